@@ -0,0 +1,378 @@
+# app/bundle_extraction.py
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+from functools import lru_cache
+import logging
+
+from .screener_rules import ScreenerRules, NO_DECISION, registry
+from .metrics import StageTimer
+
+logger = logging.getLogger(__name__)
+
+SAFETY_SCORE_QUESTION = "95614-4"  # Calculated total, not an answered question
+HIGH_RISK_THRESHOLD = 11
+
+# Answer-text patterns the web table falls back on for answers no ruleset covers
+POSITIVE_TEXT_PATTERNS = [
+    "worried", "threatened", "shut off", "didn't last", "run out",
+    "lack of", "help finding", "help keeping", "yes"
+]
+
+# Resource types extracted, and the extraction list each one lands in
+RESOURCE_LISTS = {"Patient": "patients", "Organization": "organizations", "QuestionnaireResponse": "screenings"}
+
+def reference_type_id(reference: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(ResourceType, id) of a relative or absolute literal reference; None for urn: references"""
+    if not reference or reference.startswith("urn:"):
+        return None
+    parts = reference.split("/_history/")[0].rstrip("/").split("/")
+    if len(parts) < 2 or not parts[-2] or not parts[-1]:
+        return None
+    return parts[-2], parts[-1]
+
+class ReferenceIndex:
+    """Every entry of one bundle, addressable the ways FHIR references point at it
+
+    Each entry is registered under its fullUrl (including urn:uuid: and
+    urn:oid: fullUrls) and under ResourceType/id, so resolving a reference
+    inside the bundle is one dict probe whatever form it takes and
+    wherever the target sits in the entry list.
+    """
+
+    def __init__(self):
+        self.targets: Dict[str, Tuple[str, int]] = {}
+
+    def add(self, full_url: Optional[str], resource_type: str, resource_id: Optional[str], position: int):
+        target = (resource_type, position)
+        if full_url:
+            self.targets[full_url] = target
+        if resource_id:
+            self.targets[f"{resource_type}/{resource_id}"] = target
+
+    def resolve(self, reference: Optional[str]) -> Optional[Tuple[str, int]]:
+        """(ResourceType, position in its extraction list), or None if the target is outside the bundle"""
+        if not reference:
+            return None
+        target = self.targets.get(reference)
+        if target is None:
+            type_id = reference_type_id(reference)
+            if type_id:
+                target = self.targets.get("/".join(type_id))
+        return target
+
+def extract_bundle(bundle: Dict[str, Any], rules: Optional[ScreenerRules] = None,
+                   timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+    """Walk a FHIR bundle once into everything the table view and the DB save need
+
+    Each Patient, QuestionnaireResponse and Organization is parsed once.
+    Every answer is decoded and scored once against the compiled screener
+    rules - `rules` when given, otherwise the registry's ruleset for the
+    response's questionnaire - carrying both the table's fields
+    (answer_value, is_positive) and the DB's (answer_text, mapped,
+    positive). table_projection() and the processors' process_extraction()
+    then only read the result.
+
+    Screening subjects are resolved through a ReferenceIndex once the
+    whole bundle is indexed, so a QuestionnaireResponse may come before
+    its Patient and may reference it by fullUrl (urn:uuid:) or
+    Patient/id. `subject_patient` is the position of the subject in
+    `patients`, or None when it lives outside the bundle.
+
+    A metrics.StageTimer, when given, is lapped at "validate" after the
+    walk and at "resolve" after the subjects are resolved.
+    """
+    extraction = {
+        "bundle_id": bundle.get("id"),
+        "type": bundle.get("type"),
+        "entry_count": len(bundle.get("entry", [])),
+        "patients": [],
+        "screenings": [],
+        "organizations": []
+    }
+
+    references = ReferenceIndex()
+
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource", {})
+        resource_type = resource.get("resourceType")
+        list_name = RESOURCE_LISTS.get(resource_type)
+        if list_name is None:
+            continue
+        references.add(entry.get("fullUrl"), resource_type, resource.get("id"), len(extraction[list_name]))
+
+        if resource_type == "Patient":
+            extraction["patients"].append(extract_patient(resource))
+        elif resource_type == "QuestionnaireResponse":
+            screening_rules = rules or registry.for_questionnaire(resource.get("questionnaire"))
+            extraction["screenings"].append(extract_screening(resource, screening_rules))
+        elif resource_type == "Organization":
+            extraction["organizations"].append(extract_organization(resource))
+
+    if timer is not None:
+        timer.lap("validate")
+
+    for screening in extraction["screenings"]:
+        resolve_subject(screening, references, extraction["patients"])
+
+    if timer is not None:
+        timer.lap("resolve")
+    return extraction
+
+def resolve_subject(screening: Dict[str, Any], references: ReferenceIndex, patients: List[Dict[str, Any]]):
+    """Point a screening at its Patient in the bundle, or at the Patient id to look up outside it"""
+    target = references.resolve(screening["subject_reference"])
+    if target is not None and target[0] == "Patient":
+        screening["subject_patient"] = target[1]
+        screening["member_fhir_id"] = patients[target[1]]["fhir_id"]
+        return
+    type_id = reference_type_id(screening["subject_reference"])
+    screening["subject_patient"] = None
+    screening["member_fhir_id"] = type_id[1] if type_id and type_id[0] == "Patient" else None
+
+def _address_parts(addresses: List[Dict]) -> Dict[str, str]:
+    if not addresses:
+        return {"address": "", "address_line1": "", "city": "", "state": "", "zip_code": ""}
+
+    addr = addresses[0]
+    lines = addr.get("line", [])
+    if lines and not isinstance(lines, list):
+        lines = [str(lines)]
+    parts = list(lines or [])
+    for field in ("city", "state", "postalCode"):
+        if addr.get(field):
+            parts.append(addr[field])
+    return {
+        "address": ", ".join(parts),
+        "address_line1": lines[0] if lines else "",
+        "city": addr.get("city", ""),
+        "state": addr.get("state", ""),
+        "zip_code": addr.get("postalCode", "")
+    }
+
+def _phone(telecoms: List[Dict]) -> str:
+    for telecom in telecoms:
+        if telecom.get("system") == "phone":
+            return telecom.get("value", "")
+    return ""
+
+def extract_patient(patient: Dict[str, Any]) -> Dict[str, Any]:
+    """Patient fields for both the member table row and the Member record"""
+    first_name = ""
+    last_name = ""
+    name_data = patient.get("name")
+    if name_data:
+        name = name_data[0] if isinstance(name_data, list) else name_data
+        given = name.get("given", [])
+        if given:
+            first_name = " ".join(given) if isinstance(given, list) else str(given)
+        last_name = name.get("family", "")
+
+    birth_date = patient.get("birthDate")
+    date_of_birth = None
+    if birth_date:
+        try:
+            date_of_birth = datetime.strptime(birth_date, "%Y-%m-%d")
+        except ValueError:
+            pass
+
+    return {
+        "fhir_id": patient.get("id"),
+        "name": f"{first_name} {last_name}".strip(),
+        "first_name": first_name,
+        "last_name": last_name,
+        "gender": patient.get("gender"),
+        "birth_date": birth_date,
+        "date_of_birth": date_of_birth,
+        "phone": _phone(patient.get("telecom", [])),
+        **_address_parts(patient.get("address", []))
+    }
+
+@lru_cache(maxsize=1024)
+def is_positive_text(answer_value: Optional[str]) -> bool:
+    """Text-based positive screen for answers outside the screener rules"""
+    if not answer_value:
+        return False
+    answer_lower = answer_value.lower()
+    return any(pattern in answer_lower for pattern in POSITIVE_TEXT_PATTERNS)
+
+def extract_screening(response: Dict[str, Any], rules: ScreenerRules) -> Dict[str, Any]:
+    """One QuestionnaireResponse, decoded and scored in a single walk of its items"""
+    subject_ref = response.get("subject", {}).get("reference", "")
+    authored = response.get("authored")
+    screening_date = None
+    if authored:
+        try:
+            screening_date = datetime.fromisoformat(authored.replace("Z", "+00:00"))
+        except ValueError:
+            pass
+
+    answers = []
+    answered_questions = set()
+    mapped_items = 0
+    safety_score = 0
+    positive_screens = 0
+    positive_answers_count = 0
+    positive_category_bits = 0
+    decisions = rules.decisions
+
+    for item in response.get("item", []):
+        question_code = item.get("linkId")
+        question_text = item.get("text", "")
+        mapped = question_code in rules.questions
+
+        # Unique questions answered, excluding the calculated safety total
+        if question_code and item.get("answer") and question_code != SAFETY_SCORE_QUESTION:
+            answered_questions.add(question_code)
+        if mapped:
+            mapped_items += 1
+
+        for answer in item.get("answer", []):
+            answer_code = None
+            answer_value = None
+            answer_text = ""
+            if "valueCoding" in answer:
+                answer_code = answer["valueCoding"].get("code")
+                answer_value = answer["valueCoding"].get("display", answer_code)
+                answer_text = answer["valueCoding"].get("display", answer_code or "")
+            elif "valueString" in answer:
+                answer_value = answer_text = answer["valueString"]
+            elif "valueInteger" in answer:
+                answer_value = answer_text = str(answer["valueInteger"])
+            elif "valueBoolean" in answer:
+                answer_value = answer_text = "Yes" if answer["valueBoolean"] else "No"
+
+            if mapped and answer_code:
+                score, positive, category_bits, _ = decisions.get((question_code, answer_code), NO_DECISION)
+                safety_score += score
+                if positive:
+                    positive_answers_count += 1
+                    positive_category_bits |= category_bits
+                is_positive = positive
+            else:
+                score, positive = 0, False
+                is_positive = is_positive_text(answer_value)
+            if answer_value and is_positive:
+                positive_screens += 1
+
+            answers.append({
+                "question_code": question_code,
+                "question_text": question_text,
+                "answer_code": answer_code,
+                "answer_value": answer_value,
+                "answer_text": answer_text,
+                "safety_score": score,
+                "is_positive": is_positive,
+                "mapped": mapped,
+                "positive": positive
+            })
+
+    return {
+        "session_id": response.get("id"),
+        "subject_reference": subject_ref,
+        "subject_patient": None,  # Set by resolve_subject()
+        "member_fhir_id": None,
+        "authored": authored,
+        "screening_date": screening_date,
+        "status": response.get("status"),
+        "questionnaire": response.get("questionnaire", ""),
+        "screener": rules.key,
+        "questions_answered": len(answered_questions),
+        "mapped_items": mapped_items,
+        "total_safety_score": safety_score,
+        "positive_screens": positive_screens,
+        "positive_answers": positive_answers_count,
+        "positive_categories": rules.category_names(positive_category_bits),
+        "answers": answers
+    }
+
+def _organization_type(types: List[Dict]) -> Dict[str, str]:
+    if not types:
+        return {"display": "", "code": ""}
+    type_obj = types[0]
+    if type_obj.get("coding"):
+        coding = type_obj["coding"][0]
+        return {"display": coding.get("display", coding.get("code", "")), "code": coding.get("code", "")}
+    return {"display": type_obj.get("text", ""), "code": ""}
+
+def extract_organization(org: Dict[str, Any]) -> Dict[str, Any]:
+    """Organization fields for both the table row and the Organization record"""
+    org_type = _organization_type(org.get("type", []))
+    return {
+        "fhir_id": org.get("id"),
+        "name": org.get("name"),
+        "type": org_type["display"],
+        "type_code": org_type["code"],
+        "phone": _phone(org.get("telecom", [])),
+        "active": org.get("active", True),
+        **_address_parts(org.get("address", []))
+    }
+
+def calculate_summary(screenings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Table-view summary of the bundle's first screening"""
+    if not screenings:
+        return {}
+
+    screening = screenings[0]  # Assuming one screening session per bundle
+    return {
+        "total_safety_score": screening.get("total_safety_score", 0),
+        "high_risk": screening.get("total_safety_score", 0) >= HIGH_RISK_THRESHOLD,
+        "positive_screens": screening.get("positive_screens", 0),
+        "questions_answered": screening.get("questions_answered", 0),
+        "completion_rate": round((screening.get("questions_answered", 0) / 12) * 100, 1)
+    }
+
+def table_projection(extraction: Dict[str, Any]) -> Dict[str, Any]:
+    """The web interface's table format (members, screenings, responses, organizations, summary)"""
+    members = [{
+        "member_id": patient["fhir_id"],
+        "name": patient["name"],
+        "gender": patient["gender"],
+        "birth_date": patient["birth_date"],
+        "address": patient["address"],
+        "phone": patient["phone"],
+        "created_at": datetime.utcnow().isoformat()
+    } for patient in extraction["patients"]]
+
+    screenings = []
+    responses = []
+    for screening in extraction["screenings"]:
+        screenings.append({
+            "session_id": screening["session_id"],
+            "member_id": screening["member_fhir_id"] or screening["subject_reference"],
+            "screening_date": screening["authored"] or datetime.utcnow().isoformat(),
+            "status": screening["status"],
+            "questionnaire": screening["questionnaire"],
+            "screener": screening["screener"],
+            "total_safety_score": screening["total_safety_score"],
+            "questions_answered": screening["questions_answered"],
+            "positive_screens": screening["positive_screens"]
+        })
+        for answer in screening["answers"]:
+            if not answer["answer_value"]:
+                continue
+            responses.append({
+                "session_id": screening["session_id"],
+                "question_code": answer["question_code"],
+                "question_text": answer["question_text"],
+                "answer_code": answer["answer_code"],
+                "answer_value": answer["answer_value"],
+                "safety_score": answer["safety_score"],
+                "is_positive": answer["is_positive"]
+            })
+
+    organizations = [{
+        "organization_id": org["fhir_id"],
+        "name": org["name"],
+        "type": org["type"],
+        "address": org["address"],
+        "phone": org["phone"],
+        "active": org["active"]
+    } for org in extraction["organizations"]]
+
+    return {
+        "members": members,
+        "screenings": screenings,
+        "responses": responses,
+        "organizations": organizations,
+        "summary": calculate_summary(screenings)
+    }
@@ -0,0 +1,104 @@
+# app/bundle_log.py
+from typing import Dict, Any, List, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import logging
+
+from .models import BundleProcessingLog
+from .metrics import INGEST_STAGES, StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Columns /admin/slow-bundles can rank by: a stage, or the whole ingest
+RANK_COLUMNS = {**{stage: f"{stage}_ms" for stage in INGEST_STAGES}, "total": "duration_ms"}
+
+# Added to bundle_processing_logs after the table first shipped
+TIMING_COLUMNS = [*RANK_COLUMNS.values(), "query_count"]
+
+def add_timing_columns(engine):
+    """Add the timing columns to a bundle_processing_logs table created before them
+
+    create_all never alters an existing table. Runs at every start; on
+    PostgreSQL the IF NOT EXISTS forms let several workers start at once.
+    """
+    table = BundleProcessingLog.__table__
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    missing = [name for name in TIMING_COLUMNS if name not in existing]
+    if not missing:
+        return
+    if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+    with engine.begin() as conn:
+        for name in missing:
+            column_type = table.c[name].type.compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{name} {column_type}"))
+        for index in table.indexes:
+            columns = [column.name for column in index.columns]
+            if set(columns) & set(missing):
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON {table.name} ({', '.join(columns)})"))
+    logger.info(f"Added {', '.join(missing)} to {table.name}")
+
+def record_processing(db: Session, bundle: Dict[str, Any], processing_id: str, timer: StageTimer,
+                      received_at: datetime, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[Exception] = None):
+    """Save one bundle's BundleProcessingLog row with its stage timings and query count
+
+    Runs after the bundle's own transaction committed or rolled back, so a
+    failure here never costs the ingest itself.
+    """
+    try:
+        durations = {f"{stage}_ms": round(timer.durations.get(stage, 0.0) * 1000, 3) for stage in INGEST_STAGES}
+        result = result or {}
+        db.add(BundleProcessingLog(
+            bundle_id=bundle.get("id") or "unknown",
+            processing_id=processing_id,
+            status="failed" if error is not None else "completed",
+            error_message=str(error) if error is not None else None,
+            resources_processed=len(bundle.get("entry", [])),
+            members_created=result.get("members_processed", 0),
+            screenings_created=result.get("screenings_processed", 0),
+            started_at=received_at,
+            completed_at=datetime.utcnow(),
+            duration_ms=round(sum(durations.values()), 3),
+            query_count=timer.queries,
+            **durations
+        ))
+        db.commit()
+    except Exception as e:
+        logger.error(f"Could not record processing log for {processing_id}: {e}")
+        db.rollback()
+
+def slowest_stage(log: BundleProcessingLog) -> Optional[str]:
+    timings = {stage: getattr(log, f"{stage}_ms") or 0.0 for stage in INGEST_STAGES}
+    return max(timings, key=timings.get) if any(timings.values()) else None
+
+def slow_bundles(db: Session, stage: str = "total", limit: int = 20, hours: int = 24) -> Dict[str, Any]:
+    """The bundles that spent longest in `stage` (or in total) over the last `hours`"""
+    column = getattr(BundleProcessingLog, RANK_COLUMNS[stage])
+    since = datetime.utcnow() - timedelta(hours=hours)
+    logs: List[BundleProcessingLog] = (
+        db.query(BundleProcessingLog)
+        .filter(BundleProcessingLog.started_at >= since, column.isnot(None))
+        .order_by(column.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "stage": stage,
+        "since": since.isoformat(),
+        "bundles": [{
+            "bundle_id": log.bundle_id,
+            "processing_id": log.processing_id,
+            "status": log.status,
+            "error_message": log.error_message,
+            "started_at": log.started_at,
+            "completed_at": log.completed_at,
+            "duration_ms": log.duration_ms,
+            "stages_ms": {stage_name: getattr(log, f"{stage_name}_ms") for stage_name in INGEST_STAGES},
+            "slowest_stage": slowest_stage(log),
+            "query_count": log.query_count,
+            "resources_processed": log.resources_processed,
+            "members_created": log.members_created,
+            "screenings_created": log.screenings_created
+        } for log in logs]
+    }
@@ -0,0 +1,177 @@
+# app/bundle_partition.py
+from typing import Dict, Any, List, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+import contextvars
+import logging
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Result counters summed across partitions
+RESULT_COUNTERS = ("members_processed", "screenings_processed", "organizations_processed")
+
+# Postgres SQLSTATEs of a lost race with a concurrent partition:
+# serialization failure, deadlock, lock not available, unique violation
+CONTENTION_PGCODES = {"40001", "40P01", "55P03", "23505"}
+
+class PartialBundleError(Exception):
+    """Some partitions of a bundle were saved and at least one was not
+
+    `result` is the merged result of the partitions that committed, with
+    status 'partial' and the errors of the ones that did not.
+    """
+
+    def __init__(self, message: str, result: Dict[str, Any]):
+        super().__init__(message)
+        self.result = result
+
+def is_contention(error: Exception) -> bool:
+    """Whether a partition failed on another partition's locks or rows, and may succeed if replayed"""
+    if isinstance(error, (OperationalError, IntegrityError)):
+        return True
+    if isinstance(error, DBAPIError):
+        return getattr(error.orig, "pgcode", None) in CONTENTION_PGCODES
+    return False
+
+def should_partition(extraction: Dict[str, Any], db: Session, workers: int = None) -> bool:
+    """Whether a bundle is big enough, and the database able, to be saved concurrently"""
+    workers = settings.BUNDLE_WORKERS if workers is None else workers
+    if workers < 2 or len(extraction["patients"]) < settings.BUNDLE_PARALLEL_MIN_PATIENTS:
+        return False
+    # SQLite has a single writer; concurrent partitions would only queue on its lock
+    return db is not None and db.get_bind().dialect.name != "sqlite"
+
+def partition_extraction(extraction: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Split an extraction into independent per-patient subgraphs
+
+    Each partition holds one Patient and the QuestionnaireResponses whose
+    subject resolved to it; screenings of patients outside the bundle are
+    grouped by member. No two partitions write the same member's rows.
+    """
+    partitions = [{"key": patient["zip_code"] or patient["fhir_id"], "patients": [patient], "screenings": []}
+                  for patient in extraction["patients"]]
+    external: Dict[Any, Dict[str, Any]] = {}
+    for screening in extraction["screenings"]:
+        if screening["subject_patient"] is not None:
+            partitions[screening["subject_patient"]]["screenings"].append(screening)
+        else:
+            key = screening["member_fhir_id"]
+            external.setdefault(key, {"key": key or "", "patients": [], "screenings": []})["screenings"].append(screening)
+    return partitions + list(external.values())
+
+def plan_chunks(extraction: Dict[str, Any], partitions: List[Dict[str, Any]], chunks: int) -> List[Dict[str, Any]]:
+    """Pack partitions into `chunks` extractions, one transaction each
+
+    Partitions sharing a ZIP stay in one chunk, since the screening sketch
+    and geographic rollups lock a row per ZIP and month; the biggest ZIP
+    groups are placed first, each on the lightest chunk so far.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for partition in partitions:
+        groups.setdefault(partition["key"], []).append(partition)
+
+    def size(group):
+        return sum(len(p["patients"]) + len(p["screenings"]) for p in group)
+
+    planned = [{
+        "bundle_id": extraction["bundle_id"],
+        "type": extraction["type"],
+        "entry_count": 0,
+        "patients": [],
+        "screenings": [],
+        "organizations": []
+    } for _ in range(max(1, min(chunks, len(groups))))]
+    loads = [0] * len(planned)
+
+    for group in sorted(groups.values(), key=size, reverse=True):
+        target = loads.index(min(loads))
+        chunk = planned[target]
+        for partition in group:
+            offset = len(chunk["patients"])
+            chunk["patients"].extend(partition["patients"])
+            for screening in partition["screenings"]:
+                if screening["subject_patient"] is not None:
+                    # Re-point the subject at the patient's slot in this chunk
+                    screening = dict(screening, subject_patient=offset)
+                chunk["screenings"].append(screening)
+        loads[target] += size(group)
+        chunk["entry_count"] = len(chunk["patients"]) + len(chunk["screenings"])
+    return planned
+
+def merge_results(bundle_id: str, results: List[Dict[str, Any]], errors: List[str], chunks: int) -> Dict[str, Any]:
+    merged = {"bundle_id": bundle_id, **{counter: 0 for counter in RESULT_COUNTERS}}
+    for result in results:
+        for counter in RESULT_COUNTERS:
+            merged[counter] += result.get(counter, 0)
+        if result.get("screenings_skipped"):
+            merged.setdefault("screenings_skipped", []).extend(result["screenings_skipped"])
+    merged["partitions"] = chunks
+    merged["status"] = "partial" if errors else "completed"
+    if errors:
+        merged["errors"] = errors
+    return merged
+
+def process_partitioned(process: Callable[[Dict[str, Any], Session], Dict[str, Any]],
+                        extraction: Dict[str, Any], session_factory: Callable[[], Session],
+                        workers: int = None) -> Dict[str, Any]:
+    """Save an extraction as concurrent per-patient partitions, merged into one result
+
+    `process` is a processor's process_extraction(extraction, db); each
+    chunk runs it on its own session and connection and commits on its
+    own. Organizations are shared by every patient, so they are saved
+    first. A chunk that lost a race on a shared row (a deadlock, lock
+    timeout or duplicate key) is replayed once after the others finish;
+    any other error is the data's fault and is not. If nothing was saved
+    the error is raised as-is; if only some chunks were, a
+    PartialBundleError carries the merged result.
+    """
+    workers = settings.BUNDLE_WORKERS if workers is None else workers
+
+    def run(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        db = session_factory()
+        try:
+            return process(chunk, db)
+        finally:
+            db.close()
+
+    results = []
+    if extraction["organizations"]:
+        results.append(run(dict(extraction, patients=[], screenings=[])))
+
+    chunks = plan_chunks(extraction, partition_extraction(extraction), workers)
+    failed = []
+    errors = []
+    last_error = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bundle-partition") as pool:
+        # Each chunk runs in a copy of this context, so a bundle's StageTimer still counts its statements
+        futures = {pool.submit(contextvars.copy_context().run, run, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if is_contention(e):
+                    logger.warning(f"Bundle {extraction['bundle_id']} partition lost a race, will replay: {e}")
+                    failed.append(futures[future])
+                else:
+                    logger.error(f"Bundle {extraction['bundle_id']} partition failed: {e}")
+                    errors.append(str(e))
+                    last_error = e
+
+    for chunk in failed:
+        try:
+            results.append(run(chunk))
+        except Exception as e:
+            logger.error(f"Bundle {extraction['bundle_id']} partition failed on replay: {e}")
+            errors.append(str(e))
+            last_error = e
+
+    if last_error is not None and len(errors) == len(chunks) and not extraction["organizations"]:
+        raise last_error
+    merged = merge_results(extraction["bundle_id"], results, errors, len(chunks))
+    if errors:
+        raise PartialBundleError(f"{len(errors)} of {len(chunks)} partitions of bundle "
+                                 f"{extraction['bundle_id']} failed: {errors[0]}", merged)
+    return merged
@@ -0,0 +1,178 @@
+# app/cache.py
+from typing import Dict, Any, Optional, Callable
+from collections import OrderedDict
+from fastapi import Request
+from fastapi.responses import Response
+import hashlib
+import logging
+import secrets
+import threading
+
+from .config import settings
+from .json_codec import dumps
+
+logger = logging.getLogger(__name__)
+
+class CacheBackend:
+    """Storage interface for the analytics response cache
+
+    Backends hold serialized response bodies plus the data-generation
+    number. Every ingest commit bumps the generation, and because the
+    generation is part of each cache key, stale entries are never read
+    again and simply age out of the backend.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def get_generation(self) -> int:
+        raise NotImplementedError
+
+    def bump_generation(self) -> int:
+        raise NotImplementedError
+
+class LRUCacheBackend(CacheBackend):
+    """In-process LRU backend (default)
+
+    The generation lives in this process only, so with several uvicorn
+    workers an ingest handled by one worker does not invalidate the
+    others, and neither does a backfill CLI run in its own process. Use
+    the Redis backend when running more than one worker. The generation
+    starts at a random value, so an ETag handed out before a restart, or
+    by another worker, never matches here and cannot earn a stale 304.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._generation = secrets.randbits(48)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def bump_generation(self) -> int:
+        with self._lock:
+            self._generation += 1
+            # Entries from older generations can never be hit again
+            self._entries.clear()
+            return self._generation
+
+class RedisCacheBackend(CacheBackend):
+    """Shared backend so every worker sees the same data generation"""
+
+    GENERATION_KEY = "hrsn:cache:generation"
+
+    def __init__(self, url: str, ttl_seconds: int = 3600, prefix: str = "hrsn:cache:"):
+        import redis  # Optional dependency, only needed for the shared backend
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set(self.prefix + key, value, ex=self.ttl_seconds)
+
+    def get_generation(self) -> int:
+        value = self.client.get(self.GENERATION_KEY)
+        return int(value) if value else 0
+
+    def bump_generation(self) -> int:
+        return int(self.client.incr(self.GENERATION_KEY))
+
+class ResponseCache:
+    """Versioned JSON response cache keyed by endpoint, params and data generation"""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    def make_key(self, endpoint: str, params: Dict[str, Any], generation: int) -> str:
+        """Build a stable cache key for an endpoint call"""
+        param_string = "&".join(f"{k}={params[k]}" for k in sorted(params))
+        digest = hashlib.sha1(f"{endpoint}?{param_string}".encode("utf-8")).hexdigest()
+        return f"{generation}:{digest}"
+
+    def make_etag(self, key: str) -> str:
+        """ETag derived from the key, so a 304 never needs the cached body"""
+        return f'W/"{key}"'
+
+    def bump_generation(self) -> int:
+        """Invalidate every cached response; call after each ingest commit"""
+        try:
+            generation = self.backend.bump_generation()
+            logger.info(f"Response cache generation bumped to {generation}")
+            return generation
+        except Exception as e:
+            logger.error(f"Failed to bump response cache generation: {e}")
+            return -1
+
+    def respond(self, request: Request, endpoint: str, compute: Callable[[], Any],
+                params: Optional[Dict[str, Any]] = None) -> Response:
+        """Serve a cached JSON response, honouring If-None-Match"""
+        if params is None:
+            params = dict(request.query_params)
+
+        try:
+            generation = self.backend.get_generation()
+        except Exception as e:
+            # Cache backend unavailable - fall back to computing directly
+            logger.warning(f"Response cache unavailable for {endpoint}: {e}")
+            return self._json_response(compute(), headers={"X-Cache": "bypass"})
+
+        key = self.make_key(endpoint, params, generation)
+        etag = self.make_etag(key)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "private, no-cache"
+        }
+
+        # Browser already holds the current version
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        body = self.backend.get(key)
+        if body is not None:
+            headers["X-Cache"] = "hit"
+            return Response(content=body, media_type="application/json", headers=headers)
+
+        body = self._serialize(compute())
+        self.backend.set(key, body)
+        headers["X-Cache"] = "miss"
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def _serialize(self, data: Any) -> bytes:
+        return dumps(data)
+
+    def _json_response(self, data: Any, headers: Dict[str, str]) -> Response:
+        return Response(content=self._serialize(data), media_type="application/json", headers=headers)
+
+def create_backend() -> CacheBackend:
+    """Build the backend selected by CACHE_BACKEND"""
+    if settings.CACHE_BACKEND == "redis":
+        try:
+            return RedisCacheBackend(settings.REDIS_URL, ttl_seconds=settings.CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.error(f"Redis cache backend unavailable, using in-process LRU: {e}")
+    return LRUCacheBackend(max_entries=settings.CACHE_MAX_ENTRIES)
+
+response_cache = ResponseCache(create_backend())
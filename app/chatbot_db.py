@@ -0,0 +1,464 @@
+# app/chatbot_db.py
+from typing import Dict, Any, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, event
+from datetime import datetime, timedelta
+import json
+import logging
+
+from .models import Member, ScreeningSession, ScreeningResponse, MemberConditionFlags, ChatbotAggregate
+from .config import settings
+from .cache import response_cache
+from .member_store import CONDITION_CATEGORIES, CONDITIONS, SAFETY_THRESHOLD
+from .geo import UPSERT_INSERTS, positive_categories
+from .chatbot_router import route_question, describe_slots
+
+logger = logging.getLogger(__name__)
+
+AGGREGATES = CONDITIONS + ["screened_members", "screenings"]
+
+CONDITION_ANSWERS = {
+    "food": ("Food Insecurity Analysis", "have food insecurity issues", "food_insecurity"),
+    "housing": ("Housing Issues Analysis", "have housing-related concerns", "housing_issues"),
+    "transportation": ("Transportation Issues Analysis", "have transportation barriers", "transportation_issues"),
+    "utilities": ("Utility Issues Analysis", "have had utilities threatened or shut off", "utility_issues"),
+    "employment": ("Employment Needs Analysis", "want help finding or keeping work", "employment_needs"),
+    "safety": ("Safety Concerns Analysis", "have high safety risk (score ≥11)", "safety_concerns")
+}
+
+def conditions_for_categories(categories: Set[str]) -> Set[str]:
+    """Chatbot conditions flagged by a screening's positive SDOH categories"""
+    return {condition for condition, condition_categories in CONDITION_CATEGORIES.items()
+            if condition_categories & categories}
+
+PENDING_AGGREGATES = "chatbot_aggregate_deltas"
+SAVEPOINT_AGGREGATES = "chatbot_aggregate_savepoints"
+
+def _adjust(db: Session, name: str, delta: int):
+    """Queue a counter change, applied when the session's transaction commits
+
+    The counters are a handful of rows every ingest touches. Applied at
+    commit, in one upsert, they are locked for the commit alone rather
+    than for the whole ingest transaction, and a counter's first insert
+    cannot race another session's.
+    """
+    if PENDING_AGGREGATES not in db.info:
+        _watch_session(db)
+    if not db.in_transaction():
+        db.begin()  # Else a rollback before the first statement would keep the queue
+    pending = db.info[PENDING_AGGREGATES]
+    pending[name] = pending.get(name, 0) + delta
+
+def _watch_session(db: Session):
+    db.info[PENDING_AGGREGATES] = {}
+    # Savepoints already open hold no changes yet
+    transaction = db.get_nested_transaction()
+    while transaction is not None and transaction.nested:
+        db.info.setdefault(SAVEPOINT_AGGREGATES, {})[transaction] = {}
+        transaction = transaction.parent
+    event.listen(db, "before_commit", _apply_aggregate_deltas)
+    event.listen(db, "after_transaction_create", _snapshot_aggregate_deltas)
+    event.listen(db, "after_soft_rollback", _discard_aggregate_deltas)
+
+def _apply(db: Session, deltas: Dict[str, int]):
+    """Add each delta to its counter, in a single upsert where the dialect has one"""
+    insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        # Locked in name order, so concurrent commits cannot deadlock
+        for name in sorted(deltas):
+            row = db.query(ChatbotAggregate).filter(ChatbotAggregate.name == name).with_for_update().first()
+            if not row:
+                row = ChatbotAggregate(name=name, value=0)
+                db.add(row)
+            row.value = (row.value or 0) + deltas[name]
+        db.flush()
+        return
+
+    statement = insert(ChatbotAggregate).values([{"name": name, "value": deltas[name]} for name in sorted(deltas)])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"value": func.coalesce(ChatbotAggregate.value, 0) + statement.excluded.value}
+    ))
+
+def _apply_aggregate_deltas(db: Session):
+    if db.in_nested_transaction():
+        return
+    db.info.pop(SAVEPOINT_AGGREGATES, None)
+    pending = db.info[PENDING_AGGREGATES]
+    deltas = {name: delta for name, delta in pending.items() if delta}
+    pending.clear()
+    if deltas:
+        _apply(db, deltas)
+
+def _snapshot_aggregate_deltas(db: Session, transaction):
+    if transaction.nested:
+        db.info.setdefault(SAVEPOINT_AGGREGATES, {})[transaction] = dict(db.info[PENDING_AGGREGATES])
+
+def _discard_aggregate_deltas(db: Session, previous_transaction):
+    pending = db.info[PENDING_AGGREGATES]
+    if not previous_transaction.nested:
+        pending.clear()
+        db.info.pop(SAVEPOINT_AGGREGATES, None)
+        return
+    # A rolled-back savepoint drops only the changes queued inside it
+    snapshot = db.info.get(SAVEPOINT_AGGREGATES, {}).pop(previous_transaction, None)
+    if snapshot is not None:
+        pending.clear()
+        pending.update(snapshot)
+
+def _flag_set(flags: MemberConditionFlags) -> Set[str]:
+    return {condition for condition in CONDITIONS if getattr(flags, condition)}
+
+def record_screening_flags(db: Session, member_id, screening, categories: Set[str]):
+    """Fold a newly ingested screening into the member's condition flags
+
+    Runs inside the ingest transaction. Condition flags accumulate over all
+    of a member's screenings; the safety flag follows the latest screening
+    by date. Aggregate counters move only when a flag actually changes.
+    """
+    flags = db.query(MemberConditionFlags).filter(
+        MemberConditionFlags.member_id == member_id
+    ).with_for_update().first()
+    if not flags:
+        flags = MemberConditionFlags(member_id=member_id, screening_count=0,
+                                     **{condition: False for condition in CONDITIONS})
+        db.add(flags)
+        _adjust(db, "screened_members", 1)
+
+    before = _flag_set(flags)
+    flags.screening_count = (flags.screening_count or 0) + 1
+    _adjust(db, "screenings", 1)
+
+    for condition in conditions_for_categories(categories):
+        setattr(flags, condition, True)
+
+    # By screening date, not arrival: an undated screening never displaces a dated one
+    screening_date = screening.screening_date
+    if screening_date is not None and screening_date.tzinfo is not None:
+        screening_date = screening_date.replace(tzinfo=None)
+    if flags.latest_screening_date is None or (screening_date is not None
+                                               and screening_date >= flags.latest_screening_date):
+        flags.latest_screening_id = screening.id
+        flags.latest_screening_date = screening_date
+        flags.latest_safety_score = screening.total_safety_score or 0
+        flags.safety = flags.latest_safety_score >= SAFETY_THRESHOLD
+
+    after = _flag_set(flags)
+    for condition in after - before:
+        _adjust(db, condition, 1)
+    for condition in before - after:
+        _adjust(db, condition, -1)
+    db.flush()
+
+def remove_member_flags(db: Session, member_id):
+    """Drop a deleted member's flags and take them out of the aggregates"""
+    flags = db.query(MemberConditionFlags).filter(
+        MemberConditionFlags.member_id == member_id
+    ).with_for_update().first()
+    if not flags:
+        return
+    for condition in _flag_set(flags):
+        _adjust(db, condition, -1)
+    _adjust(db, "screened_members", -1)
+    _adjust(db, "screenings", -(flags.screening_count or 0))
+    db.delete(flags)
+    db.flush()
+
+def get_aggregates(db: Session) -> Dict[str, int]:
+    """All chatbot counters in one primary-key range read"""
+    values = {name: 0 for name in AGGREGATES}
+    for row in db.query(ChatbotAggregate).all():
+        values[row.name] = row.value or 0
+    return values
+
+def _apply_slots(query, slots: Dict[str, Any]):
+    """Narrow a flags-joined-to-members query by the router's slots"""
+    if slots.get("zip_code"):
+        query = query.filter(Member.zip_code.like(f"{slots['zip_code']}%"))
+    if "min_score" in slots:
+        query = query.filter(MemberConditionFlags.latest_safety_score >= slots["min_score"])
+    if "max_score" in slots:
+        query = query.filter(MemberConditionFlags.latest_safety_score <= slots["max_score"])
+    if slots.get("date_from"):
+        query = query.filter(MemberConditionFlags.latest_screening_date >= datetime.fromisoformat(slots["date_from"]))
+    if slots.get("date_to"):
+        query = query.filter(MemberConditionFlags.latest_screening_date <
+                             datetime.fromisoformat(slots["date_to"]) + timedelta(days=1))
+    return query
+
+def get_counts(db: Session, slots: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """Chatbot counters, from the aggregates or, for a filtered question, one pass over the flags"""
+    if not slots:
+        return get_aggregates(db)
+    columns = [func.count(MemberConditionFlags.id), func.sum(MemberConditionFlags.screening_count)]
+    columns += [func.sum(case((getattr(MemberConditionFlags, condition) == True, 1), else_=0))
+                for condition in CONDITIONS]
+    row = _apply_slots(db.query(*columns).join(Member, Member.id == MemberConditionFlags.member_id), slots).one()
+    counts = {"screened_members": row[0] or 0, "screenings": int(row[1] or 0)}
+    for condition, value in zip(CONDITIONS, row[2:]):
+        counts[condition] = int(value or 0)
+    return counts
+
+def _percentage(count: int, total: int) -> float:
+    return round((count / total) * 100, 1) if total > 0 else 0
+
+def _member_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    return f"{first_name or ''} {last_name or ''}".strip() or "Unknown"
+
+def _top_members(db: Session, condition: Optional[str] = None, slots: Optional[Dict[str, Any]] = None,
+                 limit: Optional[int] = None) -> List[tuple]:
+    """Highest-risk flagged members via the (flag, latest_safety_score) indexes"""
+    query = db.query(
+        Member.id, Member.fhir_id, Member.first_name, Member.last_name, Member.gender,
+        Member.date_of_birth, Member.address, MemberConditionFlags.latest_safety_score,
+        MemberConditionFlags.latest_screening_id
+    ).join(MemberConditionFlags, MemberConditionFlags.member_id == Member.id)
+    if condition:
+        query = query.filter(getattr(MemberConditionFlags, condition) == True)
+    query = _apply_slots(query, slots or {})
+    return query.order_by(
+        MemberConditionFlags.latest_safety_score.desc(), Member.id
+    ).limit(limit or settings.CHATBOT_RESULT_LIMIT).all()
+
+def _condition_answer(db: Session, condition: str, slots: Dict[str, Any]) -> Dict[str, Any]:
+    title, description, summary_name = CONDITION_ANSWERS[condition]
+    counts = get_counts(db, slots)
+    total_members = counts["screened_members"]
+    count = counts[condition]
+    percentage = _percentage(count, total_members)
+
+    member_data = []
+    for row in _top_members(db, condition, slots):
+        entry = {
+            "name": _member_name(row.first_name, row.last_name),
+            "member_id": row.fhir_id,
+            "link": f"/member/{row.fhir_id}"
+        }
+        if condition == "safety":
+            entry["safety_score"] = row.latest_safety_score or 0
+        member_data.append(entry)
+
+    summary = {
+        "total_members": total_members,
+        "affected_count": count,
+        "percentage": percentage,
+        "condition": summary_name,
+        "listed": len(member_data)
+    }
+    if condition == "safety":
+        summary["high_risk_count"] = count
+    return {
+        "answer": f"{title}:\n{count} out of {total_members} screened members{describe_slots(slots)} "
+                  f"({percentage}%) {description}.",
+        "data": member_data,
+        "summary": summary
+    }
+
+def _statistics_answer(db: Session, slots: Dict[str, Any]) -> Dict[str, Any]:
+    counts = get_counts(db, slots)
+    total_members = counts["screened_members"]
+    lines = [
+        ("High Safety Risk", "safety"), ("Food Insecurity", "food"), ("Housing Issues", "housing"),
+        ("Transportation Barriers", "transportation"), ("Utility Issues", "utilities"),
+        ("Employment Needs", "employment")
+    ]
+    answer = f"Member Database Statistics{describe_slots(slots)}:\n"
+    answer += f"• Screened Members: {total_members}\n"
+    answer += f"• Total Screenings: {counts['screenings']}\n"
+    answer += "\n".join(f"• {label}: {counts[name]} ({_percentage(counts[name], total_members)}%)"
+                        for label, name in lines)
+    return {
+        "answer": answer,
+        "data": [],
+        "summary": {
+            "total_members": total_members,
+            "total_screenings": counts["screenings"],
+            "high_risk_count": counts["safety"],
+            "food_insecurity": counts["food"],
+            "housing_issues": counts["housing"],
+            "transportation_issues": counts["transportation"],
+            "utility_issues": counts["utilities"],
+            "employment_needs": counts["employment"]
+        }
+    }
+
+def _members_answer(db: Session, slots: Dict[str, Any]) -> Dict[str, Any]:
+    total_members = get_counts(db, slots)["screened_members"]
+    member_data = [{
+        "name": _member_name(row.first_name, row.last_name),
+        "member_id": row.fhir_id,
+        "gender": row.gender or "",
+        "birth_date": row.date_of_birth.strftime("%Y-%m-%d") if row.date_of_birth else "",
+        "link": f"/member/{row.fhir_id}"
+    } for row in _top_members(db, slots=slots)]
+    return {
+        "answer": f"Screened Members{describe_slots(slots)} ({total_members} total, highest safety score first):",
+        "data": member_data,
+        "summary": {"total_members": total_members, "listed": len(member_data)}
+    }
+
+def _overview_answer(db: Session, slots: Dict[str, Any]) -> Dict[str, Any]:
+    counts = get_counts(db, slots)
+    total_members = counts["screened_members"]
+    if total_members == 0:
+        return {
+            "answer": "Database is empty. Upload some FHIR bundles to populate member data." if not slots
+                      else f"No screened members{describe_slots(slots)}.",
+            "data": [],
+            "summary": {"total_members": 0}
+        }
+
+    rows = _top_members(db, slots=slots)
+    # Latest screening details for the listed members only - one primary-key IN lookup
+    screening_ids = [row.latest_screening_id for row in rows if row.latest_screening_id]
+    screenings = {
+        s.id: s for s in db.query(
+            ScreeningSession.id, ScreeningSession.questions_answered, ScreeningSession.positive_screens_count
+        ).filter(ScreeningSession.id.in_(screening_ids)).all()
+    } if screening_ids else {}
+
+    member_overview = []
+    for row in rows:
+        screening = screenings.get(row.latest_screening_id)
+        safety_score = row.latest_safety_score or 0
+        member_overview.append({
+            "name": _member_name(row.first_name, row.last_name),
+            "member_id": row.fhir_id,
+            "gender": row.gender or "N/A",
+            "birth_date": row.date_of_birth.strftime("%Y-%m-%d") if row.date_of_birth else "N/A",
+            "address": row.address or "N/A",
+            "safety_score": safety_score,
+            "high_risk": safety_score >= SAFETY_THRESHOLD,
+            "questions_answered": screening.questions_answered if screening else 0,
+            "positive_screens": screening.positive_screens_count if screening else 0,
+            "link": f"/member/{row.fhir_id}"
+        })
+
+    answer = f"Database Overview - Highest Risk Members{describe_slots(slots)}:\n"
+    answer += f"📊 Total: {total_members} screened members, {counts['screenings']} screenings\n\n"
+    for i, member in enumerate(member_overview, 1):
+        risk_indicator = "⚠️ HIGH RISK" if member["high_risk"] else "✅ Low Risk"
+        answer += f"{i}. {member['name']} ({member['gender']}, {member['birth_date']})\n"
+        answer += f"   Safety Score: {member['safety_score']} - {risk_indicator}\n"
+        answer += f"   Questions Answered: {member['questions_answered']}/12\n"
+        answer += f"   Positive Screens: {member['positive_screens']}\n"
+        answer += f"   Address: {member['address']}\n\n"
+
+    return {
+        "answer": answer.strip(),
+        "data": member_overview,
+        "summary": {
+            "total_members": total_members,
+            "total_screenings": counts["screenings"],
+            "high_risk_count": counts["safety"],
+            "listed": len(member_overview)
+        }
+    }
+
+def _help_answer(db: Session, slots: Dict[str, Any]) -> Dict[str, Any]:
+    total_members = get_aggregates(db)["screened_members"]
+    return {
+        "answer": "I can answer questions about:\n" +
+                 "• Food insecurity: 'How many members have food insecurity?'\n" +
+                 "• Housing issues: 'Which members have housing problems?'\n" +
+                 "• Transportation: 'Tell me about transportation issues'\n" +
+                 "• Utilities and employment: 'Who has utility shutoffs?'\n" +
+                 "• Safety concerns: 'How many members have safety concerns?'\n" +
+                 "• High risk members: 'Who are the high risk members?'\n" +
+                 "• General statistics: 'Show me member statistics'\n\n" +
+                 "Narrow any question by ZIP, screening date or safety score, e.g.\n" +
+                 "'food insecure members in 10001 since 2024-01-01' or 'members with score above 8'\n\n" +
+                 f"Current database: {total_members} screened members",
+        "data": [],
+        "summary": {"total_members": total_members}
+    }
+
+INTENT_HANDLERS = {
+    "statistics": _statistics_answer,
+    "members": _members_answer,
+    "overview": _overview_answer,
+    "help": _help_answer
+}
+
+def compute_intent(db: Session, intent: str, slots: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Answer an intent, narrowed by slots, from the aggregate and flag tables"""
+    slots = slots or {}
+    if intent in CONDITION_ANSWERS:
+        result = _condition_answer(db, intent, slots)
+    else:
+        result = INTENT_HANDLERS.get(intent, _help_answer)(db, slots)
+    result["summary"]["intent"] = intent
+    if slots:
+        result["summary"]["filters"] = slots
+    return result
+
+def answer_question(db: Session, question: str) -> Tuple[Dict[str, Any], str]:
+    """Answer a chatbot question, cached per routed intent and slots until the next ingest
+
+    Returns the response and the cache status ('hit', 'miss' or 'bypass').
+    Many phrasings route to one intent and slot set, so they share a cache entry.
+    """
+    routed = route_question(question)
+    intent, slots = routed["intent"], routed["slots"]
+    try:
+        generation = response_cache.backend.get_generation()
+    except Exception as e:
+        logger.warning(f"Response cache unavailable for chatbot: {e}")
+        return compute_intent(db, intent, slots), "bypass"
+
+    key = response_cache.make_key("/api/chatbot", {"intent": intent, **slots}, generation)
+    cached = response_cache.backend.get(key)
+    if cached is not None:
+        return json.loads(cached), "hit"
+
+    result = compute_intent(db, intent, slots)
+    response_cache.backend.set(key, json.dumps(result).encode("utf-8"))
+    return result, "miss"
+
+def create_chatbot_tables(engine):
+    """Create the flag and aggregate tables for servers with their own metadata"""
+    for table in (MemberConditionFlags.__table__, ChatbotAggregate.__table__):
+        table.create(bind=engine, checkfirst=True)
+
+def rebuild_condition_flags(db: Session) -> int:
+    """Rebuild flags and aggregates from existing screenings (one-off backfill)"""
+    db.query(MemberConditionFlags).delete()
+    db.query(ChatbotAggregate).delete()
+    db.flush()
+    for name in AGGREGATES:
+        db.add(ChatbotAggregate(name=name, value=0))
+    db.flush()
+
+    count = 0
+    last_id = None
+    while True:
+        # Keyset pagination over screenings keeps the backfill in bounded memory
+        # Only columns both servers' schemas share, so this also backfills simple_main's tables
+        query = db.query(
+            ScreeningSession.id, ScreeningSession.member_id,
+            ScreeningSession.screening_date, ScreeningSession.total_safety_score
+        )
+        if last_id is not None:
+            query = query.filter(ScreeningSession.id > last_id)
+        page = query.order_by(ScreeningSession.id).limit(1000).all()
+        if not page:
+            break
+        for screening in page:
+            answers = db.query(ScreeningResponse.question_code, ScreeningResponse.answer_code).filter(
+                ScreeningResponse.screening_session_id == screening.id
+            ).all()
+            record_screening_flags(db, screening.member_id, screening, positive_categories(answers))
+            count += 1
+        last_id = page[-1].id
+    db.commit()
+    response_cache.bump_generation()
+    logger.info(f"Rebuilt chatbot condition flags from {count} screenings")
+    return count
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt chatbot condition flags from {rebuild_condition_flags(db)} screenings")
+    finally:
+        db.close()
@@ -0,0 +1,378 @@
+# app/chatbot_router.py
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, timedelta
+from calendar import monthrange
+from collections import deque
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Vocabulary term -> feature (or features). Terms match at the start of a word, so
+# "transport" also matches "transportation" but "count" does not match "account".
+VOCABULARY = {
+    # Conditions
+    "food": "food", "hunger": "food", "hungry": "food", "meal": "food",
+    "insecur": "insecure",
+    "housing": "housing", "homeless": "housing", "shelter": "housing", "evict": "housing",
+    "transport": "transportation", "ride": "transportation",
+    "utilit": "utilities", "shut off": "utilities", "shutoff": "utilities", "electric": "utilities",
+    "employ": "employment", "job": "employment", "unemploy": "employment",
+    "safety": "safety", "violence": "safety", "hurt": "safety", "abuse": "safety",
+    "risk": "safety",
+    # Question shapes
+    "how many": "count", "count": "count", "number": "count", "total": "count",
+    "who": "who", "which members": "who", "tell me": "who", "list": "who", "show me members": "who",
+    "stats": "statistics", "statistics": "statistics", "summary": "statistics", "breakdown": "statistics",
+    "database": "overview", "overview": "overview", "show all": "overview",
+    # Slot cues
+    "zip": "zip", "zipcode": "zip", "postal": "zip",
+    "since": "after", "after": "after", "from": "after", "starting": "after",
+    "before": "before", "until": "before", "through": "before", "prior to": "before",
+    "between": "between",
+    "in": "in", "during": "in",
+    "last": "last", "past": "last",
+    "day": "day", "week": "week", "month": "month",
+    "above": "above", "over": "above", "more than": "above", "greater than": "above", ">": "above",
+    "at least": "at_least", ">=": "at_least", "≥": "at_least", "or more": "or_more",
+    "or higher": "or_more", "or above": "or_more", "+": "or_more",
+    "below": "below", "under": "below", "less than": "below", "<": "below",
+    "at most": "at_most", "<=": "at_most", "≤": "at_most", "or less": "or_less", "or lower": "or_less",
+    "to": "to",
+    # A safety score is still a safety question: "members with safety score >= 11"
+    "score": "score", "safety score": ("safety", "score"), "risk score": ("safety", "score"),
+}
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august",
+          "september", "october", "november", "december"]
+MONTH_ABBREVIATIONS = {"jan": "january", "feb": "february", "mar": "march", "apr": "april", "jun": "june",
+                       "jul": "july", "aug": "august", "sep": "september", "sept": "september",
+                       "oct": "october", "nov": "november", "dec": "december"}
+MONTH_NUMBERS = {month: number for number, month in enumerate(MONTHS, start=1)}
+VOCABULARY.update({month: month for month in MONTHS})
+VOCABULARY.update(MONTH_ABBREVIATIONS)
+
+# Terms that only match as a whole word ("in" must not fire on "insecure",
+# "over" on "overview")
+WHOLE_WORDS = {"in", "to", "over", "under", "from", "last", "past", "after", "during"} | set(MONTHS) | set(MONTH_ABBREVIATIONS)
+
+# Condition intents, in the order the original keyword chain checked them
+CONDITION_PRECEDENCE = ["housing", "transportation", "utilities", "employment", "safety"]
+
+# Cues that say how the next number is used. "between" reads the next
+# value as a range start and the one after it ("range_end") as its end.
+SCORE_CUES = {"above", "at_least", "below", "at_most"}
+TRAILING_SCORE_CUES = {"or_more", "or_less"}
+DATE_CUES = {"after", "before", "in", "between"}
+CUES = SCORE_CUES | DATE_CUES | {"zip", "last"}
+WINDOW_UNITS = {"day": 1, "week": 7, "month": 30}
+
+NUMBER_TOKEN = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4})|(\d{5})(?:-\d{4})?|(\d{1,4})")
+
+class IntentRouter:
+    """Aho-Corasick automaton over the chatbot vocabulary
+
+    route() walks the question once, character by character. The automaton
+    reports every vocabulary term ending at each position, and digit runs
+    (with their - and / separators) are collected as number tokens in the
+    same loop. Intent and slots (ZIP, screening date range, safety score
+    bounds) are then decided from the ordered hits without touching the
+    question again.
+    """
+
+    def __init__(self, vocabulary: Dict[str, str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, Tuple[str, ...], bool]]] = [[]]
+
+        for term, features in vocabulary.items():
+            state = 0
+            for char in term:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            features = (features,) if isinstance(features, str) else tuple(features)
+            self.output[state].append((len(term), features, term in WHOLE_WORDS))
+
+        # Breadth-first failure links; each state inherits its fallback's outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+        # Fold the failure links into one transition table per state, so the
+        # scan is a single dict lookup per character (a missing key means root)
+        self.delta: List[Dict[str, int]] = [dict(self.goto[0])] + [None] * (len(self.goto) - 1)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.delta[state] = {**self.delta[self.fail[state]], **self.goto[state]}
+            queue.extend(self.goto[state].values())
+
+    def scan(self, text: str) -> List[Tuple[int, str, Any]]:
+        """(start, kind, value) hits in text order: ('term', feature) or ('number', token)"""
+        hits = []
+        last_term = None  # (start, end) of the last term kept
+        state = 0
+        number_start = None
+        length = len(text)
+        delta, output = self.delta, self.output
+        for position, char in enumerate(text):
+            if char.isdigit() or (number_start is not None and char in "-/" and
+                                  position + 1 < length and text[position + 1].isdigit()):
+                if number_start is None:
+                    number_start = position
+            elif number_start is not None:
+                hits.append((number_start, "number", text[number_start:position]))
+                number_start = None
+
+            state = delta[state].get(char, 0)
+            if not output[state]:
+                continue
+            # Outputs come longest first, so a term inside a longer one
+            # ("safety" in "safety score", ">" in ">=") is dropped in favour of it
+            for term_length, features, whole_word in output[state]:
+                start = position - term_length + 1
+                # Word terms must start a word; symbol terms (>=, +) match anywhere
+                if text[start].isalpha() and start > 0 and text[start - 1].isalnum():
+                    continue
+                if whole_word and position + 1 < length and text[position + 1].isalnum():
+                    continue
+                if last_term and last_term[0] <= start and position <= last_term[1]:
+                    continue
+                while hits and hits[-1][1] == "term" and hits[-1][0] >= start:
+                    hits.pop()
+                hits.extend((start, "term", feature) for feature in features)
+                last_term = (start, position)
+        if number_start is not None:
+            hits.append((number_start, "number", text[number_start:]))
+
+        # Numbers are reported when they end; order everything by where it starts
+        hits.sort(key=lambda hit: hit[0])
+        return hits
+
+    def route(self, question: str, today: Optional[date] = None) -> Dict[str, Any]:
+        """Classify and parameterize a question: {'intent': ..., 'slots': {...}}"""
+        hits = self.scan(question.strip().lower())
+        features = {value for _, kind, value in hits if kind == "term"}
+        slots = extract_slots(hits, today or date.today())
+
+        if "food" in features and "insecure" in features:
+            intent = "food"
+        else:
+            intent = next((condition for condition in CONDITION_PRECEDENCE if condition in features), None)
+        if intent is None:
+            if "count" in features:
+                intent = "food" if "food" in features else "statistics"
+            elif "who" in features:
+                intent = "food" if "food" in features else "members"
+            elif "statistics" in features:
+                intent = "statistics"
+            elif "overview" in features:
+                intent = "overview"
+            elif "food" in features:
+                intent = "food"
+            elif slots:
+                # "members in 10001", "score above 8" - a filtered member list
+                intent = "members"
+            else:
+                intent = "help"
+        return {"intent": intent, "slots": slots}
+
+def _parse_date(match) -> Optional[date]:
+    try:
+        if match.group(1):
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        if match.group(4):
+            return date(int(match.group(6)), int(match.group(4)), int(match.group(5)))
+    except ValueError:
+        return None
+    return None
+
+def _set_score(slots: Dict[str, Any], cue: str, value: int):
+    # Scores are never negative, so "below 0" is clamped to 0
+    if cue == "above":
+        slots["min_score"] = value + 1
+    elif cue in ("at_least", "or_more"):
+        slots["min_score"] = value
+    elif cue == "below":
+        slots["max_score"] = max(value - 1, 0)
+    elif cue in ("at_most", "or_less"):
+        slots["max_score"] = value
+
+def _set_period(slots: Dict[str, Any], cue: Optional[str], first: date, last: date) -> Optional[str]:
+    """Apply a year or month to the date range; the cue left for the next value"""
+    if cue in ("after", "between"):
+        slots["date_from"] = first.isoformat()
+    elif cue in ("before", "range_end"):
+        slots["date_to"] = last.isoformat()
+    else:
+        # "in 2024", "during march 2024": the whole period
+        slots["date_from"] = first.isoformat()
+        slots["date_to"] = last.isoformat()
+    return "range_end" if cue == "between" else None
+
+def _month_period(year: int, month: int) -> Tuple[date, date]:
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+def _latest_years(months: List[int], today: date) -> List[int]:
+    """Years for yearless months: the last is its latest occurrence up to
+    today, and each earlier one its latest occurrence before the next"""
+    years = []
+    year, following = today.year, today.month
+    for month in reversed(months):
+        if month > following:
+            year -= 1
+        years.append(year)
+        following = month
+    return years[::-1]
+
+def extract_slots(hits: List[Tuple[int, str, Any]], today: date) -> Dict[str, Any]:
+    """Slots from scanned hits, reading each number with the cue terms around it
+
+    Comparisons only become score bounds once a score word has been seen
+    ("members over 65" is not a score filter). A month name takes the year
+    that follows it; without one it needs a date cue ("in march") and
+    means its latest occurrence up to today.
+    """
+    slots: Dict[str, Any] = {}
+    cue = None
+    score_context = False
+    pending = None  # (number, role) waiting on a trailing term: "8 or more", "30 days"
+    months: List[int] = []  # month names waiting on a year: "march 2024", "between jan and mar 2024"
+
+    def settle():
+        # A score with no trailing modifier ("score of 11") means at least that
+        nonlocal pending
+        if pending is not None and pending[1] == "score":
+            slots.setdefault("min_score", pending[0])
+        pending = None
+
+    def settle_months(year: Optional[int] = None):
+        nonlocal cue
+        if months and (year is not None or cue in DATE_CUES | {"range_end"}):
+            years = [year] * len(months) if year is not None else _latest_years(months, today)
+            for month, month_year in zip(months, years):
+                cue = _set_period(slots, cue, *_month_period(month_year, month))
+        months.clear()
+
+    for _, kind, value in hits:
+        if kind == "term":
+            if value in MONTH_NUMBERS:
+                settle()
+                months.append(MONTH_NUMBERS[value])
+                continue
+            if value == "to" and months and cue == "after":
+                # "from jan to mar": read the months together, like "between"
+                cue = "between"
+                continue
+            settle_months()
+            if pending is not None:
+                number, role = pending
+                if role == "last" and value in WINDOW_UNITS:
+                    slots["date_from"] = (today - timedelta(days=number * WINDOW_UNITS[value])).isoformat()
+                    pending, cue = None, None
+                    continue
+                if role == "score" and value in TRAILING_SCORE_CUES:
+                    _set_score(slots, value, number)
+                    pending, cue = None, None
+                    continue
+                settle()
+            if value == "to":
+                # "from 2023 to 2024": the next value ends the range
+                if cue is None and "date_from" in slots:
+                    cue = "range_end"
+            elif value == "score":
+                score_context = True
+            elif value in CUES:
+                cue = value
+            elif value in WINDOW_UNITS and cue == "last":
+                # "last month" with no number
+                slots["date_from"] = (today - timedelta(days=WINDOW_UNITS[value])).isoformat()
+                cue = None
+            continue
+
+        settle()
+        match = NUMBER_TOKEN.fullmatch(value)
+        if not match:
+            settle_months()
+            continue
+        year = int(match.group(8)) if match.group(8) and len(match.group(8)) == 4 else None
+        if year is not None and not 1900 < year < 2200:
+            year = None
+        if months and year is not None:
+            settle_months(year)
+            continue
+        settle_months()
+        parsed_date = _parse_date(match)
+        if parsed_date:
+            # "before X" bounds the end; otherwise the first date is the start
+            # and a second one ("between X and Y", "from X to Y") the end
+            if cue in ("before", "range_end") or "date_from" in slots:
+                slots["date_to"] = parsed_date.isoformat()
+            else:
+                slots["date_from"] = parsed_date.isoformat()
+            cue = "range_end" if cue == "between" else None
+        elif match.group(7):
+            slots["zip_code"] = match.group(7)
+            cue = None
+        elif match.group(8):
+            number = int(match.group(8))
+            if year is not None and cue in DATE_CUES | {"range_end", None}:
+                # A bare year: the whole calendar year, or from/until its edge
+                cue = _set_period(slots, cue, date(year, 1, 1), date(year, 12, 31))
+            elif cue == "last":
+                pending = (number, "last")
+            elif not score_context or number > 99:
+                if cue in SCORE_CUES:
+                    cue = None
+            elif cue == "between":
+                slots["min_score"] = number
+                cue = "range_end"
+            elif cue == "range_end":
+                low = slots.get("min_score", 0)
+                slots["min_score"], slots["max_score"] = min(low, number), max(low, number)
+                cue = None
+            elif cue in SCORE_CUES:
+                _set_score(slots, cue, number)
+                cue = None
+            else:
+                pending = (number, "score")
+    settle()
+    settle_months()
+    return slots
+
+def describe_slots(slots: Optional[Dict[str, Any]]) -> str:
+    """Human-readable scope for answer text, e.g. ' in ZIP 10001, with safety score ≥ 11'"""
+    slots = slots or {}
+    parts = []
+    if slots.get("zip_code"):
+        parts.append(f"in ZIP {slots['zip_code']}")
+    if "min_score" in slots and "max_score" in slots:
+        parts.append(f"with safety score {slots['min_score']}-{slots['max_score']}")
+    elif "min_score" in slots:
+        parts.append(f"with safety score ≥ {slots['min_score']}")
+    elif "max_score" in slots:
+        parts.append(f"with safety score ≤ {slots['max_score']}")
+    if slots.get("date_from") and slots.get("date_to"):
+        parts.append(f"screened {slots['date_from']} to {slots['date_to']}")
+    elif slots.get("date_from"):
+        parts.append(f"screened since {slots['date_from']}")
+    elif slots.get("date_to"):
+        parts.append(f"screened through {slots['date_to']}")
+    return (" " + ", ".join(parts)) if parts else ""
+
+router = IntentRouter(VOCABULARY)
+
+def route_question(question: str) -> Dict[str, Any]:
+    """Intent and slots for a chatbot question"""
+    return router.route(question)
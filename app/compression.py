@@ -0,0 +1,251 @@
+# app/compression.py
+from typing import Any, List, Optional
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers, MutableHeaders
+import logging
+import zlib
+
+from .config import settings
+
+try:
+    import zstandard  # Optional dependency, only needed for zstd bodies
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_WBITS = 31  # zlib window bits for a gzip header and trailer
+DEFLATE_WBITS = 15  # HTTP "deflate" is the zlib format
+
+# Response types worth compressing; event streams and HTML pass through
+COMPRESSIBLE_TYPES = ("application/json", "application/fhir+json", "text/csv")
+
+def supported_encodings() -> List[str]:
+    """Content codings this server can decode and produce, most preferred first"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+class _ZlibInflater:
+    """Incremental gzip/deflate decoder that never inflates more than it is allowed to
+
+    A gzip body may be several members back to back (what `cat a.gz b.gz`
+    produces); each member is decoded in turn, as gunzip does.
+    """
+
+    def __init__(self, wbits: int):
+        self.wbits = wbits
+        self.decompressor = zlib.decompressobj(wbits)
+
+    def feed(self, chunk: bytes, limit: int) -> bytes:
+        output = b""
+        while chunk and len(output) <= limit:
+            if self.decompressor.eof:
+                if self.wbits != GZIP_WBITS:
+                    raise zlib.error("data after the end of the deflate stream")
+                self.decompressor = zlib.decompressobj(self.wbits)
+            output += self.decompressor.decompress(chunk, limit + 1 - len(output))
+            chunk = self.decompressor.unconsumed_tail or self.decompressor.unused_data
+        return output
+
+    def finish(self) -> bytes:
+        if not self.decompressor.eof:
+            raise zlib.error("truncated stream")
+        return self.decompressor.flush()
+
+class _OutputLimitReached(Exception):
+    pass
+
+class _BoundedSink:
+    """Collects decoded output for _ZstdInflater and stops the decoder once past the limit"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.size = 0
+        self.limit = 0
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        if self.size > self.limit:
+            raise _OutputLimitReached()
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+class _ZstdInflater:
+    """Incremental zstd decoder bounded like _ZlibInflater
+
+    zstandard's decompressobj has no output cap, so frames are decoded
+    through a stream_writer whose sink raises as soon as the output passes
+    the limit - at most one write_size block beyond it is ever produced.
+    """
+
+    def __init__(self):
+        self.sink = _BoundedSink()
+        self.writer = zstandard.ZstdDecompressor().stream_writer(self.sink)
+
+    def feed(self, chunk: bytes, limit: int) -> bytes:
+        self.sink.limit = limit
+        try:
+            self.writer.write(chunk)
+        except _OutputLimitReached:
+            pass
+        return self.sink.take()
+
+    def finish(self) -> bytes:
+        return b""
+
+def _inflater(content_encoding: str):
+    if content_encoding in ("gzip", "x-gzip"):
+        return _ZlibInflater(GZIP_WBITS)
+    if content_encoding == "deflate":
+        return _ZlibInflater(DEFLATE_WBITS)
+    if content_encoding == "zstd" and zstandard is not None:
+        return _ZstdInflater()
+    raise HTTPException(
+        status_code=415,
+        detail=f"Unsupported Content-Encoding '{content_encoding}' (supported: {', '.join(supported_encodings() + ['deflate'])})"
+    )
+
+async def read_request_body(request: Request, max_bytes: Optional[int] = None) -> bytes:
+    """The request body, decoded chunk by chunk as it arrives if it has a Content-Encoding
+
+    gzip, deflate and (with zstandard installed) zstd bodies are accepted.
+    The compressed body is never held in full, and decoding stops with a
+    413 once the decoded size passes max_bytes (MAX_REQUEST_BODY_BYTES).
+    """
+    content_encoding = request.headers.get("content-encoding", "").strip().lower()
+    if content_encoding in ("", "identity"):
+        return await request.body()
+
+    max_bytes = settings.MAX_REQUEST_BODY_BYTES if max_bytes is None else max_bytes
+    inflater = _inflater(content_encoding)
+    parts = []
+    size = 0
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            data = inflater.feed(chunk, max_bytes - size)
+            size += len(data)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Decoded request body exceeds {max_bytes} bytes")
+            parts.append(data)
+        parts.append(inflater.finish())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Malformed {content_encoding} request body: {e}")
+    return b"".join(parts)
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported coding the client accepts, or None for identity"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for coding in supported_encodings():
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+class _Deflater:
+    """Streaming compressor; flush_chunk() emits everything fed so far"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+
+    def flush_chunk(self, data: bytes) -> bytes:
+        if self.encoding == "zstd":
+            return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        if self.encoding == "zstd":
+            return self.compressor.compress(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH)
+
+class CompressionMiddleware:
+    """Negotiated zstd/gzip compression of JSON and CSV responses
+
+    Each body chunk the app sends is compressed and flushed on its own, so
+    streaming responses (the CSV export) stay streaming and no response is
+    buffered whole. Single-chunk bodies under minimum_size go out as-is.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, encoding, self.minimum_size).send)
+
+class _CompressingSender:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.downstream = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message: Optional[dict] = None
+        self.deflater: Optional[_Deflater] = None
+        self.passthrough = False
+
+    async def send(self, message: Any):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message.get("headers", []))
+            content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            if (content_type not in COMPRESSIBLE_TYPES or "content-encoding" in headers
+                    or message.get("status", 200) in (204, 304)):
+                self.passthrough = True
+                await self.downstream(message)
+            else:
+                # Held until the first body chunk shows whether compression pays
+                self.start_message = message
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.downstream(start)
+                await self.downstream(message)
+                return
+            headers = MutableHeaders(raw=start.setdefault("headers", []))
+            del headers["content-length"]
+            headers["content-encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            self.deflater = _Deflater(self.encoding)
+            await self.downstream(start)
+
+        if more_body:
+            await self.downstream({"type": "http.response.body", "body": self.deflater.flush_chunk(body), "more_body": True})
+        else:
+            await self.downstream({"type": "http.response.body", "body": self.deflater.finish(body), "more_body": False})
@@ -19,6 +19,51 @@ class Settings:
     LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
     LOG_FILE: str = "logs/hrsn-server.log"
     
+    # Analytics response cache ('memory' or 'redis')
+    CACHE_BACKEND: str = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_MAX_ENTRIES: int = int(os.environ.get("CACHE_MAX_ENTRIES", "256"))
+    CACHE_TTL_SECONDS: int = int(os.environ.get("CACHE_TTL_SECONDS", "3600"))
+    REDIS_URL: str = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+    # Geographic reporting - optional 5-digit ZIP/county crosswalk (zip,county_fips)
+    ZIP_COUNTY_FILE: str = os.environ.get("ZIP_COUNTY_FILE", "")
+
+    # Web interface store persistence ('' disables; one worker process only)
+    WEB_STORE_DIR: str = os.environ.get("WEB_STORE_DIR", "")
+    WEB_STORE_SNAPSHOT_EVERY: int = int(os.environ.get("WEB_STORE_SNAPSHOT_EVERY", "500"))
+
+    # Chatbot - maximum members listed per answer (counts are always exact)
+    CHATBOT_RESULT_LIMIT: int = int(os.environ.get("CHATBOT_RESULT_LIMIT", "100"))
+    # Members per page (and per streamed event) in the web interface overview
+    CHATBOT_PAGE_SIZE: int = int(os.environ.get("CHATBOT_PAGE_SIZE", "25"))
+
+    # HTTP bodies - cap on a decoded (gzip/deflate/zstd) request body, and the smallest
+    # JSON/CSV response worth compressing
+    MAX_REQUEST_BODY_BYTES: int = int(os.environ.get("MAX_REQUEST_BODY_BYTES", str(50 * 1024 * 1024)))
+    COMPRESSION_MIN_BYTES: int = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+
+    # Query instrumentation - log requests over this many statements or this
+    # much statement time, or repeating one statement this often (likely N+1),
+    # and EXPLAIN single statements slower than SLOW_QUERY_MS (0 disables)
+    QUERY_LOG_MAX_COUNT: int = int(os.environ.get("QUERY_LOG_MAX_COUNT", "50"))
+    QUERY_LOG_MAX_MS: float = float(os.environ.get("QUERY_LOG_MAX_MS", "500"))
+    QUERY_REPEAT_THRESHOLD: int = int(os.environ.get("QUERY_REPEAT_THRESHOLD", "10"))
+    SLOW_QUERY_MS: float = float(os.environ.get("SLOW_QUERY_MS", "200"))
+
+    # Bundle ingest - worker threads (each on its own connection) for bundles
+    # with at least BUNDLE_PARALLEL_MIN_PATIENTS patients
+    BUNDLE_WORKERS: int = int(os.environ.get("BUNDLE_WORKERS", "4"))
+    BUNDLE_PARALLEL_MIN_PATIENTS: int = int(os.environ.get("BUNDLE_PARALLEL_MIN_PATIENTS", "50"))
+
+    # Screener rules - JSON ruleset directory ('' = built-in rulesets only),
+    # the ruleset for unrecognised questionnaires, and how often to check for edits
+    SCREENER_RULES_DIR: str = os.environ.get("SCREENER_RULES_DIR", "")
+    SCREENER_RULES_DEFAULT: str = os.environ.get("SCREENER_RULES_DEFAULT", "ny-hrsn-12")
+    SCREENER_RULES_CHECK_SECONDS: int = int(os.environ.get("SCREENER_RULES_CHECK_SECONDS", "30"))
+
+    # CMS waiver report - rows per checkpointed batch
+    WAIVER_REPORT_BATCH_SIZE: int = int(os.environ.get("WAIVER_REPORT_BATCH_SIZE", "5000"))
+    
     # FHIR Validation
     STRICT_FHIR_VALIDATION: bool = True
     REQUIRE_ALL_SCREENING_QUESTIONS: bool = False
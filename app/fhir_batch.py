@@ -0,0 +1,245 @@
+# app/fhir_batch.py
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from datetime import datetime, timezone
+from http import HTTPStatus
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import logging
+import uuid
+
+from .bundle_extraction import (
+    RESOURCE_LISTS, ReferenceIndex, extract_patient, extract_screening, extract_organization, resolve_subject
+)
+from .metrics import StageTimer
+from .screener_rules import ScreenerRules, registry
+
+logger = logging.getLogger(__name__)
+
+# Request Bundle type -> response Bundle type
+RESPONSE_TYPES = {"batch": "batch-response", "transaction": "transaction-response"}
+
+SUPPORTED_METHODS = ("POST", "PUT")
+
+# process_extraction() result counter for each stored resource type
+PROCESSED_COUNTERS = {
+    "Patient": "members_processed",
+    "Organization": "organizations_processed",
+    "QuestionnaireResponse": "screenings_processed"
+}
+
+# Entries are saved members and organizations first, so a screening can
+# point at a Patient sent in the same Bundle
+SAVE_ORDER = {"Patient": 0, "Organization": 1, "QuestionnaireResponse": 2}
+
+class EntryError(Exception):
+    """An entry that cannot be saved, with the HTTP status reported for it"""
+
+    def __init__(self, status: int, message: str, code: str = "processing"):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+def is_batch(bundle: Dict[str, Any]) -> bool:
+    """Whether a Bundle gets batch/transaction semantics
+
+    Senders have long posted screening Bundles typed "transaction" with no
+    entry.request at all; those keep the document processing path.
+    """
+    return bundle.get("type") in RESPONSE_TYPES and any("request" in entry for entry in bundle.get("entry", []))
+
+def status_line(status: int) -> str:
+    return f"{status} {HTTPStatus(status).phrase}"
+
+def operation_outcome(message: str, severity: str = "error", code: str = "processing") -> Dict[str, Any]:
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": severity, "code": code, "diagnostics": message}]
+    }
+
+def _check_request(entry: Dict[str, Any], resource: Dict[str, Any]):
+    """Validate an entry's request against its resource"""
+    request = entry.get("request") or {}
+    method = (request.get("method") or "").upper()
+    if not method:
+        raise EntryError(400, "Entry has no request.method", "required")
+    if method not in SUPPORTED_METHODS:
+        raise EntryError(405, f"{method} is not supported in a batch (supported: {', '.join(SUPPORTED_METHODS)})",
+                         "not-supported")
+    if not resource.get("resourceType"):
+        raise EntryError(400, "Entry has no resource", "required")
+    if method == "PUT":
+        # PUT [type]/[id] must name the resource it carries
+        target = (request.get("url") or "").split("?")[0].strip("/").split("/")
+        if len(target) != 2 or target != [resource["resourceType"], resource.get("id")]:
+            raise EntryError(400, f"PUT url '{request.get('url')}' does not match "
+                                  f"{resource['resourceType']}/{resource.get('id')}", "invalid")
+
+def parse_entries(bundle: Dict[str, Any], rules: Optional[ScreenerRules] = None,
+                  timer: Optional[StageTimer] = None) -> List[Dict[str, Any]]:
+    """Validate and extract every entry of a batch or transaction Bundle
+
+    Each parsed entry keeps its position in the Bundle, its method, and
+    either the extracted resource or the EntryError that rejects it. As in
+    extract_bundle, screening subjects resolve through a ReferenceIndex,
+    so a QuestionnaireResponse may reference a Patient POSTed alongside it
+    by fullUrl (urn:uuid:) or Patient/id.
+    """
+    parsed = []
+    references = ReferenceIndex()
+    patients: List[Dict[str, Any]] = []
+    counts = {list_name: 0 for list_name in RESOURCE_LISTS.values()}
+
+    for index, entry in enumerate(bundle.get("entry", [])):
+        resource = entry.get("resource") or {}
+        resource_type = resource.get("resourceType")
+        item = {"index": index, "resource_type": resource_type,
+                "method": ((entry.get("request") or {}).get("method") or "").upper(),
+                "extracted": None, "error": None}
+        parsed.append(item)
+        try:
+            _check_request(entry, resource)
+            list_name = RESOURCE_LISTS.get(resource_type)
+            if list_name is None:
+                continue
+            if resource_type == "Patient":
+                item["extracted"] = extract_patient(resource)
+                patients.append(item["extracted"])
+            elif resource_type == "QuestionnaireResponse":
+                item["extracted"] = extract_screening(resource, rules or registry.for_questionnaire(resource.get("questionnaire")))
+            else:
+                item["extracted"] = extract_organization(resource)
+        except EntryError as e:
+            item["error"] = e
+            continue
+        except Exception as e:
+            item["error"] = EntryError(400, f"Could not read {resource_type}: {e}", "structure")
+            continue
+        references.add(entry.get("fullUrl"), resource_type, resource.get("id"), counts[list_name])
+        counts[list_name] += 1
+    if timer is not None:
+        timer.lap("validate")
+
+    for item in parsed:
+        if item["resource_type"] == "QuestionnaireResponse" and item["extracted"] is not None:
+            resolve_subject(item["extracted"], references, patients)
+            # Saved entry by entry, so an in-bundle subject is found by its id
+            item["extracted"]["subject_patient"] = None
+    if timer is not None:
+        timer.lap("resolve")
+    return parsed
+
+def _single_extraction(bundle: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+    extraction = {
+        "bundle_id": bundle.get("id"),
+        "type": bundle.get("type"),
+        "entry_count": 1,
+        "patients": [],
+        "screenings": [],
+        "organizations": []
+    }
+    extraction[RESOURCE_LISTS[item["resource_type"]]].append(item["extracted"])
+    return extraction
+
+def _save_entry(process: Callable[..., Dict[str, Any]], bundle: Dict[str, Any], item: Dict[str, Any],
+                db: Session, timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+    """Save one extracted entry in the caller's transaction; its response element"""
+    result = process(_single_extraction(bundle, item), db, commit=False, timer=timer)
+    skipped = result.get("screenings_skipped")
+    if skipped:
+        raise EntryError(422, skipped[0]["reason"])
+
+    resource_type = item["resource_type"]
+    if not result.get(PROCESSED_COUNTERS[resource_type]):
+        # This processor does not store the type (simple_main has no organizations)
+        return _not_stored(resource_type)
+
+    resource_id = item["extracted"].get("session_id") if resource_type == "QuestionnaireResponse" else item["extracted"]["fhir_id"]
+    return {"status": status_line(201 if item["method"] == "POST" else 200),
+            "location": f"{resource_type}/{resource_id}",
+            "lastModified": datetime.now(timezone.utc).isoformat()}
+
+def _not_stored(resource_type: str) -> Dict[str, Any]:
+    return {"status": status_line(200),
+            "outcome": operation_outcome(f"{resource_type} accepted but not stored", "information", "informational")}
+
+def _error_response(error: EntryError) -> Dict[str, Any]:
+    return {"status": status_line(error.status), "outcome": operation_outcome(str(error), code=error.code)}
+
+def _as_entry_error(item: Dict[str, Any], e: Exception) -> EntryError:
+    if isinstance(e, EntryError):
+        return e
+    if isinstance(e, ValueError):
+        return EntryError(400, str(e), "invalid")
+    if isinstance(e, IntegrityError):
+        return EntryError(409, f"{item['resource_type']} conflicts with existing data", "conflict")
+    logger.error(f"Batch entry {item['index']} ({item['resource_type']}) failed: {e}")
+    return EntryError(500, f"Could not save {item['resource_type']}", "exception")
+
+def process_batch(bundle: Dict[str, Any], db: Session, process: Callable[..., Dict[str, Any]],
+                  rules: Optional[ScreenerRules] = None,
+                  timer: Optional[StageTimer] = None) -> Tuple[int, Dict[str, Any]]:
+    """Save a batch or transaction Bundle; (HTTP status, response resource)
+
+    `process` is a processor's process_extraction, called with commit=False
+    once per entry. A batch saves every entry in its own SAVEPOINT, so a
+    failed entry rolls back alone and the batch-response reports a status
+    per entry - the sender retries just the failures. A transaction is all
+    or nothing: the first failing entry rolls everything back and the
+    answer is a 400 OperationOutcome naming it. Entries that are not
+    Patient, Organization or QuestionnaireResponse are acknowledged but
+    not stored, as in document Bundles.
+
+    Stages are lapped on `timer` as for a document Bundle; match and write
+    accumulate over the entries. Entries are saved one by one on the
+    caller's connection (a transaction has to be), so large Bundles are
+    not partitioned across workers.
+    """
+    transaction = bundle.get("type") == "transaction"
+    timer = timer or StageTimer()
+    parsed = parse_entries(bundle, rules, timer)
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(parsed)
+
+    for item in sorted(parsed, key=lambda item: SAVE_ORDER.get(item["resource_type"], len(SAVE_ORDER))):
+        error = item["error"]
+        if error is None and item["extracted"] is None:
+            responses[item["index"]] = _not_stored(item["resource_type"])
+            continue
+        if error is None:
+            try:
+                if transaction:
+                    responses[item["index"]] = _save_entry(process, bundle, item, db, timer)
+                else:
+                    with db.begin_nested():
+                        responses[item["index"]] = _save_entry(process, bundle, item, db, timer)
+            except Exception as e:
+                error = _as_entry_error(item, e)
+
+        if error is not None:
+            if transaction:
+                db.rollback()
+                logger.info(f"Transaction {bundle.get('id')} rolled back at entry {item['index']}: {error}")
+                return 400, operation_outcome(f"Entry {item['index']} ({item['resource_type']}) failed with "
+                                              f"{status_line(error.status)}: {error}", code=error.code)
+            responses[item["index"]] = _error_response(error)
+
+    db.commit()
+    timer.lap("commit")
+    failed = sum(1 for response in responses if not response["status"].startswith("2"))
+    logger.info(f"{bundle.get('type')} {bundle.get('id')}: {len(parsed) - failed} entries saved, {failed} failed")
+    return 200, {
+        "resourceType": "Bundle",
+        "id": str(uuid.uuid4()),
+        "type": RESPONSE_TYPES[bundle["type"]],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "entry": [{"response": response} for response in responses]
+    }
+
+def processed_counts(response: Dict[str, Any]) -> Dict[str, int]:
+    """process_extraction-style counters for a batch-response / transaction-response Bundle"""
+    counts = {counter: 0 for counter in PROCESSED_COUNTERS.values()}
+    for entry in response.get("entry", []):
+        location = entry.get("response", {}).get("location") or ""
+        counter = PROCESSED_COUNTERS.get(location.split("/")[0])
+        if counter:
+            counts[counter] += 1
+    return counts
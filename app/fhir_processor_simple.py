@@ -1,34 +1,60 @@
 # app/fhir_processor_simple.py
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Callable
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime
+import asyncio
 import logging
 
 from .models import Member, Organization, ScreeningSession, ScreeningResponse
-from .config import HRSN_QUESTION_MAPPINGS
+from .sketches import record_screening
+from .geo import record_screening_geo
+from .trajectories import record_screening_trajectory
+from .chatbot_db import record_screening_flags
+from .bundle_extraction import extract_bundle
+from .bundle_partition import should_partition, process_partitioned
+from .metrics import StageTimer
 
 logger = logging.getLogger(__name__)
 
 class FHIRBundleProcessor:
     """Simple FHIR bundle processor for basic functionality"""
     
-    def __init__(self):
-        self.safety_questions = ["95618-5", "95617-7", "95616-9", "95615-1"]
-    
-    async def process_bundle(self, bundle_dict: Dict[str, Any], db: Session) -> Dict[str, Any]:
+    async def process_bundle(self, bundle_dict: Dict[str, Any], db: Session,
+                             session_factory: Optional[Callable[[], Session]] = None,
+                             timer: Optional[StageTimer] = None) -> Dict[str, Any]:
         """
         Main entry point for processing FHIR bundles
+        
+        With a session_factory, bundles covering many patients are saved as
+        concurrent per-patient partitions (see app.bundle_partition). A
+        StageTimer passed in is lapped at each stage; the partitions time
+        their own stages, and for the timer their whole save is "write".
+        Partitions that fail while others commit raise PartialBundleError.
+        """
+        # Basic validation
+        if not isinstance(bundle_dict, dict) or bundle_dict.get("resourceType") != "Bundle":
+            raise ValueError("Invalid FHIR Bundle structure")
+        
+        timer = timer or StageTimer()
+        extraction = extract_bundle(bundle_dict, timer=timer)
+        # Saves run off the event loop; to_thread copies the context, so the timer still counts statements
+        if session_factory is not None and should_partition(extraction, db):
+            result = await asyncio.to_thread(process_partitioned, self.process_extraction, extraction, session_factory)
+            timer.lap("write", observe=False)
+            return result
+        return await asyncio.to_thread(self.process_extraction, extraction, db, timer=timer)
+    
+    def process_extraction(self, extraction: Dict[str, Any], db: Session, commit: bool = True,
+                           timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+        """Save an already-extracted bundle (see bundle_extraction.extract_bundle)
+        
+        With commit=False the rows are only flushed, for a caller that owns
+        the transaction (app.fhir_batch).
         """
         try:
-            logger.info(f"Processing FHIR bundle: {bundle_dict.get('id', 'unknown')}")
-            
-            # Basic validation
-            if not isinstance(bundle_dict, dict) or bundle_dict.get("resourceType") != "Bundle":
-                raise ValueError("Invalid FHIR Bundle structure")
-            
-            bundle_id = bundle_dict.get("id")
-            entries = bundle_dict.get("entry", [])
+            bundle_id = extraction["bundle_id"]
+            logger.info(f"Processing FHIR bundle: {bundle_id or 'unknown'}")
             
             result = {
                 "bundle_id": bundle_id,
@@ -38,34 +64,41 @@ class FHIRBundleProcessor:
                 "status": "completed"
             }
             
-            # Process each resource in the bundle
-            for entry in entries:
-                resource = entry.get("resource", {})
-                resource_type = resource.get("resourceType")
-                
-                if resource_type == "Patient":
-                    self._process_member(resource, db)
-                    result["members_processed"] += 1
-                elif resource_type == "QuestionnaireResponse":
-                    self._process_questionnaire_response(resource, db)
+            # Dependency order: members first, so screenings resolve their
+            # subject to a member saved from this same bundle
+            timer = timer or StageTimer()
+            members = []
+            for patient in extraction["patients"]:
+                members.append(self._process_member(patient, db))
+                result["members_processed"] += 1
+            timer.lap("match")
+            for organization in extraction["organizations"]:
+                self._process_organization(organization, db)
+                result["organizations_processed"] += 1
+            for screening in extraction["screenings"]:
+                skipped = self._process_questionnaire_response(screening, members, db)
+                if skipped:
+                    result.setdefault("screenings_skipped", []).append({"id": screening["session_id"], "reason": skipped})
+                else:
                     result["screenings_processed"] += 1
-                elif resource_type == "Organization":
-                    self._process_organization(resource, db)
-                    result["organizations_processed"] += 1
+            timer.lap("write")
             
-            db.commit()
-            logger.info(f"Successfully processed bundle {bundle_id}")
+            if commit:
+                db.commit()
+                timer.lap("commit")
+                logger.info(f"Successfully processed bundle {bundle_id}")
             return result
             
         except Exception as e:
             logger.error(f"Error processing bundle: {e}")
-            db.rollback()
+            if commit:
+                db.rollback()
             raise
     
-    def _process_member(self, patient_resource: Dict[str, Any], db: Session) -> Member:
-        """Process a FHIR Patient resource into a Member"""
+    def _process_member(self, patient: Dict[str, Any], db: Session) -> Member:
+        """Create a Member from an extracted Patient"""
         
-        fhir_id = patient_resource.get("id")
+        fhir_id = patient["fhir_id"]
         if not fhir_id:
             raise ValueError("Patient resource missing ID")
         
@@ -74,154 +107,82 @@ class FHIRBundleProcessor:
         if existing_member:
             return existing_member
         
-        # Extract name
-        name_data = patient_resource.get("name", [])
-        first_name = ""
-        last_name = ""
-        if name_data and isinstance(name_data, list) and len(name_data) > 0:
-            name = name_data[0]
-            given = name.get("given", [])
-            if given:
-                first_name = " ".join(given) if isinstance(given, list) else str(given)
-            last_name = name.get("family", "")
-        
-        # Extract other data
-        gender = patient_resource.get("gender", "")
-        birth_date_str = patient_resource.get("birthDate", "")
-        birth_date = None
-        if birth_date_str:
-            try:
-                birth_date = datetime.strptime(birth_date_str, "%Y-%m-%d")
-            except:
-                pass
-        
-        # Extract address
-        addresses = patient_resource.get("address", [])
-        address_line1 = ""
-        city = ""
-        state = ""
-        zip_code = ""
-        if addresses and len(addresses) > 0:
-            addr = addresses[0]
-            lines = addr.get("line", [])
-            if lines:
-                address_line1 = lines[0] if isinstance(lines, list) else str(lines)
-            city = addr.get("city", "")
-            state = addr.get("state", "")
-            zip_code = addr.get("postalCode", "")
-        
-        # Create new member
         member = Member(
             fhir_id=fhir_id,
-            first_name=first_name,
-            last_name=last_name,
-            date_of_birth=birth_date,
-            gender=gender,
-            address_line1=address_line1,
-            city=city,
-            state=state,
-            zip_code=zip_code
+            first_name=patient["first_name"],
+            last_name=patient["last_name"],
+            date_of_birth=patient["date_of_birth"],
+            gender=patient["gender"] or "",
+            address_line1=patient["address_line1"],
+            city=patient["city"],
+            state=patient["state"],
+            zip_code=patient["zip_code"]
         )
         
         db.add(member)
         db.flush()  # Get the ID
         return member
     
-    def _process_questionnaire_response(self, qr_resource: Dict[str, Any], db: Session):
-        """Process a QuestionnaireResponse into screening data"""
+    def _process_questionnaire_response(self, extracted: Dict[str, Any], members: List[Member], db: Session) -> Optional[str]:
+        """Save an extracted QuestionnaireResponse as screening data
         
-        session_id = qr_resource.get("id")
-        if not session_id:
-            return
+        Returns why the screening was skipped, or None once it is saved.
+        """
         
-        # Get member reference
-        subject_ref = qr_resource.get("subject", {}).get("reference", "")
-        if subject_ref.startswith("Patient/"):
-            member_fhir_id = subject_ref.replace("Patient/", "")
-            member = db.query(Member).filter(Member.fhir_id == member_fhir_id).first()
+        session_id = extracted["session_id"]
+        if not session_id:
+            return "QuestionnaireResponse missing ID"
+        
+        # Subjects in this bundle were resolved during extraction; only a
+        # Patient outside it needs the database
+        subject_ref = extracted["subject_reference"]
+        if extracted["subject_patient"] is not None:
+            member = members[extracted["subject_patient"]]
+        elif extracted["member_fhir_id"]:
+            member = db.query(Member).filter(Member.fhir_id == extracted["member_fhir_id"]).first()
             if not member:
                 logger.warning(f"Member not found for reference: {subject_ref}")
-                return
+                return f"Member not found for reference: {subject_ref}"
         else:
             logger.warning(f"Invalid subject reference: {subject_ref}")
-            return
-        
-        # Create screening session
-        authored_date_str = qr_resource.get("authored", "")
-        screening_date = datetime.utcnow()
-        if authored_date_str:
-            try:
-                screening_date = datetime.fromisoformat(authored_date_str.replace("Z", "+00:00"))
-            except:
-                pass
+            return f"Invalid subject reference: {subject_ref}"
         
+        # Scores and counts were computed during extraction
         screening = ScreeningSession(
             member_id=member.id,
-            screening_date=screening_date,
-            fhir_questionnaire_response_id=session_id
+            screening_date=extracted["screening_date"] or datetime.utcnow(),
+            fhir_questionnaire_response_id=session_id,
+            total_safety_score=extracted["total_safety_score"],
+            positive_screens_count=extracted["positive_answers"],
+            questions_answered=extracted["mapped_items"]
         )
         
         db.add(screening)
         db.flush()  # Get the ID
         
-        # Process responses
-        safety_score = 0
-        positive_screens = 0
-        questions_answered = 0
-        
-        items = qr_resource.get("item", [])
-        for item in items:
-            question_code = item.get("linkId")
-            question_text = item.get("text", "")
-            
-            if question_code and question_code in HRSN_QUESTION_MAPPINGS:
-                questions_answered += 1
-                
-                for answer in item.get("answer", []):
-                    answer_code = None
-                    answer_text = ""
-                    
-                    if "valueCoding" in answer:
-                        coding = answer["valueCoding"]
-                        answer_code = coding.get("code")
-                        answer_text = coding.get("display", answer_code or "")
-                    elif "valueString" in answer:
-                        answer_text = answer["valueString"]
-                    elif "valueBoolean" in answer:
-                        answer_text = "Yes" if answer["valueBoolean"] else "No"
-                    elif "valueInteger" in answer:
-                        answer_text = str(answer["valueInteger"])
-                    
-                    # Calculate safety score
-                    if question_code in self.safety_questions and answer_code:
-                        score_mapping = HRSN_QUESTION_MAPPINGS[question_code].get("score_mapping", {})
-                        if answer_code in score_mapping:
-                            safety_score += score_mapping[answer_code]
-                    
-                    # Check for positive screen
-                    positive_answers = HRSN_QUESTION_MAPPINGS[question_code].get("positive_answers", [])
-                    if answer_code in positive_answers:
-                        positive_screens += 1
-                    
-                    # Create response record
-                    response = ScreeningResponse(
-                        screening_session_id=screening.id,
-                        question_code=question_code,
-                        question_text=question_text,
-                        answer_code=answer_code,
-                        answer_text=answer_text
-                    )
-                    db.add(response)
-        
-        # Update screening with calculated values
-        screening.total_safety_score = safety_score
-        screening.positive_screens_count = positive_screens
-        screening.questions_answered = questions_answered
-        
-    def _process_organization(self, org_resource: Dict[str, Any], db: Session) -> Organization:
-        """Process a FHIR Organization resource"""
-        
-        fhir_id = org_resource.get("id")
+        db.add_all([
+            ScreeningResponse(
+                screening_session_id=screening.id,
+                question_code=answer["question_code"],
+                question_text=answer["question_text"],
+                answer_code=answer["answer_code"],
+                answer_text=answer["answer_text"]
+            )
+            for answer in extracted["answers"] if answer["mapped"]
+        ])
+        
+        # Fold into the sketches, geographic rollups and member trajectory
+        # in the same transaction
+        positive_categories = extracted["positive_categories"]
+        record_screening(db, member, screening)
+        record_screening_geo(db, member, screening, positive_categories)
+        record_screening_trajectory(db, member, screening, positive_categories)
+        record_screening_flags(db, member.id, screening, positive_categories)
+        
+    def _process_organization(self, org: Dict[str, Any], db: Session) -> Organization:
+        """Create an Organization from an extracted Organization resource"""
+        
+        fhir_id = org["fhir_id"]
         if not fhir_id:
             raise ValueError("Organization resource missing ID")
         
@@ -230,41 +191,16 @@ class FHIRBundleProcessor:
         if existing_org:
             return existing_org
         
-        name = org_resource.get("name", "")
-        
-        # Extract organization type
-        org_types = org_resource.get("type", [])
-        org_type = ""
-        if org_types and len(org_types) > 0:
-            type_coding = org_types[0].get("coding", [])
-            if type_coding and len(type_coding) > 0:
-                org_type = type_coding[0].get("code", "")
-        
-        # Extract address
-        addresses = org_resource.get("address", [])
-        address_line1 = ""
-        city = ""
-        state = ""
-        zip_code = ""
-        if addresses and len(addresses) > 0:
-            addr = addresses[0]
-            lines = addr.get("line", [])
-            if lines:
-                address_line1 = lines[0] if isinstance(lines, list) else str(lines)
-            city = addr.get("city", "")
-            state = addr.get("state", "")
-            zip_code = addr.get("postalCode", "")
-        
         organization = Organization(
             fhir_id=fhir_id,
-            name=name,
-            organization_type=org_type,
-            address_line1=address_line1,
-            city=city,
-            state=state,
-            zip_code=zip_code
+            name=org["name"] or "",
+            organization_type=org["type_code"],
+            address_line1=org["address_line1"],
+            city=org["city"],
+            state=org["state"],
+            zip_code=org["zip_code"]
         )
         
         db.add(organization)
         db.flush()
-        return organization
\ No newline at end of file
+        return organization
@@ -0,0 +1,233 @@
+# app/geo.py
+from typing import Dict, Any, List, Optional, Iterable, Set, Tuple
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from datetime import datetime
+import csv
+import logging
+import os
+import uuid
+
+from .cache import response_cache
+from .models import Member, ScreeningSession, ScreeningResponse, GeoRollup
+from .config import settings
+from .screener_rules import registry
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+UNKNOWN_COUNTY = "unknown"
+
+class ZipCountyTable:
+    """Local ZIP -> county reference table
+
+    Rows may hold a full 5-digit ZIP or a 3-digit ZIP prefix. Lookups try
+    the exact ZIP first and fall back to the prefix. The bundled file lists
+    every New York ZIP (standard, PO box and unique) with the county it
+    mostly lies in, covering all 62 counties; a ZIP that crosses a county
+    line counts toward that primary county. Its ZIP3 (USPS sectional
+    center) rows only catch ZIPs missing from the list. ZIP_COUNTY_FILE
+    replaces it, e.g. with a HUD USPS ZIP-County extract (zip,county_fips).
+    """
+
+    def __init__(self, zip_file: str, counties_file: str):
+        self.counties: Dict[str, str] = {}
+        self.zip5: Dict[str, str] = {}
+        self.zip3: Dict[str, str] = {}
+
+        with open(counties_file, newline="") as f:
+            for row in csv.DictReader(f):
+                self.counties[row["county_fips"]] = row["county_name"]
+
+        with open(zip_file, newline="") as f:
+            for row in csv.DictReader(f):
+                zip_code = row["zip"].strip()
+                fips = row["county_fips"].strip()
+                if len(zip_code) == 5 and zip_code not in self.zip5:
+                    # First row wins when a crosswalk lists a ZIP in several counties
+                    self.zip5[zip_code] = fips
+                elif len(zip_code) == 3:
+                    self.zip3[zip_code] = fips
+
+        logger.info(f"Loaded ZIP/county table: {len(self.zip5)} ZIPs, {len(self.zip3)} ZIP3 prefixes, "
+                    f"{len(self.counties)} counties")
+
+    def county_for_zip(self, zip_code: Optional[str]) -> str:
+        """County FIPS code for a ZIP, or 'unknown'"""
+        zip_code = (zip_code or "").strip()[:5]
+        if len(zip_code) < 3:
+            return UNKNOWN_COUNTY
+        return self.zip5.get(zip_code) or self.zip3.get(zip_code[:3]) or UNKNOWN_COUNTY
+
+    def county_zips(self, fips: str) -> Tuple[List[str], List[str]]:
+        """The ZIPs and ZIP3 prefixes listed for a county, to narrow a query before county_for_zip"""
+        return ([zip_code for zip_code, county in self.zip5.items() if county == fips],
+                [prefix for prefix, county in self.zip3.items() if county == fips])
+
+    def county_name(self, fips: str) -> str:
+        return self.counties.get(fips, "Unknown")
+
+_zip_county_table: Optional[ZipCountyTable] = None
+
+def get_zip_county_table() -> ZipCountyTable:
+    """Load the reference table once per process"""
+    global _zip_county_table
+    if _zip_county_table is None:
+        _zip_county_table = ZipCountyTable(
+            settings.ZIP_COUNTY_FILE or os.path.join(DATA_DIR, "ny_zip_county.csv"),
+            os.path.join(DATA_DIR, "ny_counties.csv")
+        )
+    return _zip_county_table
+
+def risk_level(screening: ScreeningSession) -> str:
+    """Bucket a screening: high (safety score >= 11), moderate (any positive screen) or low"""
+    if (screening.total_safety_score or 0) >= 11:
+        return "high"
+    if (screening.positive_screens_count or 0) > 0:
+        return "moderate"
+    return "low"
+
+def positive_categories(answers: Iterable[tuple]) -> Set[str]:
+    """SDOH categories with a positive answer, from (question_code, answer_code) pairs"""
+    rules = registry.default()
+    bits = 0
+    for question_code, answer_code in answers:
+        bits |= rules.decide(question_code, answer_code)[2]
+    return rules.category_names(bits)
+
+# Dialects whose INSERT ... ON CONFLICT lets one statement add to every rollup cell
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+ROLLUP_CELL = ("county_fips", "zip_code", "month", "dimension", "value")
+
+def _add_counts(db: Session, county_fips: str, zip_code: str, month: str, cells: List[tuple]):
+    """Add 1 to each (dimension, value) cell, in a single upsert where the dialect has one"""
+    insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        for dimension, value in cells:
+            row = db.query(GeoRollup).filter(
+                GeoRollup.county_fips == county_fips,
+                GeoRollup.zip_code == zip_code,
+                GeoRollup.month == month,
+                GeoRollup.dimension == dimension,
+                GeoRollup.value == value
+            ).with_for_update().first()
+            if not row:
+                row = GeoRollup(county_fips=county_fips, zip_code=zip_code, month=month,
+                                dimension=dimension, value=value, count=0)
+                db.add(row)
+            row.count = (row.count or 0) + 1
+        db.flush()
+        return
+
+    statement = insert(GeoRollup).values([
+        {"id": uuid.uuid4(), "county_fips": county_fips, "zip_code": zip_code, "month": month,
+         "dimension": dimension, "value": value, "count": 1}
+        for dimension, value in cells
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=list(ROLLUP_CELL),
+        set_={"count": GeoRollup.count + statement.excluded.count}
+    ))
+
+def record_screening_geo(db: Session, member: Member, screening: ScreeningSession, categories: Set[str]):
+    """Add one ingested screening to the county/ZIP/month rollups
+
+    Runs inside the ingest transaction, so rollups always match the
+    committed screenings. Every cell the screening touches is updated by
+    one upsert, which takes the row locks together instead of one
+    SELECT ... FOR UPDATE per cell.
+    """
+    zip_code = (member.zip_code or "").strip()[:5]
+    county_fips = get_zip_county_table().county_for_zip(zip_code)
+    month = (screening.screening_date or datetime.utcnow()).strftime("%Y-%m")
+
+    cells = [("screenings", ""), ("risk_level", risk_level(screening))]
+    cells.extend(("sdoh_category", category) for category in sorted(categories))
+    _add_counts(db, county_fips, zip_code, month, cells)
+
+def geo_summary(db: Session, level: str = "county", county: Optional[str] = None,
+                start_month: Optional[str] = None, end_month: Optional[str] = None) -> Dict[str, Any]:
+    """Pre-aggregated screening counts per county or ZIP"""
+    if level not in ("county", "zip"):
+        raise ValueError("level must be 'county' or 'zip'")
+
+    table = get_zip_county_table()
+    query = db.query(GeoRollup)
+    if county:
+        query = query.filter(GeoRollup.county_fips == county)
+    if start_month:
+        query = query.filter(GeoRollup.month >= start_month)
+    if end_month:
+        query = query.filter(GeoRollup.month <= end_month)
+
+    regions: Dict[str, Dict[str, Any]] = {}
+
+    def empty_region(key: str, county_fips: str) -> Dict[str, Any]:
+        region = {
+            "county_fips": county_fips,
+            "county_name": table.county_name(county_fips),
+            "screenings": 0,
+            "risk_levels": {"high": 0, "moderate": 0, "low": 0},
+            "sdoh_categories": {}
+        }
+        if level == "zip":
+            region["zip_code"] = key
+        return region
+
+    # The map needs every county, including those without screenings yet
+    if level == "county":
+        for fips in table.counties:
+            if not county or fips == county:
+                regions[fips] = empty_region(fips, fips)
+
+    for row in query.all():
+        key = row.county_fips if level == "county" else row.zip_code
+        if key not in regions:
+            regions[key] = empty_region(key, row.county_fips)
+        region = regions[key]
+        if row.dimension == "screenings":
+            region["screenings"] += row.count
+        elif row.dimension == "risk_level":
+            region["risk_levels"][row.value] = region["risk_levels"].get(row.value, 0) + row.count
+        elif row.dimension == "sdoh_category":
+            region["sdoh_categories"][row.value] = region["sdoh_categories"].get(row.value, 0) + row.count
+
+    return {
+        "level": level,
+        "window": {"start": start_month, "end": end_month},
+        "regions": sorted(regions.values(), key=lambda r: (-r["screenings"], r.get("zip_code") or r["county_fips"]))
+    }
+
+def rebuild_geo_rollups(db: Session) -> int:
+    """Rebuild all rollups from existing screenings (one-off backfill)"""
+    db.query(GeoRollup).delete()
+    db.flush()
+    count = 0
+    last_id = None
+    while True:
+        # Keyset pagination keeps the backfill in bounded memory
+        query = db.query(ScreeningSession, Member).join(Member, Member.id == ScreeningSession.member_id)
+        if last_id is not None:
+            query = query.filter(ScreeningSession.id > last_id)
+        page = query.order_by(ScreeningSession.id).limit(1000).all()
+        if not page:
+            break
+        for screening, member in page:
+            answers = db.query(ScreeningResponse.question_code, ScreeningResponse.answer_code).filter(
+                ScreeningResponse.screening_session_id == screening.id
+            ).all()
+            record_screening_geo(db, member, screening, positive_categories(answers))
+            count += 1
+        last_id = page[-1][0].id
+    db.commit()
+    response_cache.bump_generation()
+    logger.info(f"Rebuilt geo rollups from {count} screenings")
+    return count
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt geo rollups from {rebuild_geo_rollups(db)} screenings")
+    finally:
+        db.close()
@@ -0,0 +1,86 @@
+# app/json_codec.py
+from typing import Any
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import json
+import logging
+import uuid
+
+from .compression import read_request_body
+
+try:
+    import orjson  # Optional dependency; the stdlib encoder is the fallback
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# OpenAPI body for routes that decode the raw request body themselves
+JSON_BODY_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"type": "object", "additionalProperties": True}}}
+    }
+}
+
+def _default(obj: Any) -> Any:
+    """Types neither encoder handles natively; anything else goes through jsonable_encoder"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    return jsonable_encoder(obj)
+
+def _stdlib_default(obj: Any) -> Any:
+    # orjson encodes these natively
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    return _default(obj)
+
+if orjson is not None:
+    def dumps(data: Any) -> bytes:
+        """Compact JSON bytes; UUID, datetime and date are encoded natively"""
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(body: Any) -> Any:
+        return orjson.loads(body)
+
+    DecodeError = orjson.JSONDecodeError
+else:
+    def dumps(data: Any) -> bytes:
+        """Compact JSON bytes; UUID, datetime and date are encoded natively"""
+        return json.dumps(data, default=_stdlib_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(body: Any) -> Any:
+        return json.loads(body)
+
+    DecodeError = ValueError
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()
+
+    As the app's default_response_class it only replaces the final
+    encoding step; a route that returns FastJSONResponse(payload) itself
+    also skips FastAPI's jsonable_encoder walk of the payload.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+async def read_json_body(request: Request) -> Any:
+    """Decode the raw (gzip/zstd-decoded) request body in one pass, without FastAPI's body model validation"""
+    body = await read_request_body(request)
+    try:
+        return loads(body)
+    except (DecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=422, detail=f"Request body is not valid JSON: {e}")
@@ -1,7 +1,8 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException, Depends, Security, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Security, BackgroundTasks, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 import logging
@@ -9,11 +10,19 @@ import os
 from datetime import datetime
 import uuid
 
-from .database import get_db, engine
+from .database import get_db, engine, SessionLocal
 from .models import Base
 from .fhir_processor_simple import FHIRBundleProcessor
 from .schemas import BundleResponse, HealthResponse, BundleProcessingStatus
 from .config import settings
+from .cache import response_cache
+from .json_codec import FastJSONResponse, read_json_body, JSON_BODY_OPENAPI
+from .compression import CompressionMiddleware
+from .fhir_batch import is_batch, process_batch, processed_counts
+from .metrics import MetricsMiddleware, StageTimer, bundles_total, ingest_queue, instrument_engine, metrics_response
+from .bundle_partition import PartialBundleError
+from .bundle_log import RANK_COLUMNS, add_timing_columns, record_processing, slow_bundles
+from .query_instrumentation import QueryInstrumentationMiddleware, instrument_queries
 
 # Configure logging
 logging.basicConfig(
@@ -28,6 +37,7 @@ logger = logging.getLogger(__name__)
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+add_timing_columns(engine)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -35,7 +45,8 @@ app = FastAPI(
     description="NY State 1115 Waiver HRSN Data Processing API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -47,6 +58,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/zstd for JSON and CSV responses, negotiated per request
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_BYTES)
+
+# Statements per request, logged when excessive (and as headers in debug mode)
+app.add_middleware(QueryInstrumentationMiddleware, debug_headers=settings.DEBUG)
+instrument_queries(engine)
+
+# Per-route latency and in-flight requests for /metrics (outermost, so it times everything)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+
 # Security
 security = HTTPBearer()
 
@@ -94,6 +116,11 @@ async def health_check():
         version="1.0.0"
     )
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: route latency, bundle ingest and queue, and the database pool"""
+    return metrics_response()
+
 @app.get("/members/count")
 async def get_members_count():
     """Get count of members (no auth required for testing)"""
@@ -107,15 +134,27 @@ async def get_members_count():
 
 @app.get("/members")
 async def list_members(
+    trajectory: Optional[str] = None,
     db: Session = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
-    """Get list of all members"""
-    from .models import Member
+    """Get list of all members
+    
+    trajectory filters to a cohort by precomputed trend, e.g. 'worsened'.
+    """
+    from .models import Member, MemberTrajectory
     from .schemas import MemberSummary
+    from .trajectories import TRENDS
     from datetime import date
     
-    members = db.query(Member).all()
+    query = db.query(Member)
+    if trajectory:
+        if trajectory not in TRENDS:
+            raise HTTPException(status_code=400, detail=f"trajectory must be one of: {', '.join(TRENDS)}")
+        query = query.join(MemberTrajectory, MemberTrajectory.member_id == Member.id).filter(
+            MemberTrajectory.trend == trajectory
+        )
+    members = query.all()
     
     def calculate_age(birth_date):
         if not birth_date:
@@ -142,7 +181,7 @@ async def list_members(
             "zip_code": zip_code
         })
     
-    return {"members": member_list}
+    return FastJSONResponse({"members": member_list})
 
 @app.get("/members/{member_id}")
 async def get_member_detail(
@@ -187,7 +226,7 @@ async def get_member_detail(
             "high_risk": screening.total_safety_score >= 11 if screening.total_safety_score else False
         })
     
-    return {
+    return FastJSONResponse({
         "member": {
             "id": member.id,
             "name": f"{member.first_name} {member.last_name}".strip(),
@@ -203,11 +242,32 @@ async def get_member_detail(
         },
         "assessments": assessments,
         "assessment_count": len(assessments)
-    }
+    })
 
-@app.post("/fhir/Bundle", response_model=BundleResponse)
+@app.get("/members/{member_id}/trajectory")
+async def get_member_trajectory(
+    member_id: str,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Get the precomputed screening trajectory for a member"""
+    from .models import MemberTrajectory
+    from .trajectories import trajectory_to_dict
+    
+    try:
+        member_uuid = uuid.UUID(member_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    trajectory = db.query(MemberTrajectory).filter(MemberTrajectory.member_id == member_uuid).first()
+    if not trajectory:
+        raise HTTPException(status_code=404, detail="No screenings recorded for this member")
+    
+    return trajectory_to_dict(trajectory)
+
+@app.post("/fhir/Bundle", response_model=BundleResponse, openapi_extra=JSON_BODY_OPENAPI)
 async def receive_fhir_bundle(
-    bundle: Dict[str, Any],
+    request: Request,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     api_key: str = Depends(verify_api_key)
@@ -215,28 +275,45 @@ async def receive_fhir_bundle(
     """
     Receive and process FHIR Bundle containing HRSN screening data
     
-    Validates the bundle structure and queues it for processing
+    Validates the bundle structure and queues it for processing. batch and
+    transaction Bundles are saved before responding, with a
+    batch-response / transaction-response Bundle giving each entry's status.
     """
     try:
         # Generate processing ID
         processing_id = str(uuid.uuid4())
         
+        # Raw body straight to dicts - bundles skip body model validation
+        received_at = datetime.utcnow()
+        timer = StageTimer()
+        bundle = await read_json_body(request)
+        timer.lap("parse")
+        
         # Basic validation
         if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle":
+            bundles_total.inc("document", "rejected")
             raise HTTPException(status_code=400, detail="Invalid FHIR Bundle structure")
         
+        if is_batch(bundle):
+            # Saved before the response, off the event loop
+            return await run_in_threadpool(process_batch_request, bundle, db, processing_id, timer, received_at)
+        
         bundle_id = bundle.get("id")
         if not bundle_id:
+            bundles_total.inc("document", "rejected")
             raise HTTPException(status_code=400, detail="Bundle must have an ID")
         
         logger.info(f"Received FHIR Bundle {bundle_id} for processing {processing_id}")
         
         # Queue for background processing
+        ingest_queue.put(processing_id)
         background_tasks.add_task(
             process_bundle_async, 
             bundle, 
             processing_id, 
-            db_session_maker=get_db
+            db_session_maker=get_db,
+            timer=timer,
+            received_at=received_at
         )
         
         return BundleResponse(
@@ -253,16 +330,61 @@ async def receive_fhir_bundle(
         logger.error(f"Error receiving bundle: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-async def process_bundle_async(bundle: Dict[str, Any], processing_id: str, db_session_maker):
-    """Background task to process FHIR bundle"""
+def process_batch_request(bundle: Dict[str, Any], db: Session, processing_id: str, timer: StageTimer,
+                          received_at: datetime) -> FastJSONResponse:
+    """Save a batch or transaction Bundle now; logged and counted like a queued one"""
+    result, error = None, None
+    try:
+        with timer:
+            status_code, response = process_batch(bundle, db, fhir_processor.process_extraction, timer=timer)
+    except Exception as e:
+        db.rollback()
+        bundles_total.inc(bundle["type"], "failed")
+        record_processing(db, bundle, processing_id, timer, received_at, error=e)
+        raise
+    if status_code == 200:
+        result = processed_counts(response)
+        bundles_total.inc(bundle["type"], "processed")
+        response_cache.bump_generation()
+    else:
+        error = ValueError(response["issue"][0]["diagnostics"])
+        bundles_total.inc(bundle["type"], "failed")
+    record_processing(db, bundle, processing_id, timer, received_at, result, error)
+    return FastJSONResponse(response, status_code=status_code, media_type="application/fhir+json")
+
+async def process_bundle_async(bundle: Dict[str, Any], processing_id: str, db_session_maker,
+                               timer: Optional[StageTimer] = None, received_at: Optional[datetime] = None):
+    """Background task to process FHIR bundle
+    
+    Stage timings and the query count go to the bundle's
+    BundleProcessingLog row (see /admin/slow-bundles).
+    """
+    ingest_queue.take(processing_id)
+    timer = timer or StageTimer()
+    timer.skip()  # Time in the queue is not a stage
+    result, error = None, None
     db = next(db_session_maker())
     try:
         logger.info(f"Starting background processing for {processing_id}")
-        result = await fhir_processor.process_bundle(bundle, db)
+        with timer:
+            result = await fhir_processor.process_bundle(bundle, db, session_factory=SessionLocal, timer=timer)
         logger.info(f"Completed processing {processing_id}: {result}")
+        bundles_total.inc("document", "processed")
+        
+        # New data committed - cached analytics are now stale
+        response_cache.bump_generation()
+    except PartialBundleError as e:
+        # Some partitions committed: the bundle failed, but the cache is stale all the same
+        result, error = e.result, e
+        bundles_total.inc("document", "failed")
+        response_cache.bump_generation()
+        logger.error(f"Background processing partly failed for {processing_id}: {e}")
     except Exception as e:
+        error = e
+        bundles_total.inc("document", "failed")
         logger.error(f"Background processing failed for {processing_id}: {e}")
     finally:
+        record_processing(db, bundle, processing_id, timer, received_at or datetime.utcnow(), result, error)
         db.close()
 
 @app.get("/fhir/Bundle/{bundle_id}")
@@ -311,25 +433,218 @@ async def get_member_referrals(
 
 @app.get("/analytics/dashboard")
 async def get_dashboard_analytics(
+    request: Request,
+    approx: bool = False,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    county: Optional[str] = None,
     db: Session = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
-    """Get dashboard analytics for HRSN data"""
+    """Get dashboard analytics for HRSN data (cached until the next ingest)
+    
+    With approx=true the figures come from merged ZIP/month sketches and
+    include error bounds; start/end ('YYYY-MM') and county (FIPS) limit
+    which partitions are merged.
+    """
     from .analytics_simple import generate_dashboard_data
+    from .sketches import approximate_dashboard
     
-    data = generate_dashboard_data(db)
-    return data
+    if approx:
+        compute = lambda: approximate_dashboard(db, start_month=start, end_month=end, county=county)
+    else:
+        compute = lambda: generate_dashboard_data(db)
+    return response_cache.respond(request, "/analytics/dashboard", compute)
 
 @app.get("/reports/safety-scores")
 async def get_safety_score_report(
+    request: Request,
+    approx: bool = False,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    county: Optional[str] = None,
     db: Session = Depends(get_db),
     api_key: str = Depends(verify_api_key)
 ):
-    """Generate safety score analysis report"""
+    """Generate safety score analysis report (cached until the next ingest)
+    
+    With approx=true percentiles and distinct members come from merged
+    sketches and include error bounds; start/end ('YYYY-MM') and county
+    (FIPS) limit which partitions are merged.
+    """
     from .analytics_simple import analyze_safety_scores
+    from .sketches import approximate_safety_scores
+    
+    if approx:
+        compute = lambda: approximate_safety_scores(db, start_month=start, end_month=end, county=county)
+    else:
+        compute = lambda: analyze_safety_scores(db)
+    return response_cache.respond(request, "/reports/safety-scores", compute)
+
+@app.get("/analytics/geo")
+async def get_geo_analytics(
+    request: Request,
+    level: str = "county",
+    county: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Screening counts by county or ZIP from the pre-aggregated geo rollups
+    
+    level is 'county' (all 62 NY counties) or 'zip'; county filters to one
+    FIPS code and start/end ('YYYY-MM') limit the month window.
+    """
+    from .geo import geo_summary
+    
+    if level not in ("county", "zip"):
+        raise HTTPException(status_code=400, detail="level must be 'county' or 'zip'")
+    
+    return response_cache.respond(
+        request, "/analytics/geo",
+        lambda: geo_summary(db, level=level, county=county, start_month=start, end_month=end)
+    )
+
+@app.post("/api/chatbot")
+async def chatbot_query(
+    query_data: Dict[str, Any],
+    response: Response,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Answer chatbot questions from the precomputed condition flags and aggregates
+    
+    Answers are cached per intent and invalidated by the next ingest.
+    """
+    from .chatbot_db import answer_question
+    
+    question = (query_data.get("question") or "").strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+    
+    result, cache_status = answer_question(db, question)
+    response.headers["X-Cache"] = cache_status
+    return {
+        "question": question,
+        "answer": result["answer"],
+        "data": result.get("data", []),
+        "summary": result.get("summary", {})
+    }
+
+@app.get("/admin/screener-rules")
+async def list_screener_rules(api_key: str = Depends(verify_api_key)):
+    """Loaded screener ruleset versions and the questionnaires each one scores"""
+    from .screener_rules import registry
+    
+    return registry.describe()
+
+@app.post("/admin/screener-rules/reload")
+async def reload_screener_rules(api_key: str = Depends(verify_api_key)):
+    """Recompile the SCREENER_RULES_DIR rulesets now instead of at the next check"""
+    from .screener_rules import registry
+    
+    if not settings.SCREENER_RULES_DIR:
+        raise HTTPException(status_code=400, detail="SCREENER_RULES_DIR is not configured")
+    registry.reload(force=True)
+    return registry.describe()
+
+@app.get("/admin/profile")
+async def profile_server(
+    request: Request,
+    seconds: float = 30,
+    hz: int = 100,
+    idle: bool = False,
+    api_key: str = Depends(verify_api_key)
+):
+    """Sample every thread of this worker for `seconds`; collapsed stacks for a flamegraph
+    
+    idle=true keeps stacks of threads that are only waiting (event loop,
+    idle pool workers).
+    """
+    from .profiler import profile
+    
+    return await profile(request, seconds, hz, idle)
+
+@app.get("/admin/slow-bundles")
+async def get_slow_bundles(
+    stage: str = "total",
+    limit: int = 20,
+    hours: int = 24,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Bundles that spent longest in one ingest stage, or in total, over the last `hours`
+    
+    stage is one of parse, validate, resolve, match, write, commit or total.
+    """
+    if stage not in RANK_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"stage must be one of {', '.join(RANK_COLUMNS)}")
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    return slow_bundles(db, stage, limit, hours)
+
+@app.post("/reports/waiver/{quarter}", status_code=202)
+async def start_waiver_report(
+    quarter: str,
+    background_tasks: BackgroundTasks,
+    restart: bool = False,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Start (or resume) the quarterly CMS waiver report, e.g. /reports/waiver/2024Q4
+    
+    The report runs in the background with checkpoints; poll the GET route
+    for progress. A failed or interrupted run resumes where it stopped
+    unless restart=true.
+    """
+    from .waiver_report import parse_quarter, get_or_create_job, is_job_active, job_status
+    
+    try:
+        parse_quarter(quarter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job = get_or_create_job(db, quarter)
+    if is_job_active(job):
+        raise HTTPException(status_code=409, detail=f"Waiver report {job.quarter} is already running")
+    if job.status == "completed" and not restart:
+        return job_status(job)
+    
+    background_tasks.add_task(run_waiver_report_job, job.quarter, restart)
+    status = job_status(job)
+    status["status"] = "queued"
+    return status
+
+def run_waiver_report_job(quarter: str, restart: bool):
+    """Background task - runs on its own session since it outlives the request"""
+    from .database import SessionLocal
+    from .waiver_report import run_waiver_report, WaiverReportBusy
+    
+    db = SessionLocal()
+    try:
+        run_waiver_report(db, quarter, restart=restart)
+    except WaiverReportBusy as e:
+        logger.info(str(e))
+    except Exception as e:
+        logger.error(f"Waiver report {quarter} failed: {e}")
+    finally:
+        db.close()
+
+@app.get("/reports/waiver/{quarter}")
+async def get_waiver_report(
+    quarter: str,
+    db: Session = Depends(get_db),
+    api_key: str = Depends(verify_api_key)
+):
+    """Progress of a waiver report run, with the report once completed"""
+    from .models import WaiverReportJob
+    from .waiver_report import job_status
     
-    report = analyze_safety_scores(db)
-    return report
+    job = db.query(WaiverReportJob).filter(WaiverReportJob.quarter == quarter.upper()).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="No waiver report for this quarter")
+    return job_status(job)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,336 @@
+# app/member_store.py
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Set, Callable, Tuple
+import bisect
+import heapq
+import logging
+import re
+
+from .config import HRSN_QUESTION_MAPPINGS
+
+logger = logging.getLogger(__name__)
+
+# Chatbot conditions and the HRSN_QUESTION_MAPPINGS categories that flag them
+CONDITION_CATEGORIES = {
+    "food": {"food-insecurity"},
+    "housing": {"housing-instability", "homelessness", "inadequate-housing"},
+    "transportation": {"transportation-insecurity"},
+    "utilities": {"utility-insecurity"},
+    "employment": {"employment-status"}
+}
+# Safety is flagged from the latest screening's total safety score instead
+SAFETY_THRESHOLD = 11
+CONDITIONS = list(CONDITION_CATEGORIES) + ["safety"]
+
+def _build_positive_conditions() -> Dict[tuple, Set[str]]:
+    """(question_code, answer_code) -> conditions that answer flags"""
+    table = {}
+    for question_code, mapping in HRSN_QUESTION_MAPPINGS.items():
+        conditions = {condition for condition, categories in CONDITION_CATEGORIES.items()
+                      if categories.intersection(mapping.get("category", []))}
+        if not conditions:
+            continue
+        for answer_code in mapping.get("positive_answers", []):
+            table[(question_code, answer_code)] = conditions
+    return table
+
+POSITIVE_CONDITIONS = _build_positive_conditions()
+
+# Trailing 5-digit ZIP (optionally ZIP+4) of a formatted address
+ZIP_PATTERN = re.compile(r"\b(\d{5})(?:-\d{4})?\s*$")
+
+class MemberStore:
+    """In-memory member store for the web interface
+
+    Primary records live in dicts keyed by member_id / session_id, with
+    secondary indexes maintained on ingest so every lookup the chatbot makes
+    is a hash probe instead of a scan:
+
+        screenings_by_member   member_id     -> {session_id: screening}
+        responses_by_member    member_id     -> {session_id: [response, ...]}
+        responses_by_question  question_code -> {session_id: [response, ...]}
+
+    Index values are keyed by session so re-uploading a bundle replaces
+    that session's rows instead of duplicating them.
+
+    Condition flags are computed once per session at ingest from the
+    positive answer codes and kept as per-condition member sets, so the
+    chatbot aggregates are set sizes.
+
+    score_ranking is a sorted list of (-latest safety score, member_id)
+    keys, kept in order on ingest, so the overview pages highest risk
+    first without sorting and can resume from a key.
+    """
+
+    def __init__(self):
+        self.members: Dict[str, Dict[str, Any]] = {}
+        self.screenings: Dict[str, Dict[str, Any]] = {}
+        self.session_members: Dict[str, str] = {}
+        self.screenings_by_member: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.responses_by_member: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self.responses_by_question: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self.response_count = 0
+        self.session_response_counts: Dict[str, int] = {}
+        self._response_loader: Optional[Callable[[], Dict[str, List[Dict[str, Any]]]]] = None
+        self.session_conditions: Dict[str, Set[str]] = {}
+        self.condition_members: Dict[str, Set[str]] = {condition: set() for condition in CONDITIONS}
+        self.score_ranking: List[Tuple[int, str]] = []
+        self.ranking_keys: Dict[str, Tuple[int, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def add_result(self, result: Dict[str, Any]):
+        """Index one extraction result (members, screenings, responses)"""
+        for member in result.get("members", []):
+            member_id = member.get("member_id")
+            if member_id and member_id not in self.members:
+                self.members[member_id] = member
+                self._refresh_flags(member_id)
+
+        for screening in result.get("screenings", []):
+            self.add_screening(screening)
+
+        # Group responses by session so each session is indexed in one step
+        by_session: Dict[str, List[Dict[str, Any]]] = {}
+        for response in result.get("responses", []):
+            by_session.setdefault(response.get("session_id"), []).append(response)
+        for session_id, responses in by_session.items():
+            self.add_responses(session_id, responses)
+
+    def add_screening(self, screening: Dict[str, Any]):
+        session_id = screening.get("session_id")
+        member_id = screening.get("member_id")
+        if session_id in self.screenings:
+            self._remove_session(session_id)
+        self.screenings[session_id] = screening
+        self.session_members[session_id] = member_id
+        self.screenings_by_member.setdefault(member_id, {})[session_id] = screening
+        self._refresh_flags(member_id)
+
+    def add_responses(self, session_id: str, responses: List[Dict[str, Any]]):
+        member_id = self.session_members.get(session_id)
+        self._index_responses(session_id, responses)
+        conditions = set()
+        for response in responses:
+            conditions.update(POSITIVE_CONDITIONS.get((response.get("question_code"), response.get("answer_code")), ()))
+        self.session_response_counts[session_id] = len(responses)
+        self.response_count += len(responses)
+        self.session_conditions[session_id] = conditions
+        self._refresh_flags(member_id)
+
+    def _index_responses(self, session_id: str, responses: List[Dict[str, Any]]):
+        member_id = self.session_members.get(session_id)
+        self.responses_by_member.setdefault(member_id, {})[session_id] = responses
+        for response in responses:
+            self.responses_by_question.setdefault(response.get("question_code"), {}).setdefault(session_id, []).append(response)
+
+    def _load_responses(self):
+        """Index responses deferred by restore() the first time they are needed"""
+        if self._response_loader is None:
+            return
+        loader, self._response_loader = self._response_loader, None
+        for session_id, responses in loader().items():
+            self._index_responses(session_id, responses)
+
+    def _remove_session(self, session_id: str):
+        """Drop a session's screening and responses from every index"""
+        self._load_responses()
+        member_id = self.session_members.pop(session_id, None)
+        self.screenings.pop(session_id, None)
+        self.screenings_by_member.get(member_id, {}).pop(session_id, None)
+        responses = self.responses_by_member.get(member_id, {}).pop(session_id, [])
+        for question_code in {r.get("question_code") for r in responses}:
+            self.responses_by_question.get(question_code, {}).pop(session_id, None)
+        self.response_count -= self.session_response_counts.pop(session_id, 0)
+        self.session_conditions.pop(session_id, None)
+        self._refresh_flags(member_id)
+
+    def _refresh_flags(self, member_id: str):
+        """Recompute one member's condition flags from their sessions"""
+        flagged = set()
+        if member_id in self.members:
+            for session_id in self.screenings_by_member.get(member_id, {}):
+                flagged.update(self.session_conditions.get(session_id, ()))
+            if self.latest_screening(member_id).get("total_safety_score", 0) >= SAFETY_THRESHOLD:
+                flagged.add("safety")
+        for condition, members in self.condition_members.items():
+            if condition in flagged:
+                members.add(member_id)
+            else:
+                members.discard(member_id)
+        self._rerank(member_id)
+
+    def _rerank(self, member_id: str):
+        """Move a member to its place in score_ranking after its latest screening changed"""
+        old_key = self.ranking_keys.pop(member_id, None)
+        new_key = None
+        if member_id in self.members:
+            new_key = (-self.latest_screening(member_id).get("total_safety_score", 0), member_id)
+        if old_key == new_key:
+            if new_key:
+                self.ranking_keys[member_id] = new_key
+            return
+        if old_key:
+            del self.score_ranking[bisect.bisect_left(self.score_ranking, old_key)]
+        if new_key:
+            bisect.insort(self.score_ranking, new_key)
+            self.ranking_keys[member_id] = new_key
+
+    def get_member(self, member_id: str) -> Optional[Dict[str, Any]]:
+        return self.members.get(member_id)
+
+    def member_screenings(self, member_id: str) -> List[Dict[str, Any]]:
+        return list(self.screenings_by_member.get(member_id, {}).values())
+
+    def latest_screening(self, member_id: str) -> Dict[str, Any]:
+        """A member's screening with the latest screening_date, or {}
+
+        Bundles may arrive out of order, so this is not the last one
+        ingested; undated screenings rank below dated ones, and of two
+        with the same date the later ingested wins.
+        """
+        latest = {}
+        for screening in self.screenings_by_member.get(member_id, {}).values():
+            if not latest or (screening.get("screening_date") or "") >= (latest.get("screening_date") or ""):
+                latest = screening
+        return latest
+
+    def member_response_count(self, member_id: str) -> int:
+        return sum(self.session_response_counts.get(session_id, 0)
+                   for session_id in self.screenings_by_member.get(member_id, {}))
+
+    def responses_for_questions(self, question_codes: Iterable[str]) -> Iterator[tuple]:
+        """(member_id, response) pairs for the given questions, via the question index"""
+        self._load_responses()
+        for question_code in question_codes:
+            for session_id, responses in self.responses_by_question.get(question_code, {}).items():
+                member_id = self.session_members.get(session_id)
+                for response in responses:
+                    yield member_id, response
+
+    def member_zip(self, member_id: str) -> str:
+        match = ZIP_PATTERN.search(self.members.get(member_id, {}).get("address") or "")
+        return match.group(1) if match else ""
+
+    def matches_slots(self, member_id: str, slots: Dict[str, Any]) -> bool:
+        """Whether a member's ZIP and latest screening fall within chatbot router slots"""
+        if slots.get("zip_code") and self.member_zip(member_id) != slots["zip_code"]:
+            return False
+        screening = self.latest_screening(member_id)
+        score = screening.get("total_safety_score", 0)
+        if score < slots.get("min_score", score) or score > slots.get("max_score", score):
+            return False
+        screening_date = (screening.get("screening_date") or "")[:10]
+        if slots.get("date_from") and not (screening_date and screening_date >= slots["date_from"]):
+            return False
+        if slots.get("date_to") and not (screening_date and screening_date <= slots["date_to"]):
+            return False
+        return True
+
+    def member_ids(self, slots: Optional[Dict[str, Any]] = None) -> Iterable[str]:
+        if not slots:
+            return self.members.keys()
+        return [member_id for member_id in self.members if self.matches_slots(member_id, slots)]
+
+    def ranked_members(self, after: Optional[Tuple[int, str]] = None,
+                       slots: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[Tuple[int, str], str]]:
+        """(ranking key, member_id) pairs, highest latest safety score first
+
+        `after` is the key of the last member already seen, so a caller can
+        resume where it stopped even if members were added in between.
+        """
+        start = bisect.bisect_right(self.score_ranking, tuple(after)) if after else 0
+        for index in range(start, len(self.score_ranking)):
+            key = self.score_ranking[index]
+            if not slots or self.matches_slots(key[1], slots):
+                yield key, key[1]
+
+    def condition_count(self, condition: str, slots: Optional[Dict[str, Any]] = None) -> int:
+        if not slots:
+            return len(self.condition_members[condition])
+        return sum(1 for member_id in self.condition_members[condition] if self.matches_slots(member_id, slots))
+
+    def members_with_condition(self, condition: str, slots: Optional[Dict[str, Any]] = None,
+                               limit: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """How many members within the slots are flagged, and the first `limit` of them in member_id order
+
+        heapq.nsmallest picks the listed members without sorting every
+        flagged one.
+        """
+        member_ids = self.condition_members[condition]
+        if slots:
+            member_ids = [member_id for member_id in member_ids if self.matches_slots(member_id, slots)]
+        listed = sorted(member_ids) if limit is None else heapq.nsmallest(limit, member_ids)
+        return len(member_ids), [self.members[member_id] for member_id in listed]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-data capture of the store with its derived indexes, for persistence
+
+        Responses are returned under their own key so persistence can store
+        them apart from the small core the chatbot needs at startup. The
+        containers are copies; the member, screening and response records
+        in them are shared, which is safe because the store replaces
+        records instead of changing them. The result can therefore be
+        encoded on another thread while the store keeps taking uploads.
+
+        Responses restore() has not decoded yet stay undecoded: the result
+        then carries 'response_loader', and 'responses' holds only the
+        sessions added since (no session was removed, or the store would
+        have loaded them).
+        """
+        data = {
+            "members": list(self.members.values()),
+            "screenings": list(self.screenings.values()),
+            "session_response_counts": dict(self.session_response_counts),
+            "session_conditions": {session_id: sorted(conditions)
+                                   for session_id, conditions in self.session_conditions.items()},
+            "condition_members": {condition: sorted(members)
+                                  for condition, members in self.condition_members.items()},
+            "responses": {session_id: responses
+                          for sessions in self.responses_by_member.values()
+                          for session_id, responses in sessions.items()}
+        }
+        if self._response_loader is not None:
+            data["response_loader"] = self._response_loader
+        return data
+
+    def restore(self, data: Dict[str, Any],
+                response_loader: Optional[Callable[[], Dict[str, List[Dict[str, Any]]]]] = None):
+        """Load a snapshot without re-deriving condition flags
+
+        Condition sets and per-session response counts come from the
+        snapshot, so chatbot answers work immediately. When response_loader
+        is given instead of data['responses'], the response indexes are only
+        built on first use.
+        """
+        self.__init__()
+        for member in data.get("members", []):
+            self.members[member["member_id"]] = member
+        for screening in data.get("screenings", []):
+            session_id = screening.get("session_id")
+            member_id = screening.get("member_id")
+            self.screenings[session_id] = screening
+            self.session_members[session_id] = member_id
+            self.screenings_by_member.setdefault(member_id, {})[session_id] = screening
+        self.session_response_counts = dict(data.get("session_response_counts", {}))
+        self.response_count = sum(self.session_response_counts.values())
+        self.session_conditions = {session_id: set(conditions)
+                                   for session_id, conditions in data.get("session_conditions", {}).items()}
+        for condition, members in data.get("condition_members", {}).items():
+            self.condition_members[condition] = set(members)
+        for member_id in self.members:
+            self.ranking_keys[member_id] = (-self.latest_screening(member_id).get("total_safety_score", 0), member_id)
+        self.score_ranking = sorted(self.ranking_keys.values())
+
+        if "responses" in data:
+            for session_id, responses in data["responses"].items():
+                self._index_responses(session_id, responses)
+        else:
+            self._response_loader = response_loader
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "total_members": len(self.members),
+            "total_screenings": len(self.screenings),
+            "total_responses": self.response_count
+        }
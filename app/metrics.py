@@ -0,0 +1,364 @@
+# app/metrics.py
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from bisect import bisect_left
+from contextvars import ContextVar
+from fastapi.responses import Response
+from sqlalchemy import event
+import threading
+import time
+import weakref
+
+# Latency buckets in seconds, from a cached read to a large bundle
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class _Shard:
+    """One thread's samples; only that thread ever writes to it"""
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = weakref.ref(thread)
+        self.values: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+
+class MetricsRegistry:
+    """Lock-free collection of Prometheus counters, gauges and histograms
+
+    Every thread records into its own shard (a plain dict), so the request
+    path never takes a lock or contends with another thread. A scrape sums
+    the shards; shards of threads that have exited are folded into a
+    retired total, so short-lived worker threads do not accumulate. A
+    scrape racing an observation may see it half applied (a histogram
+    count without its sum) - the next scrape is exact again.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._retired: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, Dict[Tuple[str, ...], float]]]]] = []
+        self._lock = threading.Lock()  # Shard registration and scrapes only
+
+    def _shard(self) -> Dict[Tuple[str, Tuple[str, ...]], Any]:
+        try:
+            return self._local.values
+        except AttributeError:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            self._local.values = shard.values
+            return shard.values
+
+    def register(self, metric: "_Metric") -> "_Metric":
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, Dict[Tuple[str, ...], float]]]]):
+        """Computed at scrape time: [(name, type, help, {label values: value})]; labels are ('label="v"', ...)"""
+        self._collectors.append(collector)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> "Counter":
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> "Gauge":
+        return self.register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> "Histogram":
+        return self.register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _merge(self, into: Dict[Tuple[str, Tuple[str, ...]], Any], values: Dict[Tuple[str, Tuple[str, ...]], Any]):
+        # list() copies the items in one step under the GIL, so the owning
+        # thread can keep adding keys while we read
+        for key, value in list(values.items()):
+            if isinstance(value, list):
+                total = into.get(key)
+                if total is None:
+                    into[key] = list(value)
+                else:
+                    for i, count in enumerate(value):
+                        total[i] += count
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def collect(self) -> Dict[Tuple[str, Tuple[str, ...]], Any]:
+        """Current totals across threads, keyed by (metric name, label values)"""
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                thread = shard.thread()
+                if thread is None or not thread.is_alive():
+                    self._merge(self._retired, shard.values)
+                else:
+                    live.append(shard)
+            self._shards = live
+            totals: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+            self._merge(totals, self._retired)
+            for shard in live:
+                self._merge(totals, shard.values)
+        return totals
+
+    def render(self) -> str:
+        """The Prometheus text exposition format (0.0.4)"""
+        totals = self.collect()
+        by_metric: Dict[str, List[Tuple[Tuple[str, ...], Any]]] = {}
+        for (name, labels), value in totals.items():
+            by_metric.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            samples = sorted(by_metric.get(name, []))
+            if not samples and not metric.labelnames and metric.kind != "histogram":
+                samples = [((), 0)]
+            for labels, value in samples:
+                lines.extend(metric.exposition(labels, value))
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, kind, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values.items():
+                    lines.append(f"{name}{_label_string(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_string(pairs: Tuple[str, ...]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, registry: MetricsRegistry, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _pairs(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        return tuple(f'{label}="{_escape(str(value))}"' for label, value in zip(self.labelnames, labels))
+
+    def exposition(self, labels: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{_label_string(self._pairs(labels))} {_number(value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        values = self.registry._shard()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+class Gauge(Counter):
+    """A gauge whose per-thread increments and decrements sum to the current value"""
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: MetricsRegistry, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...]):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        values = self.registry._shard()
+        key = (self.name, labels)
+        slots = values.get(key)
+        if slots is None:
+            # One count per bucket plus +Inf, then sum and count
+            slots = values[key] = [0] * (len(self.buckets) + 3)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-2] += value
+        slots[-1] += 1
+
+    def exposition(self, labels: Tuple[str, ...], value: List[float]) -> List[str]:
+        pairs = self._pairs(labels)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), value):
+            cumulative += count
+            bucket = 'le="' + _number(bound) + '"'
+            lines.append(f"{self.name}_bucket{_label_string(pairs + (bucket,))} {int(cumulative)}")
+        lines.append(f"{self.name}_sum{_label_string(pairs)} {_number(value[-2])}")
+        lines.append(f"{self.name}_count{_label_string(pairs)} {int(value[-1])}")
+        return lines
+
+registry = MetricsRegistry()
+
+http_requests_in_flight = registry.gauge(
+    "hrsn_http_requests_in_flight", "HTTP requests being handled")
+http_request_duration = registry.histogram(
+    "hrsn_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"))
+bundles_total = registry.counter(
+    "hrsn_bundles_total", "FHIR Bundles received, by kind (document, batch, transaction, web) and outcome",
+    ("kind", "status"))
+ingest_stage_duration = registry.histogram(
+    "hrsn_ingest_stage_seconds", "Time spent in each ingest stage", ("stage",))
+ingest_queue_depth = registry.gauge(
+    "hrsn_ingest_queue_depth", "Bundles accepted and waiting for background processing")
+ingest_queue_wait = registry.histogram(
+    "hrsn_ingest_queue_wait_seconds", "Time from acceptance until background processing starts")
+db_checkout_wait = registry.histogram(
+    "hrsn_db_pool_checkout_seconds", "Wait for a pooled database connection (includes opening a new one)",
+    ("pool",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+# Stages of a bundle's ingest, in order; BundleProcessingLog has a <stage>_ms column for each
+INGEST_STAGES = ("parse", "validate", "resolve", "match", "write", "commit")
+
+# The bundle timer active in this context, which statements are counted into
+_active_timer: ContextVar[Optional["StageTimer"]] = ContextVar("active_stage_timer", default=None)
+
+class StageTimer:
+    """Times the consecutive ingest stages of one bundle
+
+    timer.lap("match") closes the stage just finished, feeding the
+    hrsn_ingest_stage_seconds histogram and the timer's own durations (a
+    stage lapped twice accumulates). Inside `with timer:` every statement
+    on an instrumented engine is counted into timer.queries, including
+    those of threads started with a copy of the context.
+    """
+    __slots__ = ("started", "durations", "_statements", "_token")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self._statements: List[None] = []
+        self._token = None
+
+    def lap(self, stage: str, observe: bool = True):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        if observe:
+            ingest_stage_duration.observe(elapsed, stage)
+        self.durations[stage] = self.durations.get(stage, 0.0) + elapsed
+        self.started = now
+
+    def skip(self):
+        """Start the next stage now, leaving out the time since the last lap (a queue wait)"""
+        self.started = time.perf_counter()
+
+    @property
+    def queries(self) -> int:
+        return len(self._statements)
+
+    def __enter__(self) -> "StageTimer":
+        self._token = _active_timer.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_timer.reset(self._token)
+
+def _count_statement(*_):
+    timer = _active_timer.get()
+    if timer is not None:
+        # list.append is atomic, so partition threads can share the timer
+        timer._statements.append(None)
+
+class IngestQueue:
+    """Depth, oldest age and wait of bundles queued for background processing
+
+    Only single dict operations (atomic under the GIL) on the request path.
+    """
+
+    def __init__(self):
+        self._enqueued: Dict[str, float] = {}
+
+    def put(self, processing_id: str):
+        self._enqueued[processing_id] = time.monotonic()
+        ingest_queue_depth.inc()
+
+    def take(self, processing_id: str):
+        enqueued = self._enqueued.pop(processing_id, None)
+        if enqueued is not None:
+            ingest_queue_depth.dec()
+            ingest_queue_wait.observe(time.monotonic() - enqueued)
+
+    def oldest_age(self) -> float:
+        waiting = list(self._enqueued.values())
+        return time.monotonic() - min(waiting) if waiting else 0.0
+
+ingest_queue = IngestQueue()
+
+registry.add_collector(lambda: [(
+    "hrsn_ingest_queue_oldest_age_seconds", "gauge", "Age of the oldest bundle still waiting for processing",
+    {(): ingest_queue.oldest_age()}
+)])
+
+def instrument_engine(engine, name: str = "default"):
+    """Time every pool checkout, count statements for StageTimer, and report the pool's occupancy at scrape time"""
+    event.listen(engine, "before_cursor_execute", _count_statement)
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        finally:
+            db_checkout_wait.observe(time.perf_counter() - started, name)
+
+    pool.connect = timed_connect
+
+    def occupancy():
+        labels = (f'pool="{_escape(name)}"',)
+        samples = []
+        for method, metric, documentation in (("checkedout", "hrsn_db_pool_checked_out", "Connections in use"),
+                                              ("size", "hrsn_db_pool_size", "Configured pool size"),
+                                              ("overflow", "hrsn_db_pool_overflow", "Connections opened beyond the pool size")):
+            if hasattr(pool, method):
+                # QueuePool counts overflow from -size until the pool is full
+                samples.append((metric, "gauge", documentation, {labels: max(0, getattr(pool, method)())}))
+        return samples
+
+    registry.add_collector(occupancy)
+
+class MetricsMiddleware:
+    """Per-route latency and in-flight requests for an ASGI app
+
+    The route label is the matched path template (/members/{member_id}),
+    never the raw path, so label cardinality stays bounded; requests that
+    match no route are labelled "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"],
+                                          getattr(route, "path", None) or "unmatched", str(status[0]))
+
+def metrics_response() -> Response:
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, Text, ForeignKey, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -156,4 +156,121 @@ class BundleProcessingLog(Base):
     screenings_created = Column(Integer, default=0)
     started_at = Column(DateTime, default=func.now())
     completed_at = Column(DateTime)
-    created_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+    
+    # Time in each ingest stage (metrics.INGEST_STAGES), excluding the queue wait
+    parse_ms = Column(Float)
+    validate_ms = Column(Float)
+    resolve_ms = Column(Float)
+    match_ms = Column(Float)
+    write_ms = Column(Float)
+    commit_ms = Column(Float)
+    duration_ms = Column(Float, index=True)  # Sum of the stages
+    query_count = Column(Integer)
+
+class ScreeningSketch(Base):
+    """Mergeable approximate statistics for one ZIP code and month"""
+    __tablename__ = "screening_sketches"
+    __table_args__ = (UniqueConstraint("zip_code", "month", name="uq_screening_sketch_partition"),)
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    zip_code = Column(String(10), nullable=False, default="")  # 5-digit ZIP, '' if unknown
+    month = Column(String(7), nullable=False)  # 'YYYY-MM' of screening date
+    screening_count = Column(Integer, default=0)
+    high_risk_count = Column(Integer, default=0)  # Safety score >= 11
+    member_hll = Column(LargeBinary)        # HyperLogLog of member IDs
+    safety_score_kll = Column(LargeBinary)  # KLL sketch of total safety scores
+    positive_count_kll = Column(LargeBinary)  # KLL sketch of positive screen counts
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class GeoRollup(Base):
+    """Incrementally maintained screening counts per county, ZIP and month"""
+    __tablename__ = "geo_rollups"
+    __table_args__ = (
+        UniqueConstraint("county_fips", "zip_code", "month", "dimension", "value", name="uq_geo_rollup_cell"),
+        Index("ix_geo_rollups_county_month", "county_fips", "month"),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    county_fips = Column(String(7), nullable=False)  # 5-digit FIPS or 'unknown'
+    zip_code = Column(String(10), nullable=False, default="")
+    month = Column(String(7), nullable=False)  # 'YYYY-MM' of screening date
+    dimension = Column(String(20), nullable=False)  # 'screenings', 'risk_level', 'sdoh_category'
+    value = Column(String(50), nullable=False, default="")  # e.g. 'high', 'food-insecurity'
+    count = Column(Integer, default=0)
+
+class MemberTrajectory(Base):
+    """Precomputed comparison of a member's two most recent screenings"""
+    __tablename__ = "member_trajectories"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    member_id = Column(UUID(as_uuid=True), ForeignKey("members.id"), nullable=False, unique=True)
+    screening_count = Column(Integer, default=0)
+    latest_screening_id = Column(UUID(as_uuid=True))
+    latest_screening_date = Column(DateTime)
+    latest_safety_score = Column(Integer)
+    latest_positive_categories = Column(Text)    # JSON list of SDOH categories
+    previous_screening_id = Column(UUID(as_uuid=True))
+    previous_screening_date = Column(DateTime)
+    previous_safety_score = Column(Integer)
+    previous_positive_categories = Column(Text)  # JSON list of SDOH categories
+    safety_score_delta = Column(Integer)         # latest - previous
+    days_between_screenings = Column(Integer)
+    resolved_categories = Column(Text)           # JSON list: positive before, not now
+    new_categories = Column(Text)                # JSON list: newly positive
+    trend = Column(String(20), index=True)       # 'baseline', 'improved', 'worsened', 'unchanged'
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    # Relationships
+    member = relationship("Member")
+
+class WaiverReportJob(Base):
+    """Checkpointed state of a quarterly CMS waiver report run"""
+    __tablename__ = "waiver_report_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    quarter = Column(String(6), unique=True, nullable=False)  # e.g. '2024Q4'
+    status = Column(String(20))  # 'pending', 'running', 'completed', 'failed'
+    stage = Column(String(20))   # 'screenings', 'responses', 'referrals', 'eligibility'
+    partition_start = Column(DateTime)  # Day partition the cursor is in
+    last_id = Column(UUID(as_uuid=True))  # Last row id committed in that partition
+    rows_processed = Column(Integer, default=0)
+    state = Column(Text)   # JSON accumulator state (counters + HLL sketches)
+    result = Column(Text)  # JSON report once completed
+    error_message = Column(Text)
+    started_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now())
+    completed_at = Column(DateTime)
+
+class MemberConditionFlags(Base):
+    """Per-member chatbot condition flags, maintained at ingest"""
+    __tablename__ = "member_condition_flags"
+    __table_args__ = (
+        Index("ix_member_condition_flags_food", "food", "latest_safety_score"),
+        Index("ix_member_condition_flags_housing", "housing", "latest_safety_score"),
+        Index("ix_member_condition_flags_transportation", "transportation", "latest_safety_score"),
+        Index("ix_member_condition_flags_utilities", "utilities", "latest_safety_score"),
+        Index("ix_member_condition_flags_employment", "employment", "latest_safety_score"),
+        Index("ix_member_condition_flags_safety", "safety", "latest_safety_score"),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    member_id = Column(UUID(as_uuid=True), ForeignKey("members.id"), nullable=False, unique=True)
+    food = Column(Boolean, default=False)
+    housing = Column(Boolean, default=False)
+    transportation = Column(Boolean, default=False)
+    utilities = Column(Boolean, default=False)
+    employment = Column(Boolean, default=False)
+    safety = Column(Boolean, default=False)  # Latest safety score >= 11
+    screening_count = Column(Integer, default=0)
+    latest_screening_id = Column(UUID(as_uuid=True))
+    latest_screening_date = Column(DateTime)
+    latest_safety_score = Column(Integer, index=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class ChatbotAggregate(Base):
+    """Running totals behind chatbot answers (members per condition, screenings)"""
+    __tablename__ = "chatbot_aggregates"
+    
+    name = Column(String(30), primary_key=True)  # Condition name, 'screened_members' or 'screenings'
+    value = Column(Integer, default=0)
@@ -0,0 +1,164 @@
+# app/profiler.py
+from typing import Dict, Any, Optional, Tuple
+from types import CodeType, FrameType
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SECONDS = 300
+MAX_HZ = 1000
+DISCONNECT_POLL_SECONDS = 0.5  # How often a running profile checks that its client is still there
+
+# Leaf frames of a thread that is only waiting (event loop select, idle
+# pool worker, lock wait); dropped unless idle stacks are asked for
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker")
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ProfilerBusy(Exception):
+    pass
+
+class SamplingProfiler:
+    """In-process sampling profiler for every thread, with collapsed-stack output
+
+    A sampler thread reads sys._current_frames() `hz` times a second and
+    counts each thread's stack. Nothing is installed while no profile runs
+    (no sys.setprofile or settrace), so an idle profiler costs nothing;
+    while one runs, the cost is the sampler briefly holding the GIL once
+    per tick. Only one profile runs at a time, and only in this process -
+    with several uvicorn workers, each request profiles the worker that
+    serves it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: Dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Dict[str, int] = {}
+        self._samples = 0
+        self._started = 0.0
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(ROOT + os.sep):
+                filename = os.path.relpath(filename, ROOT)
+            else:
+                filename = "/".join(filename.split(os.sep)[-2:])
+            # Collapsed stacks separate frames with ';' and the count with a space
+            label = f"{filename}:{code.co_name}".replace(";", ":").replace(" ", "_")
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame: FrameType, thread_name: str, idle: bool) -> Optional[str]:
+        code = frame.f_code
+        if not idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+            return None
+        frames = []
+        while frame is not None:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        frames.append(thread_name.replace(";", ":").replace(" ", "_"))
+        return ";".join(reversed(frames))
+
+    def _run(self, interval: float, idle: bool):
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = self._stack(frame, names.get(ident, f"thread-{ident}"), idle)
+                if stack is not None:
+                    self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            self._samples += 1
+            del frames
+            next_tick += interval
+            # Fall behind rather than catch up in a burst under load
+            delay = next_tick - time.perf_counter()
+            if delay < 0:
+                next_tick = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def start(self, hz: int = 100, idle: bool = False):
+        """Begin sampling; ProfilerBusy if a profile is already running"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        self._stacks = {}
+        self._samples = 0
+        self._started = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(1.0 / hz, idle),
+                                        name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Tuple[str, Dict[str, Any]]:
+        """End sampling: (collapsed stacks, most frequent first; summary)"""
+        try:
+            self._stop.set()
+            self._thread.join()
+            collapsed = "".join(f"{stack} {count}\n" for stack, count in
+                                sorted(self._stacks.items(), key=lambda item: -item[1]))
+            summary = {
+                "seconds": round(time.perf_counter() - self._started, 3),
+                "samples": self._samples,
+                "stacks": len(self._stacks)
+            }
+            return collapsed, summary
+        finally:
+            self._thread = None
+            self._stacks = {}
+            self._lock.release()
+
+profiler = SamplingProfiler()
+
+async def profile(request: Request, seconds: float = 30, hz: int = 100, idle: bool = False) -> Response:
+    """Sample every thread for `seconds` and answer with collapsed stacks (flamegraph.pl, speedscope)
+
+    The request just sleeps on the event loop while the sampler thread
+    works, waking every DISCONNECT_POLL_SECONDS to check the client is
+    still connected. If it went away, the profile stops early.
+    """
+    if not 0 < seconds <= MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_SECONDS}")
+    if not 1 <= hz <= MAX_HZ:
+        raise HTTPException(status_code=400, detail=f"hz must be between 1 and {MAX_HZ}")
+    try:
+        profiler.start(hz, idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        deadline = time.perf_counter() + seconds
+        while (remaining := deadline - time.perf_counter()) > 0:
+            await asyncio.sleep(min(remaining, DISCONNECT_POLL_SECONDS))
+            if await request.is_disconnected():
+                logger.info("Profile client disconnected, stopping early")
+                break
+    finally:
+        # Joining the sampler thread blocks, so not on the event loop
+        collapsed, summary = await asyncio.to_thread(profiler.stop)
+    logger.info(f"Profiled {summary['seconds']}s: {summary['samples']} samples, {summary['stacks']} distinct stacks")
+    return Response(content=collapsed, media_type="text/plain", headers={
+        "X-Profile-Seconds": str(summary["seconds"]),
+        "X-Profile-Samples": str(summary["samples"])
+    })
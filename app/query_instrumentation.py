@@ -0,0 +1,176 @@
+# app/query_instrumentation.py
+from typing import Dict, Any, Optional, Tuple
+from contextvars import ContextVar
+from functools import lru_cache
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+import logging
+import re
+import time
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Literals and bind placeholders of every paramstyle become ?, so one
+# statement run with different values has one fingerprint
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+EXPLAINABLE = ("SELECT", "WITH")
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """A statement with its values stripped: SELECT ... WHERE id = ? AND code IN (...)"""
+    text = _STRING.sub("?", statement)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(...)", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+class RequestQueries:
+    """Statements one request ran: count, total time and repeats per fingerprint"""
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Dict[str, int] = {}
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def most_repeated(self) -> Tuple[Optional[str], int]:
+        """The fingerprint run most often, and how often"""
+        repeats: Dict[str, int] = {}
+        for statement, count in self.statements.items():
+            key = fingerprint(statement)
+            repeats[key] = repeats.get(key, 0) + count
+        if not repeats:
+            return None, 0
+        key = max(repeats, key=repeats.get)
+        return key, repeats[key]
+
+# The request whose statements are being recorded in this context. Sync
+# endpoints and streaming bodies run in threads with a copy of the
+# context, so they record into the same object.
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_instrumentation_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    queries = _current.get()
+    if queries is not None:
+        queries.record(statement, elapsed)
+    if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS and not executemany:
+        _log_slow_query(conn, cursor, statement, parameters, elapsed)
+
+def instrument_queries(engine):
+    """Time every statement on the engine, for request totals and the slow-query log"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def explain(conn, cursor, statement: str, parameters: Any) -> Optional[str]:
+    """The plan of a read statement, run on a bare DBAPI cursor so it skips the engine's events
+
+    On Postgres the EXPLAIN runs inside a savepoint, so a failure cannot
+    abort the caller's transaction.
+    """
+    if not statement.lstrip()[:6].upper().startswith(EXPLAINABLE):
+        return None
+    sqlite = conn.dialect.name == "sqlite"
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if not sqlite:
+            explain_cursor.execute("SAVEPOINT query_explain")
+        try:
+            explain_cursor.execute(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement, parameters)
+            rows = explain_cursor.fetchall()
+        finally:
+            if not sqlite:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT query_explain")
+                explain_cursor.execute("RELEASE SAVEPOINT query_explain")
+    finally:
+        explain_cursor.close()
+    return "\n".join(" | ".join(str(value) for value in row) for row in rows)
+
+def _log_slow_query(conn, cursor, statement: str, parameters: Any, elapsed: float):
+    try:
+        plan = explain(conn, cursor, statement, parameters)
+    except Exception as e:
+        plan = f"(EXPLAIN failed: {e})"
+    logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {fingerprint(statement)}"
+                   + (f"\nPlan:\n{plan}" if plan else ""))
+
+def report_request(method: str, route: str, queries: RequestQueries):
+    """Log a request that ran too many statements, spent too long in them, or repeated one (likely N+1)"""
+    repeated, repeats = queries.most_repeated()
+    over_count = queries.count > settings.QUERY_LOG_MAX_COUNT
+    over_time = queries.seconds * 1000 > settings.QUERY_LOG_MAX_MS
+    n_plus_one = repeats >= settings.QUERY_REPEAT_THRESHOLD
+    if not (over_count or over_time or n_plus_one):
+        return
+    message = f"{method} {route} ran {queries.count} queries in {queries.seconds * 1000:.0f} ms"
+    if repeats > 1:
+        message += f"; {repeats}x {'(likely N+1) ' if n_plus_one else ''}{repeated}"
+    logger.warning(message)
+
+class QueryInstrumentationMiddleware:
+    """Statement count and time per request
+
+    Requests over the QUERY_LOG_* limits, or repeating a statement
+    QUERY_REPEAT_THRESHOLD times, are logged with the repeated statement's
+    fingerprint. With debug_headers the response carries X-Query-Count and
+    X-Query-Time-Ms; those are the statements run before the response
+    started, so a streamed body's later queries are only in the log.
+    Recording ends with the last body chunk: background tasks run after
+    it and are not charged to the request.
+    """
+
+    def __init__(self, app, debug_headers: bool = False):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries()
+        reported = False
+
+        def finish():
+            nonlocal reported
+            if not reported:
+                reported = True
+                route = getattr(scope.get("route"), "path", None) or scope["path"]
+                report_request(scope["method"], route, queries)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(queries.count)
+                headers["X-Query-Time-Ms"] = f"{queries.seconds * 1000:.1f}"
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # The response is complete; what runs next (background tasks) is not this request's
+                _current.set(None)
+                finish()
+
+        token = _current.set(queries)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            finish()  # No final body was sent, e.g. the app raised
@@ -0,0 +1,224 @@
+# app/screener_rules.py
+from typing import Dict, Any, List, Optional, Set, Tuple
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from .config import settings, HRSN_QUESTION_MAPPINGS
+
+logger = logging.getLogger(__name__)
+
+# (safety score, positive, category bits, primary category) for one (question, answer) pair
+Decision = Tuple[int, bool, int, Optional[str]]
+NO_DECISION: Decision = (0, False, 0, None)
+
+NY_HRSN_QUESTIONNAIRE = "http://shinny.org/us/ny/hrsn/Questionnaire/NYSAHCHRSN"
+AHC_HRSN_QUESTIONNAIRE = "http://loinc.org/q/96777-8"
+
+# The CMS AHC core screener: the NY 12 questions without the supplemental
+# housing quality, employment and education items
+AHC_CORE_QUESTIONS = [
+    "71802-3", "96779-4", "88122-7", "88123-5", "93030-5",
+    "95618-5", "95617-7", "95616-9", "95615-1", "95614-4"
+]
+
+class ScreenerRules:
+    """One screener definition compiled into a decision table
+
+    Question and answer codes are interned, categories get dense bit
+    positions, and every scored or positive answer becomes one shared
+    Decision tuple in `decisions`, keyed by (question_code, answer_code).
+    Scoring an answer is then a single dict lookup; answers the table does
+    not list decide nothing (NO_DECISION).
+
+    A positive answer sets the bits of every category its question lists.
+    The question's first category is its primary one, the single value
+    kept in ScreeningResponse.sdoh_category (`question_categories`).
+    """
+
+    def __init__(self, name: str, version: int, mappings: Dict[str, Dict[str, Any]],
+                 questionnaires: Optional[List[str]] = None):
+        self.name = name
+        self.version = int(version)
+        self.key = f"{name}@{self.version}"
+        self.questionnaires = [url.split("|")[0] for url in (questionnaires or [])]
+        self.questions = frozenset(sys.intern(code) for code in mappings)
+
+        self.question_categories: Dict[str, Optional[str]] = {}
+        self.categories: List[str] = []
+        category_bits: Dict[str, int] = {}
+        interned: Dict[Decision, Decision] = {}
+        self.decisions: Dict[Tuple[str, str], Decision] = {}
+
+        for question_code, mapping in mappings.items():
+            question_code = sys.intern(question_code)
+            categories = mapping.get("category") or []
+            category = categories[0] if categories else None
+            self.question_categories[question_code] = category
+            bits = 0
+            for name in categories:
+                if name not in category_bits:
+                    category_bits[name] = 1 << len(self.categories)
+                    self.categories.append(name)
+                bits |= category_bits[name]
+
+            scores = mapping.get("score_mapping", {}) if mapping.get("safety_question") else {}
+            positive_answers = frozenset(mapping.get("positive_answers", []))
+            for answer_code in set(scores) | positive_answers:
+                positive = answer_code in positive_answers
+                decision = (scores.get(answer_code, 0), positive, bits if positive else 0, category)
+                decision = interned.setdefault(decision, decision)
+                self.decisions[(question_code, sys.intern(answer_code))] = decision
+
+    def decide(self, question_code: Optional[str], answer_code: Optional[str]) -> Decision:
+        """Score and positivity of one answer"""
+        return self.decisions.get((question_code, answer_code), NO_DECISION)
+
+    def category_names(self, bits: int) -> Set[str]:
+        """Categories whose bits are set in a positive-category mask"""
+        return {category for position, category in enumerate(self.categories) if bits >> position & 1}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "key": self.key,
+            "questionnaires": self.questionnaires,
+            "questions": len(self.questions),
+            "decisions": len(self.decisions)
+        }
+
+def builtin_rules() -> List[ScreenerRules]:
+    """Rulesets shipped with the server, built from HRSN_QUESTION_MAPPINGS"""
+    return [
+        ScreenerRules("ny-hrsn-12", 1, HRSN_QUESTION_MAPPINGS, [NY_HRSN_QUESTIONNAIRE]),
+        ScreenerRules("ahc-hrsn", 1, {code: HRSN_QUESTION_MAPPINGS[code] for code in AHC_CORE_QUESTIONS},
+                      [AHC_HRSN_QUESTIONNAIRE])
+    ]
+
+def load_rules_file(path: str) -> ScreenerRules:
+    """A ruleset from JSON: {"name", "version", "questionnaires", "questions": {...}}
+
+    "questions" uses the HRSN_QUESTION_MAPPINGS layout.
+    """
+    with open(path) as f:
+        definition = json.load(f)
+    if not definition.get("name") or not isinstance(definition.get("questions"), dict):
+        raise ValueError(f"{path}: a ruleset needs a name and a questions mapping")
+    return ScreenerRules(definition["name"], definition.get("version", 1),
+                         definition["questions"], definition.get("questionnaires", []))
+
+class RulesRegistry:
+    """Every loaded ruleset version, with the newest version serving each questionnaire
+
+    The registry state is one dict replaced wholesale on reload, so a
+    request always scores a bundle against one consistent set of tables.
+    Rule files in SCREENER_RULES_DIR are re-checked at most every
+    SCREENER_RULES_CHECK_SECONDS and recompiled only when one changes.
+    """
+
+    def __init__(self, rules_dir: str = "", default_name: str = "ny-hrsn-12", check_seconds: int = 30):
+        self.rules_dir = rules_dir
+        self.default_name = default_name
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._signature: Optional[tuple] = None
+        self._checked_at = 0.0
+        self._state = self._build([])
+
+    def _build(self, loaded: List[ScreenerRules]) -> Dict[str, Any]:
+        versions: Dict[str, ScreenerRules] = {}
+        latest: Dict[str, ScreenerRules] = {}
+        for rules in builtin_rules() + loaded:
+            versions[rules.key] = rules
+            if rules.name not in latest or rules.version >= latest[rules.name].version:
+                latest[rules.name] = rules
+
+        by_questionnaire: Dict[str, ScreenerRules] = {}
+        for rules in latest.values():
+            for url in rules.questionnaires:
+                by_questionnaire[url] = rules
+
+        default = latest.get(self.default_name)
+        if default is None:
+            logger.warning(f"Unknown screener ruleset {self.default_name}, defaulting to ny-hrsn-12")
+            default = latest["ny-hrsn-12"]
+        return {"versions": versions, "latest": latest, "by_questionnaire": by_questionnaire, "default": default}
+
+    def _file_signature(self) -> tuple:
+        try:
+            names = sorted(name for name in os.listdir(self.rules_dir) if name.endswith(".json"))
+        except OSError:
+            return ()
+        signature = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.rules_dir, name))
+            except OSError:
+                continue
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile the rule files if any changed; True when the tables were swapped"""
+        if not self.rules_dir:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._file_signature()
+            if signature == self._signature and not force:
+                return False
+
+            loaded = []
+            for name, _, _ in signature:
+                path = os.path.join(self.rules_dir, name)
+                try:
+                    loaded.append(load_rules_file(path))
+                except (OSError, ValueError, TypeError, AttributeError) as e:
+                    # Skip a broken file; the other rulesets still load
+                    logger.error(f"Skipping screener ruleset {path}: {e}")
+            self._state = self._build(loaded)
+            self._signature = signature
+            logger.info(f"Loaded screener rulesets: {', '.join(sorted(self._state['versions']))}")
+            return True
+
+    def _maybe_reload(self):
+        if self.rules_dir and time.monotonic() - self._checked_at >= self.check_seconds:
+            self.reload()
+
+    def for_questionnaire(self, questionnaire: Optional[str]) -> ScreenerRules:
+        """Ruleset for a QuestionnaireResponse's questionnaire canonical (version suffix ignored)"""
+        self._maybe_reload()
+        state = self._state
+        if questionnaire:
+            rules = state["by_questionnaire"].get(questionnaire.split("|")[0])
+            if rules is not None:
+                return rules
+        return state["default"]
+
+    def get(self, name: str, version: Optional[int] = None) -> Optional[ScreenerRules]:
+        """A ruleset by name, the newest version unless one is given"""
+        self._maybe_reload()
+        state = self._state
+        if version is None:
+            return state["latest"].get(name)
+        return state["versions"].get(f"{name}@{int(version)}")
+
+    def default(self) -> ScreenerRules:
+        self._maybe_reload()
+        return self._state["default"]
+
+    def describe(self) -> Dict[str, Any]:
+        state = self._state
+        return {
+            "default": state["default"].key,
+            "rulesets": [rules.describe() for rules in state["versions"].values()],
+            "questionnaires": {url: rules.key for url, rules in state["by_questionnaire"].items()}
+        }
+
+registry = RulesRegistry(settings.SCREENER_RULES_DIR, settings.SCREENER_RULES_DEFAULT,
+                         settings.SCREENER_RULES_CHECK_SECONDS)
+registry.reload()
@@ -0,0 +1,422 @@
+# app/sketches.py
+from typing import Dict, Any, List, Optional, Iterable
+from sqlalchemy.orm import Session
+from sqlalchemy import event, func, or_, tuple_
+from datetime import datetime
+import hashlib
+import json
+import logging
+import math
+import random
+import uuid
+
+from .cache import response_cache
+from .models import Member, ScreeningSession, ScreeningSketch
+from .geo import UNKNOWN_COUNTY, UPSERT_INSERTS, get_zip_county_table
+
+logger = logging.getLogger(__name__)
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with mergeable registers
+
+    With the default precision of 12 (4096 one-byte registers) the relative
+    standard error is 1.04 / sqrt(4096) ~= 1.6%, regardless of how many
+    members are added.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value: str):
+        """Add a value (e.g. a member ID) to the sketch"""
+        hashed = int.from_bytes(hashlib.sha1(str(value).encode("utf-8")).digest()[:8], "big")
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """Merge another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Small-range correction (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "HyperLogLog":
+        if not data:
+            return cls()
+        return cls(precision=data[0], registers=data[1:])
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang & Liberty) with mergeable compactors
+
+    Items at compactor level h stand for 2**h original values. Space is
+    O(k) and the normalized rank error is roughly 2.296 / k**0.9723, which
+    is ~1.3% for the default k=200.
+    """
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.compactors: List[List[float]] = [[]]
+        self._rng = random.Random(k)
+
+    @property
+    def rank_error(self) -> float:
+        return 2.296 / (self.k ** 0.9723)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(int(math.ceil(self.k * (2.0 / 3.0) ** depth)), 2)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _size(self) -> int:
+        return sum(len(c) for c in self.compactors)
+
+    def update(self, value: float):
+        """Add a single value"""
+        self.compactors[0].append(value)
+        self.n += 1
+        if self._size() >= self._max_size():
+            self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        """Merge another sketch into this one"""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            compactor = self.compactors[level]
+            if len(compactor) >= self._capacity(level):
+                if level + 1 >= len(self.compactors):
+                    self.compactors.append([])
+                compactor.sort()
+                # Keep the odd item out at this level, promote every other item
+                kept = [compactor.pop()] if len(compactor) % 2 else []
+                offset = self._rng.randint(0, 1)
+                self.compactors[level + 1].extend(compactor[offset::2])
+                self.compactors[level] = kept
+                if self._size() < self._max_size():
+                    break
+            level += 1
+
+    def _weighted_items(self) -> List[tuple]:
+        items = []
+        for level, compactor in enumerate(self.compactors):
+            weight = 1 << level
+            items.extend((value, weight) for value in compactor)
+        items.sort()
+        return items
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate value at quantile q (0..1)"""
+        items = self._weighted_items()
+        if not items:
+            return None
+        total = sum(weight for _, weight in items)
+        target = q * total
+        cumulative = 0
+        for value, weight in items:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return items[-1][0]
+
+    def mean(self) -> Optional[float]:
+        items = self._weighted_items()
+        total = sum(weight for _, weight in items)
+        if not total:
+            return None
+        return sum(value * weight for value, weight in items) / total
+
+    def histogram(self) -> Dict[str, int]:
+        """Approximate count per distinct retained value"""
+        items = self._weighted_items()
+        total = sum(weight for _, weight in items)
+        scale = self.n / total if total else 0
+        counts: Dict[str, float] = {}
+        for value, weight in items:
+            key = str(int(value)) if float(value).is_integer() else str(value)
+            counts[key] = counts.get(key, 0) + weight * scale
+        return {key: int(round(count)) for key, count in counts.items()}
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({"k": self.k, "n": self.n, "c": self.compactors}, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "KLLSketch":
+        if not data:
+            return cls()
+        state = json.loads(data.decode("utf-8"))
+        sketch = cls(k=state["k"])
+        sketch.n = state["n"]
+        sketch.compactors = state["c"]
+        return sketch
+
+def _partition_zip(member: Member) -> str:
+    """Normalise a member ZIP to its 5-digit form for sketch partitioning"""
+    return (member.zip_code or "")[:5]
+
+def _partition_month(screening: ScreeningSession) -> str:
+    screening_date = screening.screening_date or datetime.utcnow()
+    return screening_date.strftime("%Y-%m")
+
+# Session.info keys: (zip, month) -> observations not yet merged into their
+# partition, and savepoint -> how many each key had when it began
+PENDING_SKETCHES = "screening_sketch_observations"
+SAVEPOINT_SKETCHES = "screening_sketch_savepoints"
+
+def record_screening(db: Session, member: Member, screening: ScreeningSession):
+    """Queue a newly ingested screening for its ZIP/month sketch partition
+
+    Runs inside the ingest transaction. The partition rows are locked,
+    decoded, updated and re-encoded once per transaction, when it commits
+    (flush_screening_sketches), rather than once per screening, so the
+    sketch commits together with the screenings it describes.
+    """
+    if PENDING_SKETCHES not in db.info:
+        _watch_session(db)
+    key = (_partition_zip(member), _partition_month(screening))
+    db.info[PENDING_SKETCHES].setdefault(key, []).append(
+        (str(member.id), screening.total_safety_score or 0, screening.positive_screens_count or 0))
+
+def _watch_session(db: Session):
+    db.info[PENDING_SKETCHES] = {}
+    # Savepoints already open hold no observations yet
+    transaction = db.get_nested_transaction()
+    while transaction is not None and transaction.nested:
+        db.info.setdefault(SAVEPOINT_SKETCHES, {})[transaction] = {}
+        transaction = transaction.parent
+    event.listen(db, "before_commit", _flush_before_commit)
+    event.listen(db, "after_transaction_create", _snapshot_pending)
+    event.listen(db, "after_soft_rollback", _discard_pending)
+
+def flush_screening_sketches(db: Session):
+    """Merge the session's queued screenings into their partitions, one locked row each"""
+    pending = db.info.get(PENDING_SKETCHES)
+    if not pending:
+        return
+    keys = sorted(pending)
+    insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        # New partitions exist before the locking read, so two ingests opening the same month wait on one row
+        db.execute(insert(ScreeningSketch).values([
+            {"id": uuid.uuid4(), "zip_code": zip_code, "month": month, "screening_count": 0, "high_risk_count": 0}
+            for zip_code, month in keys
+        ]).on_conflict_do_nothing(index_elements=["zip_code", "month"]))
+    # Locked in key order, so concurrent ingests cannot deadlock on partitions
+    rows = {(row.zip_code, row.month): row for row in db.query(ScreeningSketch).filter(
+        tuple_(ScreeningSketch.zip_code, ScreeningSketch.month).in_(keys)
+    ).order_by(ScreeningSketch.zip_code, ScreeningSketch.month).with_for_update()}
+
+    for key in keys:
+        row = rows.get(key)
+        if row is None:  # Dialects without an upsert
+            row = ScreeningSketch(zip_code=key[0], month=key[1], screening_count=0, high_risk_count=0)
+            db.add(row)
+        members = HyperLogLog.from_bytes(row.member_hll)
+        safety_scores = KLLSketch.from_bytes(row.safety_score_kll)
+        positive_counts = KLLSketch.from_bytes(row.positive_count_kll)
+        for member_id, safety_score, positive_count in pending[key]:
+            members.add(member_id)
+            safety_scores.update(safety_score)
+            positive_counts.update(positive_count)
+        row.member_hll = members.to_bytes()
+        row.safety_score_kll = safety_scores.to_bytes()
+        row.positive_count_kll = positive_counts.to_bytes()
+        row.screening_count = (row.screening_count or 0) + len(pending[key])
+        row.high_risk_count = (row.high_risk_count or 0) + sum(1 for _, score, _ in pending[key] if score >= 11)
+    pending.clear()
+    db.info.pop(SAVEPOINT_SKETCHES, None)
+    db.flush()
+
+def _flush_before_commit(db: Session):
+    if not db.in_nested_transaction():
+        flush_screening_sketches(db)
+
+def _snapshot_pending(db: Session, transaction):
+    if transaction.nested:
+        db.info.setdefault(SAVEPOINT_SKETCHES, {})[transaction] = {
+            key: len(observations) for key, observations in db.info[PENDING_SKETCHES].items()}
+
+def _discard_pending(db: Session, previous_transaction):
+    pending = db.info[PENDING_SKETCHES]
+    if not previous_transaction.nested:
+        pending.clear()
+        db.info.pop(SAVEPOINT_SKETCHES, None)
+        return
+    # A rolled-back savepoint drops only the screenings queued inside it
+    snapshot = db.info.get(SAVEPOINT_SKETCHES, {}).pop(previous_transaction, None)
+    if snapshot is None:
+        return
+    for key in list(pending):
+        if key in snapshot:
+            del pending[key][snapshot[key]:]
+        else:
+            del pending[key]
+
+def _load_partitions(db: Session, start_month: Optional[str] = None, end_month: Optional[str] = None,
+                     zip_codes: Optional[Iterable[str]] = None,
+                     county: Optional[str] = None) -> List[ScreeningSketch]:
+    query = db.query(ScreeningSketch)
+    if start_month:
+        query = query.filter(ScreeningSketch.month >= start_month)
+    if end_month:
+        query = query.filter(ScreeningSketch.month <= end_month)
+    if zip_codes is not None:
+        query = query.filter(ScreeningSketch.zip_code.in_(list(zip_codes)))
+    if not county:
+        return query.all()
+    # ZIP partitions roll up into counties through the reference table: the
+    # county's ZIPs and prefixes narrow the query, county_for_zip decides
+    table = get_zip_county_table()
+    if county != UNKNOWN_COUNTY:
+        zips, prefixes = table.county_zips(county)
+        query = query.filter(or_(ScreeningSketch.zip_code.in_(zips),
+                                 func.substr(ScreeningSketch.zip_code, 1, 3).in_(prefixes)))
+    return [row for row in query.all() if table.county_for_zip(row.zip_code) == county]
+
+def merge_partitions(rows: List[ScreeningSketch]) -> Dict[str, Any]:
+    """Merge partition sketches into one set of window-level sketches"""
+    members = HyperLogLog()
+    safety_scores = KLLSketch()
+    positive_counts = KLLSketch()
+    screening_count = 0
+    high_risk_count = 0
+
+    for row in rows:
+        members.merge(HyperLogLog.from_bytes(row.member_hll))
+        safety_scores.merge(KLLSketch.from_bytes(row.safety_score_kll))
+        positive_counts.merge(KLLSketch.from_bytes(row.positive_count_kll))
+        screening_count += row.screening_count or 0
+        high_risk_count += row.high_risk_count or 0
+
+    return {
+        "members": members,
+        "safety_scores": safety_scores,
+        "positive_counts": positive_counts,
+        "screening_count": screening_count,
+        "high_risk_count": high_risk_count,
+        "partitions": len(rows)
+    }
+
+def distinct_estimate(hll: HyperLogLog) -> Dict[str, Any]:
+    """Distinct count with its standard error and 95% interval"""
+    estimate = hll.count()
+    margin = 1.96 * hll.relative_error * estimate
+    return {
+        "estimate": estimate,
+        "relative_standard_error": round(hll.relative_error, 4),
+        "ci95": [max(0, int(estimate - margin)), int(math.ceil(estimate + margin))]
+    }
+
+def _distribution(kll: KLLSketch) -> Dict[str, Any]:
+    mean = kll.mean()
+    return {
+        "count": kll.n,
+        "mean": round(mean, 2) if mean is not None else None,
+        "percentiles": {
+            "p50": kll.quantile(0.5),
+            "p75": kll.quantile(0.75),
+            "p90": kll.quantile(0.9),
+            "p99": kll.quantile(0.99)
+        },
+        "normalized_rank_error": round(kll.rank_error, 4)
+    }
+
+def approximate_dashboard(db: Session, start_month: Optional[str] = None,
+                          end_month: Optional[str] = None,
+                          zip_codes: Optional[Iterable[str]] = None,
+                          county: Optional[str] = None) -> Dict[str, Any]:
+    """Dashboard counts from merged sketches, with their error bounds"""
+    merged = merge_partitions(_load_partitions(db, start_month, end_month, zip_codes, county))
+    return {
+        "approximate": True,
+        "window": {"start": start_month, "end": end_month, "county": county},
+        "partitions_merged": merged["partitions"],
+        "total_members": distinct_estimate(merged["members"]),
+        "total_screenings": merged["screening_count"],
+        "high_risk_count": merged["high_risk_count"],
+        "positive_screens_distribution": _distribution(merged["positive_counts"])
+    }
+
+def approximate_safety_scores(db: Session, start_month: Optional[str] = None,
+                              end_month: Optional[str] = None,
+                              zip_codes: Optional[Iterable[str]] = None,
+                              county: Optional[str] = None) -> Dict[str, Any]:
+    """Safety score report from merged sketches, with their error bounds"""
+    merged = merge_partitions(_load_partitions(db, start_month, end_month, zip_codes, county))
+    safety_scores = merged["safety_scores"]
+    distribution = _distribution(safety_scores)
+    return {
+        "approximate": True,
+        "window": {"start": start_month, "end": end_month, "county": county},
+        "partitions_merged": merged["partitions"],
+        "total_screenings": merged["screening_count"],
+        "distinct_members": distinct_estimate(merged["members"]),
+        "average_safety_score": distribution["mean"] or 0.0,
+        "high_risk_count": merged["high_risk_count"],
+        "percentiles": distribution["percentiles"],
+        "score_distribution": safety_scores.histogram(),
+        "normalized_rank_error": distribution["normalized_rank_error"]
+    }
+
+def rebuild_sketches(db: Session) -> int:
+    """Rebuild every sketch partition from existing screenings (one-off backfill)"""
+    db.query(ScreeningSketch).delete()
+    db.flush()
+    count = 0
+    last_id = None
+    while True:
+        # Keyset pagination keeps the backfill in bounded memory
+        query = db.query(ScreeningSession, Member).join(Member, Member.id == ScreeningSession.member_id)
+        if last_id is not None:
+            query = query.filter(ScreeningSession.id > last_id)
+        page = query.order_by(ScreeningSession.id).limit(1000).all()
+        if not page:
+            break
+        for screening, member in page:
+            record_screening(db, member, screening)
+            count += 1
+        flush_screening_sketches(db)
+        last_id = page[-1][0].id
+    db.commit()
+    response_cache.bump_generation()
+    logger.info(f"Rebuilt sketches from {count} screenings")
+    return count
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt sketches from {rebuild_sketches(db)} screenings")
+    finally:
+        db.close()
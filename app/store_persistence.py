@@ -0,0 +1,238 @@
+# app/store_persistence.py
+from typing import Dict, Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+import logging
+import mmap
+import os
+import struct
+import time
+
+try:
+    import fcntl  # POSIX only; elsewhere the single-writer rule is not enforced
+except ImportError:
+    fcntl = None
+
+from .config import settings
+from .member_store import MemberStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Snapshot layout: 8-byte core length, msgpack core, msgpack responses
+HEADER = struct.Struct("<Q")
+
+class StorePersistence:
+    """Snapshot + append-only log persistence for the in-memory MemberStore
+
+    Every stored extraction result is appended to store.log as one msgpack
+    record. Once the log holds `snapshot_every` records, or a quarter of the
+    store's member count if that is larger, the whole store (including its
+    derived indexes) is written to store.snapshot and the log starts over.
+    Scaling the threshold with the store keeps snapshot cost amortized
+    constant per append while bounding the log tail replayed at startup.
+
+    Only the capture of the store's contents (copied containers, shared
+    records) happens on the caller's thread (the event loop). The log is
+    then rotated to store.log.prev and the snapshot is encoded, written and
+    fsynced on a background thread, which deletes store.log.prev once the
+    snapshot is in place. Responses a restored store has not decoded yet
+    are decoded on that thread too, not on the event loop. One
+    snapshot is written at a time; appends that cross the threshold while
+    one is in flight wait for the next.
+
+    On startup the snapshot is memory-mapped and only its core (members,
+    screenings, condition sets, response counts) is decoded; the response
+    section stays in the mapping until something needs individual
+    responses. Then store.log.prev (left by an interrupted snapshot) and
+    store.log are replayed.
+
+    Replay is idempotent because the store dedups by member_id and
+    session_id, so replaying records the snapshot already holds is
+    harmless.
+
+    Only one process may write the log. The directory is locked when the
+    log is opened; a second process (another uvicorn worker) that finds it
+    locked loads the data but does not persist its own uploads, so run the
+    web interface with a single worker when WEB_STORE_DIR is set.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 1000):
+        import msgpack
+        self.msgpack = msgpack
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = os.path.join(directory, "store.snapshot")
+        self.log_path = os.path.join(directory, "store.log")
+        self.prev_log_path = self.log_path + ".prev"
+        self.lock_path = os.path.join(directory, "store.lock")
+        self.records_since_snapshot = 0
+        self.log_file = None
+        self.lock_file = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-snapshot")
+        self.pending: Optional[Future] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, store: MemberStore) -> Dict[str, Any]:
+        """Warm the store from the snapshot and logs, then open the log for appends"""
+        started = time.perf_counter()
+        snapshot_loaded = False
+
+        if os.path.exists(self.snapshot_path) and os.path.getsize(self.snapshot_path) > HEADER.size:
+            with open(self.snapshot_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            (core_length,) = HEADER.unpack_from(view)
+            core = self.msgpack.unpackb(view[HEADER.size:HEADER.size + core_length],
+                                        raw=False, strict_map_key=False)
+            if core.get("version") == SNAPSHOT_VERSION:
+                responses_view = view[HEADER.size + core_length:]
+                store.restore(core["store"], response_loader=lambda: self.msgpack.unpackb(
+                    responses_view, raw=False, strict_map_key=False))
+                snapshot_loaded = True
+            else:
+                logger.warning(f"Ignoring store snapshot with version {core.get('version')}")
+
+        writer = self._lock()
+        replayed = self._replay_log(store, self.prev_log_path, writer) + self._replay_log(store, self.log_path, writer)
+        self.records_since_snapshot = replayed
+        if writer:
+            self.log_file = open(self.log_path, "ab")
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Store warmed in {elapsed_ms}ms (snapshot: {snapshot_loaded}, "
+                    f"log records replayed: {replayed}, members: {len(store)})")
+        return {"snapshot_loaded": snapshot_loaded, "log_records": replayed, "elapsed_ms": elapsed_ms,
+                "writer": writer}
+
+    def _lock(self) -> bool:
+        """Take the directory's writer lock; False if another process holds it"""
+        if fcntl is None:
+            return True
+        self.lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.error(f"{self.directory} is locked by another process; uploads to this "
+                         f"process will not be persisted (run a single worker)")
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+        return True
+
+    def _replay_log(self, store: MemberStore, path: str, repair: bool = True) -> int:
+        if not os.path.exists(path):
+            return 0
+
+        replayed = 0
+        good_offset = 0
+        with open(path, "rb") as f:
+            unpacker = self.msgpack.Unpacker(f, raw=False, strict_map_key=False)
+            try:
+                for record in unpacker:
+                    store.add_result(record)
+                    replayed += 1
+                    good_offset = unpacker.tell()
+            except (ValueError, self.msgpack.exceptions.ExtraData) as e:
+                logger.warning(f"Store log corrupt after {replayed} records: {e}")
+
+        # Drop a record torn by a crash mid-append so new appends stay readable
+        if repair and good_offset < os.path.getsize(path):
+            logger.warning(f"Truncating partial record at end of {os.path.basename(path)} (offset {good_offset})")
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+        return replayed
+
+    def append(self, store: MemberStore, result: Dict[str, Any]):
+        """Log one stored extraction result, starting a snapshot when the log is long enough"""
+        if self.log_file is None:
+            return
+        record = {
+            "members": result.get("members", []),
+            "screenings": result.get("screenings", []),
+            "responses": result.get("responses", [])
+        }
+        self.log_file.write(self.msgpack.packb(record, use_bin_type=True))
+        self.log_file.flush()
+        self.records_since_snapshot += 1
+        if (self.records_since_snapshot >= max(self.snapshot_every, len(store) // 4)
+                and (self.pending is None or self.pending.done())):
+            data = self._capture(store)
+            self.pending = self.writer.submit(self._write_snapshot, data, len(store))
+
+    def _capture(self, store: MemberStore) -> Dict[str, Any]:
+        """The store's contents as of now, with the log rotated so later appends go to a fresh one"""
+        data = store.snapshot()
+        self.log_file.close()
+        if os.path.exists(self.prev_log_path):
+            # The last snapshot failed, so .prev still holds records no snapshot has
+            with open(self.prev_log_path, "ab") as prev, open(self.log_path, "rb") as log:
+                prev.write(log.read())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.prev_log_path)
+        self.log_file = open(self.log_path, "ab")
+        self.records_since_snapshot = 0
+        return data
+
+    def _write_snapshot(self, data: Dict[str, Any], member_count: int):
+        """Write a captured store atomically, then drop the log it replaces"""
+        try:
+            started = time.perf_counter()
+            responses = data.pop("responses")
+            loader = data.pop("response_loader", None)
+            if loader is not None:
+                # Sessions added since the store was restored come after the old snapshot's
+                responses = {**loader(), **responses}
+            responses = self.msgpack.packb(responses, use_bin_type=True)
+            core = self.msgpack.packb({
+                "version": SNAPSHOT_VERSION,
+                "created_at": datetime.utcnow().isoformat(),
+                "store": data
+            }, use_bin_type=True)
+            size = HEADER.size + len(core) + len(responses)
+
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(len(core)))
+                f.write(core)
+                f.write(responses)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # Everything in the rotated log is now in the snapshot
+            os.remove(self.prev_log_path)
+            logger.info(f"Wrote store snapshot ({size} bytes, {member_count} members) "
+                        f"in {round((time.perf_counter() - started) * 1000, 1)}ms")
+        except Exception as e:
+            logger.error(f"Store snapshot failed, keeping the log for replay: {e}")
+            raise
+
+    def snapshot(self, store: MemberStore):
+        """Write a snapshot now, waiting for any snapshot already in flight"""
+        if self.log_file is None:
+            return
+        if self.pending is not None:
+            self.pending.exception()
+            self.pending = None
+        self._write_snapshot(self._capture(store), len(store))
+
+    def close(self, store: MemberStore):
+        """Snapshot pending log records on shutdown so the next start skips replay"""
+        if self.records_since_snapshot or os.path.exists(self.prev_log_path):
+            self.snapshot(store)
+        self.writer.shutdown(wait=True)
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+
+def create_persistence() -> Optional[StorePersistence]:
+    """Persistence configured from settings, or None when WEB_STORE_DIR is empty"""
+    if not settings.WEB_STORE_DIR:
+        return None
+    return StorePersistence(settings.WEB_STORE_DIR, snapshot_every=settings.WEB_STORE_SNAPSHOT_EVERY)
@@ -0,0 +1,448 @@
+# app/synthetic_bundles.py
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+from datetime import datetime, timedelta
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+
+from .bundle_extraction import SAFETY_SCORE_QUESTION
+from .geo import get_zip_county_table
+from .json_codec import dumps, loads
+from .screener_rules import registry
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILES = ["hrsn_bundle_1_complete.json", "hrsn_bundle_2_complete.json", "hrsn_bundle_3_complete.json"]
+
+LOINC = "http://loinc.org"
+INTERPRETATION_SYSTEM = "http://terminology.hl7.org/CodeSystem/v3-ObservationInterpretation"
+
+_YES_NO = [("LA33-6", "Yes", 15), ("LA32-8", "No", 85)]
+_FOOD = [("LA28397-0", "Often true", 8), ("LA6729-3", "Sometimes true", 17), ("LA28398-8", "Never true", 75)]
+_FREQUENCY = [("LA6270-8", "Never", 78), ("LA10066-1", "Rarely", 11), ("LA10082-8", "Sometimes", 7),
+              ("LA16644-9", "Fairly often", 3), ("LA6482-9", "Frequently", 1)]
+
+# Answer choices per screener question: (code, display, default weight)
+ANSWER_OPTIONS: Dict[str, List[Tuple[str, str, float]]] = {
+    "71802-3": [
+        ("LA31993-1", "I have a steady place to live", 80),
+        ("LA31994-9", "I have a place to live today, but I am worried about losing it in the future", 14),
+        ("LA31995-6", "I do not have a steady place to live", 6)
+    ],
+    "96778-6": [
+        ("LA9-3", "None of the above", 75),
+        ("LA31996-4", "Pests such as bugs, ants, or mice", 8),
+        ("LA28580-1", "Mold", 5),
+        ("LA31997-2", "Lead paint or pipes", 2),
+        ("LA31998-0", "Lack of heat", 4),
+        ("LA31999-8", "Oven or stove not working", 2),
+        ("LA32000-4", "Smoke detectors missing or not working", 2),
+        ("LA32001-2", "Water leaks", 2)
+    ],
+    "96779-4": [("LA33-6", "Yes", 8), ("LA32-8", "No", 89), ("LA32002-0", "Already shut off", 3)],
+    "88122-7": _FOOD,
+    "88123-5": _FOOD,
+    "93030-5": _YES_NO,
+    "96780-2": [
+        ("LA31981-6", "Yes, help finding work", 10),
+        ("LA31982-4", "Yes, help keeping work", 4),
+        ("LA31983-2", "I do not need or want help", 86)
+    ],
+    "96782-8": _YES_NO,
+    "95618-5": _FREQUENCY,
+    "95617-7": _FREQUENCY,
+    "95616-9": _FREQUENCY,
+    "95615-1": _FREQUENCY
+}
+
+# Questions that take several answers, with the answer that excludes the others
+MULTI_ANSWER_QUESTIONS = {"96778-6": "LA9-3"}
+EXTRA_ANSWER_RATE = 0.1  # chance each other listed problem is reported too
+
+FIRST_NAMES = {
+    "female": ["Maria", "Sarah", "Aisha", "Mei", "Olivia", "Guadalupe", "Fatima", "Keisha", "Anna", "Priya",
+               "Rosa", "Emily", "Yasmin", "Grace", "Sofia", "Tanya", "Leah", "Carmen", "Nadia", "Ruth"],
+    "male": ["James", "Jose", "Wei", "Mohammed", "David", "Andre", "Luis", "Michael", "Rahul", "Samuel",
+             "Kwame", "Daniel", "Omar", "Thomas", "Carlos", "Ivan", "Marcus", "Hiro", "Peter", "Ahmed"]
+}
+LAST_NAMES = ["Rodriguez", "Chen", "Johnson", "Williams", "Garcia", "Nguyen", "Smith", "Brown", "Patel", "Kim",
+              "Martinez", "Jones", "Davis", "Lopez", "Okafor", "Cohen", "Singh", "Rivera", "Murphy", "Ali",
+              "Wilson", "Taylor", "Hernandez", "Kowalski", "Thompson", "Clark", "Lewis", "Walker", "Young", "Reyes"]
+STREETS = ["Main St", "Broadway", "Central Ave", "State St", "Lake Rd", "Park Ave", "Elm St", "Maple Ave",
+           "Washington St", "Church St", "Genesee St", "Union St", "Hudson Ave", "Delaware Ave", "Erie Blvd"]
+
+MALFORMATIONS = ("missing-id", "dangling-subject", "bad-date", "empty-answer")
+
+# Patients remembered for duplicate and repeat screenings
+PATIENT_POOL_SIZE = 10000
+
+def load_answer_weights(path: str) -> Dict[str, Dict[str, float]]:
+    """Answer weights from JSON: {"question_code": {"answer_code": weight}}"""
+    with open(path) as f:
+        weights = json.load(f)
+    for question_code, answers in weights.items():
+        options = {code for code, _, _ in ANSWER_OPTIONS.get(question_code, [])}
+        if not options:
+            raise ValueError(f"Unknown screener question {question_code}")
+        unknown = set(answers) - options
+        if unknown:
+            raise ValueError(f"Unknown answers for {question_code}: {', '.join(sorted(unknown))}")
+    return weights
+
+class GeneratorOptions:
+    """Knobs for one generation run; rates are probabilities between 0 and 1
+
+    Each bundle holds between min_patients and max_patients patients. Of
+    those, repeat_screening_rate are earlier patients screened again (same
+    Patient id, a later QuestionnaireResponse) and duplicate_patient_rate
+    are earlier patients re-registered under a new Patient id with the
+    same MRN and demographics. answer_weights replaces the default weights
+    of the questions it lists.
+    """
+
+    def __init__(self, seed: int = 0, min_patients: int = 1, max_patients: Optional[int] = None,
+                 duplicate_patient_rate: float = 0.02, repeat_screening_rate: float = 0.1,
+                 malformed_entry_rate: float = 0.0, answer_weights: Optional[Dict[str, Dict[str, float]]] = None,
+                 start_date: datetime = datetime(2024, 1, 1), days: int = 365, bundle_type: Optional[str] = None,
+                 templates: Optional[List[str]] = None):
+        self.seed = seed
+        self.min_patients = max(1, min_patients)
+        self.max_patients = max(self.min_patients, max_patients or self.min_patients)
+        self.duplicate_patient_rate = duplicate_patient_rate
+        self.repeat_screening_rate = repeat_screening_rate
+        self.malformed_entry_rate = malformed_entry_rate
+        self.answer_weights = answer_weights or {}
+        self.start_date = start_date
+        self.days = days
+        self.bundle_type = bundle_type
+        self.templates = templates or [os.path.join(ROOT_DIR, name) for name in TEMPLATE_FILES]
+
+class BundleGenerator:
+    """Deterministic stream of realistic HRSN screening Bundles
+
+    Every patient is a copy of one template's patient group (Patient,
+    Encounter, Consent, QuestionnaireResponse, Observations) with fresh
+    ids, demographics, dates and answers. The copy stays internally
+    consistent: references follow the new ids, the Observations and the
+    total safety score match the QuestionnaireResponse answers, and the
+    templates' Organizations are shared. The same options and seed always
+    produce the same Bundles.
+    """
+
+    def __init__(self, options: GeneratorOptions):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.rules = registry.default()
+        self.pool: List[Dict[str, Any]] = []
+        self.stats = {"bundles": 0, "patients": 0, "new_patients": 0, "duplicate_patients": 0,
+                      "repeat_screenings": 0, "entries": 0, "malformed_entries": {kind: 0 for kind in MALFORMATIONS}}
+
+        self.templates = [self._load_template(path) for path in options.templates]
+        self.answer_choices = {}
+        for question_code, options_list in ANSWER_OPTIONS.items():
+            weights = options.answer_weights.get(question_code)
+            self.answer_choices[question_code] = (
+                [(code, display) for code, display, _ in options_list],
+                [weights.get(code, 0) if weights is not None else weight for code, _, weight in options_list]
+            )
+
+        zip_table = get_zip_county_table()
+        self.zip_areas = sorted((prefix, zip_table.county_name(fips)) for prefix, fips in zip_table.zip3.items())
+
+    def _load_template(self, path: str) -> Dict[str, Any]:
+        """A template's Organizations, and its patient group kept as JSON for cheap copies"""
+        with open(path, "rb") as f:
+            bundle = loads(f.read())
+        organizations = [entry for entry in bundle.get("entry", [])
+                         if entry.get("resource", {}).get("resourceType") == "Organization"]
+        group = [entry for entry in bundle.get("entry", [])
+                 if entry.get("resource", {}).get("resourceType") != "Organization"]
+        if sum(1 for entry in group if entry["resource"]["resourceType"] == "Patient") != 1:
+            raise ValueError(f"{path}: a template needs exactly one Patient")
+        return {"type": bundle.get("type", "transaction"), "organizations": organizations, "group": dumps(group)}
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _new_person(self) -> Dict[str, Any]:
+        rng = self.rng
+        gender = rng.choice(("female", "male"))
+        prefix, city = rng.choice(self.zip_areas)
+        return {
+            "first_name": rng.choice(FIRST_NAMES[gender]),
+            "last_name": rng.choice(LAST_NAMES),
+            "gender": gender,
+            "birth_date": (datetime(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))).date().isoformat(),
+            "line": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+            "city": city,
+            "zip_code": f"{prefix}{rng.randrange(100):02d}",
+            "mrn": f"MRN{rng.randrange(10 ** 9):09d}",
+            "phone": f"{rng.randint(201, 989)}-555-{rng.randrange(10000):04d}"
+        }
+
+    def _pick_patient(self) -> Tuple[str, Dict[str, Any], datetime]:
+        """(Patient id, person, screening time) for the next patient"""
+        rng = self.rng
+        options = self.options
+        roll = rng.random()
+        if self.pool and roll < options.repeat_screening_rate:
+            remembered = rng.choice(self.pool)
+            remembered["authored"] += timedelta(days=rng.randint(30, 180), minutes=rng.randrange(600))
+            self.stats["repeat_screenings"] += 1
+            return remembered["patient_id"], remembered["person"], remembered["authored"]
+
+        authored = options.start_date + timedelta(seconds=rng.randrange(max(1, options.days) * 86400))
+        if self.pool and roll < options.repeat_screening_rate + options.duplicate_patient_rate:
+            person = rng.choice(self.pool)["person"]
+            self.stats["duplicate_patients"] += 1
+        else:
+            person = self._new_person()
+            self.stats["new_patients"] += 1
+
+        remembered = {"patient_id": self._uuid(), "person": person, "authored": authored}
+        if len(self.pool) < PATIENT_POOL_SIZE:
+            self.pool.append(remembered)
+        else:
+            self.pool[rng.randrange(PATIENT_POOL_SIZE)] = remembered
+        return remembered["patient_id"], person, authored
+
+    def _answers(self) -> Dict[str, List[Tuple[str, str]]]:
+        """One screening's answers: question code -> [(answer code, display)]"""
+        answers = {}
+        for question_code, (choices, weights) in self.answer_choices.items():
+            chosen = self.rng.choices(choices, weights=weights)[0]
+            selected = [chosen]
+            exclusive = MULTI_ANSWER_QUESTIONS.get(question_code)
+            if exclusive is not None and chosen[0] != exclusive:
+                for choice, weight in zip(choices, weights):
+                    if choice[0] not in (exclusive, chosen[0]) and weight and self.rng.random() < EXTRA_ANSWER_RATE:
+                        selected.append(choice)
+            answers[question_code] = selected
+        return answers
+
+    def _patient_group(self, template: Dict[str, Any]) -> List[Dict[str, Any]]:
+        group = loads(template["group"])
+        patient_id, person, authored = self._pick_patient()
+        full_name = f"{person['first_name']} {person['last_name']}"
+
+        new_ids = {}
+        for entry in group:
+            resource = entry["resource"]
+            new_id = patient_id if resource["resourceType"] == "Patient" else self._uuid()
+            new_ids[f"{resource['resourceType']}/{resource.get('id')}"] = new_id
+
+        answers = self._answers()
+        safety_score = sum(self.rules.decide(code, selected[0][0])[0] for code, selected in answers.items())
+        timestamp = authored.strftime("%Y-%m-%dT%H:%M:%SZ")
+        finished = (authored + timedelta(minutes=10)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        for entry in group:
+            resource = entry["resource"]
+            resource_type = resource["resourceType"]
+            new_id = new_ids[f"{resource_type}/{resource.get('id')}"]
+            resource["id"] = new_id
+            full_url = entry.get("fullUrl") or ""
+            entry["fullUrl"] = f"urn:uuid:{new_id}" if full_url.startswith("urn:uuid:") else f"{resource_type}/{new_id}"
+            if "request" in entry:
+                entry["request"]["url"] = f"{resource_type}/{new_id}"
+            _rewrite_references(resource, new_ids, full_name)
+
+            if resource_type == "Patient":
+                _apply_person(resource, person)
+            elif resource_type == "QuestionnaireResponse":
+                resource["authored"] = timestamp
+                for item in resource.get("item", []):
+                    if item.get("linkId") in answers:
+                        item["answer"] = [{"valueCoding": {"system": LOINC, "code": code, "display": display}}
+                                          for code, display in answers[item["linkId"]]]
+                    elif item.get("linkId") == SAFETY_SCORE_QUESTION:
+                        item["answer"] = [{"valueInteger": safety_score}]
+            elif resource_type == "Observation":
+                resource["effectiveDateTime"] = timestamp
+                code = (resource.get("code", {}).get("coding") or [{}])[0].get("code")
+                if code in answers:
+                    answer_code, display = answers[code][0]
+                    resource["valueCodeableConcept"] = {"coding": [{"system": LOINC, "code": answer_code, "display": display}]}
+                    positive = self.rules.decide(code, answer_code)[1]
+                    resource["interpretation"] = [{"coding": [{
+                        "system": INTERPRETATION_SYSTEM,
+                        "code": "POS" if positive else "NEG",
+                        "display": "Positive" if positive else "Negative"
+                    }]}]
+                elif code == SAFETY_SCORE_QUESTION:
+                    resource["valueInteger"] = safety_score
+            elif resource_type == "Encounter":
+                resource["period"] = {"start": timestamp, "end": finished}
+            elif resource_type == "Consent":
+                resource["dateTime"] = timestamp
+
+        if self.options.malformed_entry_rate:
+            for entry in group:
+                if self.rng.random() < self.options.malformed_entry_rate:
+                    self._malform(entry["resource"])
+        return group
+
+    def _malform(self, resource: Dict[str, Any]):
+        """Break one entry the way real feeds do"""
+        kinds = ["missing-id", "bad-date"]
+        if "subject" in resource:
+            kinds.append("dangling-subject")
+        if resource["resourceType"] == "QuestionnaireResponse" and resource.get("item"):
+            kinds.append("empty-answer")
+        kind = self.rng.choice(kinds)
+        if kind == "missing-id":
+            resource.pop("id", None)
+        elif kind == "dangling-subject":
+            resource["subject"] = {"reference": f"Patient/{self._uuid()}"}
+        elif kind == "bad-date":
+            for field in ("birthDate", "authored", "effectiveDateTime", "dateTime"):
+                if field in resource:
+                    resource[field] = "not-a-date"
+                    break
+            else:
+                resource["meta"] = {"lastUpdated": "not-a-date"}
+        else:
+            self.rng.choice(resource["item"])["answer"] = [{"valueCoding": {"system": LOINC}}]
+        self.stats["malformed_entries"][kind] += 1
+
+    def bundle(self) -> Dict[str, Any]:
+        """The next Bundle"""
+        rng = self.rng
+        patients = rng.randint(self.options.min_patients, self.options.max_patients)
+        organizations: Dict[str, Dict[str, Any]] = {}
+        entries: List[Dict[str, Any]] = []
+        bundle_type = self.options.bundle_type
+        for _ in range(patients):
+            template = rng.choice(self.templates)
+            bundle_type = bundle_type or template["type"]
+            for organization in template["organizations"]:
+                organizations.setdefault(organization["resource"].get("id"), organization)
+            entries.extend(self._patient_group(template))
+        entries = list(organizations.values()) + entries
+
+        if bundle_type not in ("batch", "transaction"):
+            entries = [{key: value for key, value in entry.items() if key != "request"} for entry in entries]
+        authored = [entry["resource"]["authored"] for entry in entries
+                    if entry["resource"]["resourceType"] == "QuestionnaireResponse" and "authored" in entry["resource"]]
+
+        self.stats["bundles"] += 1
+        self.stats["patients"] += patients
+        self.stats["entries"] += len(entries)
+        return {
+            "resourceType": "Bundle",
+            "id": self._uuid(),
+            "type": bundle_type,
+            "timestamp": max(authored) if authored else self.options.start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "entry": entries
+        }
+
+    def bundles(self, count: int) -> Iterator[Dict[str, Any]]:
+        for _ in range(count):
+            yield self.bundle()
+
+def _rewrite_references(node: Any, new_ids: Dict[str, str], patient_name: str):
+    """Point every literal reference at the group's new ids, renaming the patient's displays"""
+    if isinstance(node, dict):
+        reference = node.get("reference")
+        if isinstance(reference, str) and reference in new_ids:
+            resource_type = reference.split("/")[0]
+            node["reference"] = f"{resource_type}/{new_ids[reference]}"
+            if resource_type == "Patient" and "display" in node:
+                node["display"] = patient_name
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                _rewrite_references(value, new_ids, patient_name)
+    elif isinstance(node, list):
+        for value in node:
+            if isinstance(value, (dict, list)):
+                _rewrite_references(value, new_ids, patient_name)
+
+def _apply_person(patient: Dict[str, Any], person: Dict[str, Any]):
+    patient["name"] = [{"use": "official", "family": person["last_name"], "given": [person["first_name"]]}]
+    patient["gender"] = person["gender"]
+    patient["birthDate"] = person["birth_date"]
+    patient["address"] = [{"use": "home", "type": "both", "line": [person["line"]], "city": person["city"],
+                           "state": "NY", "postalCode": person["zip_code"], "country": "US"}]
+    patient["telecom"] = [{"system": "phone", "value": person["phone"], "use": "home"}]
+    for identifier in patient.get("identifier", [])[:1]:
+        identifier["value"] = person["mrn"]
+
+def write_ndjson(bundles: Iterator[Dict[str, Any]], path: str) -> int:
+    """One Bundle per line to path ('-' for stdout; gzip when it ends in .gz)"""
+    if path == "-":
+        output = sys.stdout.buffer
+    elif path.endswith(".gz"):
+        output = gzip.open(path, "wb", compresslevel=6)
+    else:
+        output = open(path, "wb")
+    written = 0
+    try:
+        for bundle in bundles:
+            output.write(dumps(bundle) + b"\n")
+            written += 1
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    return written
+
+def write_directory(bundles: Iterator[Dict[str, Any]], path: str, per_directory: int = 1000) -> int:
+    """One Bundle per file, sharded into subdirectories of per_directory files"""
+    written = 0
+    for bundle in bundles:
+        shard = os.path.join(path, f"{written // per_directory:05d}")
+        if written % per_directory == 0:
+            os.makedirs(shard, exist_ok=True)
+        with open(os.path.join(shard, f"bundle-{written:08d}.json"), "wb") as f:
+            f.write(dumps(bundle))
+        written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic HRSN screening Bundles for load and scale testing")
+    parser.add_argument("count", type=int, help="Number of Bundles to generate")
+    parser.add_argument("--output", default="-", help="NDJSON file ('-' for stdout, .gz to compress) or directory")
+    parser.add_argument("--format", choices=["ndjson", "dir"], default="ndjson")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--patients", type=int, default=1, help="Patients per Bundle (the minimum with --max-patients)")
+    parser.add_argument("--max-patients", type=int, default=None, help="Upper bound for a random Bundle size")
+    parser.add_argument("--duplicate-rate", type=float, default=0.02, help="Share of patients re-registered under a new id")
+    parser.add_argument("--repeat-rate", type=float, default=0.1, help="Share of patients screened again")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of entries deliberately broken")
+    parser.add_argument("--answers", help='JSON answer weights: {"question_code": {"answer_code": weight}}')
+    parser.add_argument("--start-date", default="2024-01-01", help="First screening date (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=365, help="Days over which new screenings are spread")
+    parser.add_argument("--type", dest="bundle_type", choices=["transaction", "batch", "collection"],
+                        help="Bundle type (default: the template's); collection drops entry.request")
+    parser.add_argument("--template", action="append", dest="templates", help="Template Bundle (repeatable)")
+    args = parser.parse_args()
+
+    options = GeneratorOptions(
+        seed=args.seed,
+        min_patients=args.patients,
+        max_patients=args.max_patients,
+        duplicate_patient_rate=args.duplicate_rate,
+        repeat_screening_rate=args.repeat_rate,
+        malformed_entry_rate=args.malformed_rate,
+        answer_weights=load_answer_weights(args.answers) if args.answers else None,
+        start_date=datetime.strptime(args.start_date, "%Y-%m-%d"),
+        days=args.days,
+        bundle_type=args.bundle_type,
+        templates=args.templates
+    )
+    generator = BundleGenerator(options)
+    if args.format == "dir":
+        if args.output == "-":
+            parser.error("--format dir needs --output DIRECTORY")
+        write_directory(generator.bundles(args.count), args.output)
+    else:
+        write_ndjson(generator.bundles(args.count), args.output)
+    print(json.dumps(generator.stats, indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
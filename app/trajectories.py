@@ -0,0 +1,164 @@
+# app/trajectories.py
+from typing import Dict, Any, List, Optional, Set
+from sqlalchemy.orm import Session
+from datetime import datetime
+import json
+import logging
+
+from .cache import response_cache
+from .models import Member, ScreeningSession, ScreeningResponse, MemberTrajectory
+from .geo import positive_categories
+
+logger = logging.getLogger(__name__)
+
+TRENDS = ["baseline", "improved", "worsened", "unchanged"]
+
+def _classify_trend(score_delta: int, resolved: List[str], new: List[str]) -> str:
+    """Safety score direction decides the trend; category balance breaks ties"""
+    if score_delta > 0:
+        return "worsened"
+    if score_delta < 0:
+        return "improved"
+    if len(new) > len(resolved):
+        return "worsened"
+    if len(resolved) > len(new):
+        return "improved"
+    return "unchanged"
+
+def _refresh(trajectory: MemberTrajectory):
+    """Recompute the comparison fields from the latest and previous screenings"""
+    if trajectory.previous_screening_id is None:
+        trajectory.safety_score_delta = None
+        trajectory.days_between_screenings = None
+        trajectory.resolved_categories = "[]"
+        trajectory.new_categories = "[]"
+        trajectory.trend = "baseline"
+        return
+
+    latest = set(json.loads(trajectory.latest_positive_categories or "[]"))
+    previous = set(json.loads(trajectory.previous_positive_categories or "[]"))
+    resolved = sorted(previous - latest)
+    new = sorted(latest - previous)
+
+    score_delta = (trajectory.latest_safety_score or 0) - (trajectory.previous_safety_score or 0)
+    days_between = None
+    if trajectory.latest_screening_date and trajectory.previous_screening_date:
+        days_between = (trajectory.latest_screening_date - trajectory.previous_screening_date).days
+
+    trajectory.safety_score_delta = score_delta
+    trajectory.days_between_screenings = days_between
+    trajectory.resolved_categories = json.dumps(resolved)
+    trajectory.new_categories = json.dumps(new)
+    trajectory.trend = _classify_trend(score_delta, resolved, new)
+
+def record_screening_trajectory(db: Session, member: Member, screening: ScreeningSession,
+                                categories: Set[str]):
+    """Fold a newly ingested screening into the member's trajectory
+
+    Screenings can arrive out of order, so the new session is slotted in by
+    screening date: it becomes the latest, the previous, or (if older than
+    both) only counts towards the total.
+    """
+    trajectory = db.query(MemberTrajectory).filter(
+        MemberTrajectory.member_id == member.id
+    ).with_for_update().first()
+    if not trajectory:
+        trajectory = MemberTrajectory(member_id=member.id, screening_count=0)
+        db.add(trajectory)
+
+    screening_date = screening.screening_date or datetime.utcnow()
+    if screening_date.tzinfo is not None:
+        screening_date = screening_date.replace(tzinfo=None)
+    snapshot = {
+        "id": screening.id,
+        "date": screening_date,
+        "score": screening.total_safety_score or 0,
+        "categories": json.dumps(sorted(categories))
+    }
+
+    trajectory.screening_count = (trajectory.screening_count or 0) + 1
+
+    if trajectory.latest_screening_id is None or screening_date >= trajectory.latest_screening_date:
+        # Newest screening - the old latest becomes the comparison point
+        if trajectory.latest_screening_id is not None:
+            trajectory.previous_screening_id = trajectory.latest_screening_id
+            trajectory.previous_screening_date = trajectory.latest_screening_date
+            trajectory.previous_safety_score = trajectory.latest_safety_score
+            trajectory.previous_positive_categories = trajectory.latest_positive_categories
+        trajectory.latest_screening_id = snapshot["id"]
+        trajectory.latest_screening_date = snapshot["date"]
+        trajectory.latest_safety_score = snapshot["score"]
+        trajectory.latest_positive_categories = snapshot["categories"]
+    elif trajectory.previous_screening_id is None or screening_date >= trajectory.previous_screening_date:
+        # Back-filled screening that falls between the previous and latest
+        trajectory.previous_screening_id = snapshot["id"]
+        trajectory.previous_screening_date = snapshot["date"]
+        trajectory.previous_safety_score = snapshot["score"]
+        trajectory.previous_positive_categories = snapshot["categories"]
+
+    _refresh(trajectory)
+    db.flush()
+
+def trajectory_to_dict(trajectory: MemberTrajectory) -> Dict[str, Any]:
+    """Serialize a trajectory record for the API"""
+    return {
+        "member_id": str(trajectory.member_id),
+        "trend": trajectory.trend,
+        "screening_count": trajectory.screening_count,
+        "latest_screening": {
+            "id": str(trajectory.latest_screening_id) if trajectory.latest_screening_id else None,
+            "screening_date": trajectory.latest_screening_date.isoformat() if trajectory.latest_screening_date else None,
+            "total_safety_score": trajectory.latest_safety_score,
+            "positive_categories": json.loads(trajectory.latest_positive_categories or "[]")
+        },
+        "previous_screening": {
+            "id": str(trajectory.previous_screening_id),
+            "screening_date": trajectory.previous_screening_date.isoformat() if trajectory.previous_screening_date else None,
+            "total_safety_score": trajectory.previous_safety_score,
+            "positive_categories": json.loads(trajectory.previous_positive_categories or "[]")
+        } if trajectory.previous_screening_id else None,
+        "safety_score_delta": trajectory.safety_score_delta,
+        "days_between_screenings": trajectory.days_between_screenings,
+        "resolved_categories": json.loads(trajectory.resolved_categories or "[]"),
+        "new_categories": json.loads(trajectory.new_categories or "[]"),
+        "updated_at": trajectory.updated_at.isoformat() if trajectory.updated_at else None
+    }
+
+def rebuild_trajectories(db: Session) -> int:
+    """Rebuild every trajectory from existing screenings (one-off backfill)"""
+    db.query(MemberTrajectory).delete()
+    db.flush()
+    count = 0
+    last_id = None
+    while True:
+        # Keyset pagination over members keeps the backfill in bounded memory
+        query = db.query(Member)
+        if last_id is not None:
+            query = query.filter(Member.id > last_id)
+        members = query.order_by(Member.id).limit(500).all()
+        if not members:
+            break
+        for member in members:
+            screenings = db.query(ScreeningSession).filter(
+                ScreeningSession.member_id == member.id
+            ).order_by(ScreeningSession.screening_date).all()
+            for screening in screenings:
+                answers = db.query(ScreeningResponse.question_code, ScreeningResponse.answer_code).filter(
+                    ScreeningResponse.screening_session_id == screening.id
+                ).all()
+                record_screening_trajectory(db, member, screening, positive_categories(answers))
+            if screenings:
+                count += 1
+        last_id = members[-1].id
+    db.commit()
+    response_cache.bump_generation()
+    logger.info(f"Rebuilt trajectories for {count} members")
+    return count
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt trajectories for {rebuild_trajectories(db)} members")
+    finally:
+        db.close()
@@ -0,0 +1,394 @@
+# app/waiver_report.py
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import argparse
+import base64
+import json
+import logging
+import re
+
+from .models import (
+    ScreeningSession, ScreeningResponse, ServiceReferral,
+    EligibilityAssessment, WaiverReportJob
+)
+from .config import settings
+from .screener_rules import registry
+from .sketches import HyperLogLog, distinct_estimate
+
+logger = logging.getLogger(__name__)
+
+# Order matters: a job walks every day partition of one stage before the next
+STAGES = ["screenings", "responses", "referrals", "eligibility"]
+
+# A job still 'running' but not checkpointed for this long is treated as crashed
+STALE_AFTER = timedelta(minutes=10)
+
+class WaiverReportBusy(Exception):
+    """Another worker holds the quarter's job"""
+
+def parse_quarter(quarter: str) -> Tuple[datetime, datetime]:
+    """'2024Q4' -> (2024-10-01, 2025-01-01)"""
+    match = re.fullmatch(r"(\d{4})Q([1-4])", quarter.upper())
+    if not match:
+        raise ValueError("Quarter must look like 2024Q4")
+    year, q = int(match.group(1)), int(match.group(2))
+    start = datetime(year, 3 * (q - 1) + 1, 1)
+    end = datetime(year + 1, 1, 1) if q == 4 else datetime(year, 3 * q + 1, 1)
+    return start, end
+
+def _empty_state() -> Dict[str, Any]:
+    return {
+        "counters": {
+            "screenings_completed": 0,
+            "screenings_fully_answered": 0,
+            "screenings_with_unmet_need": 0,
+            "high_safety_risk_screenings": 0,
+            "positive_responses": 0,
+            "referrals_total": 0,
+            "eligibility_assessments": 0,
+            "enhanced_services_eligible": 0
+        },
+        "positive_by_category": {},
+        "referrals_by_category": {},
+        "referrals_by_status": {},
+        "sketches": {}
+    }
+
+class WaiverAccumulator:
+    """Bounded-memory accumulator for the quarterly waiver measures
+
+    Counters are exact; distinct-member measures use HyperLogLog so memory
+    stays constant however many members the quarter covers.
+    """
+
+    SKETCHES = ["members_screened", "members_with_unmet_need", "members_referred", "eligible_members_assessed"]
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        self.state = state or _empty_state()
+        self.sketches = {
+            name: HyperLogLog.from_bytes(
+                base64.b64decode(self.state["sketches"][name]) if name in self.state["sketches"] else None
+            )
+            for name in self.SKETCHES
+        }
+
+    def _bump(self, group: str, key: Optional[str]):
+        key = key or "unspecified"
+        self.state[group][key] = self.state[group].get(key, 0) + 1
+
+    def add_screening(self, row):
+        counters = self.state["counters"]
+        counters["screenings_completed"] += 1
+        member_id = str(row.member_id)
+        self.sketches["members_screened"].add(member_id)
+        if row.screening_complete:
+            counters["screenings_fully_answered"] += 1
+        if (row.positive_screens_count or 0) > 0:
+            counters["screenings_with_unmet_need"] += 1
+            self.sketches["members_with_unmet_need"].add(member_id)
+        if (row.total_safety_score or 0) >= 11:
+            counters["high_safety_risk_screenings"] += 1
+
+    def add_response(self, row):
+        rules = registry.default()
+        if row.positive_screen or rules.decide(row.question_code, row.answer_code)[1]:
+            self.state["counters"]["positive_responses"] += 1
+            category = row.sdoh_category or rules.question_categories.get(row.question_code)
+            self._bump("positive_by_category", category)
+
+    def add_referral(self, row):
+        self.state["counters"]["referrals_total"] += 1
+        self.sketches["members_referred"].add(str(row.member_id))
+        self._bump("referrals_by_category", row.service_category)
+        self._bump("referrals_by_status", row.referral_status)
+
+    def add_eligibility(self, row):
+        counters = self.state["counters"]
+        counters["eligibility_assessments"] += 1
+        if row.eligibility_status == "eligible":
+            # A member assessed eligible more than once in the quarter counts once
+            self.sketches["eligible_members_assessed"].add(str(row.member_id))
+        if row.enhanced_services_eligible:
+            counters["enhanced_services_eligible"] += 1
+
+    def dump(self) -> Dict[str, Any]:
+        """Serializable state for the checkpoint"""
+        self.state["sketches"] = {
+            name: base64.b64encode(sketch.to_bytes()).decode("ascii")
+            for name, sketch in self.sketches.items()
+        }
+        return self.state
+
+    def measures(self) -> Dict[str, Any]:
+        """Final report measures"""
+        counters = dict(self.state["counters"])
+        return {
+            **counters,
+            "members_screened": distinct_estimate(self.sketches["members_screened"]),
+            "members_with_unmet_need": distinct_estimate(self.sketches["members_with_unmet_need"]),
+            "members_referred": distinct_estimate(self.sketches["members_referred"]),
+            "eligible_members_assessed": distinct_estimate(self.sketches["eligible_members_assessed"]),
+            "positive_by_category": self.state["positive_by_category"],
+            "referrals_by_category": self.state["referrals_by_category"],
+            "referrals_by_status": self.state["referrals_by_status"]
+        }
+
+def _fetch_screenings(db: Session, day_start: datetime, day_end: datetime, last_id, limit: int):
+    query = db.query(
+        ScreeningSession.id, ScreeningSession.member_id, ScreeningSession.screening_complete,
+        ScreeningSession.positive_screens_count, ScreeningSession.total_safety_score
+    ).filter(
+        ScreeningSession.screening_date >= day_start,
+        ScreeningSession.screening_date < day_end
+    )
+    if last_id is not None:
+        query = query.filter(ScreeningSession.id > last_id)
+    return query.order_by(ScreeningSession.id).limit(limit).all()
+
+def _fetch_responses(db: Session, day_start: datetime, day_end: datetime, last_id, limit: int):
+    query = db.query(
+        ScreeningResponse.id, ScreeningResponse.question_code, ScreeningResponse.answer_code,
+        ScreeningResponse.sdoh_category, ScreeningResponse.positive_screen
+    ).join(
+        ScreeningSession, ScreeningSession.id == ScreeningResponse.screening_session_id
+    ).filter(
+        ScreeningSession.screening_date >= day_start,
+        ScreeningSession.screening_date < day_end
+    )
+    if last_id is not None:
+        query = query.filter(ScreeningResponse.id > last_id)
+    return query.order_by(ScreeningResponse.id).limit(limit).all()
+
+def _fetch_referrals(db: Session, day_start: datetime, day_end: datetime, last_id, limit: int):
+    query = db.query(
+        ServiceReferral.id, ServiceReferral.member_id, ServiceReferral.service_category,
+        ServiceReferral.referral_status
+    ).filter(
+        ServiceReferral.referral_date >= day_start,
+        ServiceReferral.referral_date < day_end
+    )
+    if last_id is not None:
+        query = query.filter(ServiceReferral.id > last_id)
+    return query.order_by(ServiceReferral.id).limit(limit).all()
+
+def _fetch_eligibility(db: Session, day_start: datetime, day_end: datetime, last_id, limit: int):
+    query = db.query(
+        EligibilityAssessment.id, EligibilityAssessment.member_id, EligibilityAssessment.eligibility_status,
+        EligibilityAssessment.enhanced_services_eligible
+    ).filter(
+        EligibilityAssessment.assessment_date >= day_start,
+        EligibilityAssessment.assessment_date < day_end
+    )
+    if last_id is not None:
+        query = query.filter(EligibilityAssessment.id > last_id)
+    return query.order_by(EligibilityAssessment.id).limit(limit).all()
+
+STAGE_HANDLERS: Dict[str, Tuple[Callable, str]] = {
+    "screenings": (_fetch_screenings, "add_screening"),
+    "responses": (_fetch_responses, "add_response"),
+    "referrals": (_fetch_referrals, "add_referral"),
+    "eligibility": (_fetch_eligibility, "add_eligibility")
+}
+
+def get_or_create_job(db: Session, quarter: str) -> WaiverReportJob:
+    """Load the checkpointed job for a quarter, creating it if needed"""
+    quarter = quarter.upper()
+    parse_quarter(quarter)
+    job = db.query(WaiverReportJob).filter(WaiverReportJob.quarter == quarter).first()
+    if not job:
+        try:
+            job = WaiverReportJob(quarter=quarter, status="pending", stage=STAGES[0],
+                                  state=json.dumps(_empty_state()))
+            db.add(job)
+            db.commit()
+        except IntegrityError:
+            # Another request created it first (quarter is unique)
+            db.rollback()
+            job = db.query(WaiverReportJob).filter(WaiverReportJob.quarter == quarter).one()
+    return job
+
+def claim_job(db: Session, job: WaiverReportJob) -> bool:
+    """Mark the job running unless another worker is advancing it
+
+    One conditional UPDATE, so of two workers starting together exactly
+    one claims the job.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(WaiverReportJob).filter(
+        WaiverReportJob.id == job.id,
+        or_(WaiverReportJob.status != "running", WaiverReportJob.updated_at.is_(None),
+            WaiverReportJob.updated_at < now - STALE_AFTER)
+    ).update({"status": "running", "error_message": None, "updated_at": now}, synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    return claimed == 1
+
+def _reset_job(job: WaiverReportJob):
+    job.stage = STAGES[0]
+    job.partition_start = None
+    job.last_id = None
+    job.rows_processed = 0
+    job.state = json.dumps(_empty_state())
+    job.result = None
+    job.started_at = datetime.utcnow()
+    job.completed_at = None
+
+def is_job_active(job: WaiverReportJob) -> bool:
+    """True if another worker is currently advancing this job"""
+    return (job.status == "running" and job.updated_at is not None
+            and datetime.utcnow() - job.updated_at < STALE_AFTER)
+
+def run_waiver_report(db: Session, quarter: str, batch_size: Optional[int] = None,
+                      restart: bool = False) -> Dict[str, Any]:
+    """Run (or resume) the quarterly waiver report
+
+    Each stage streams its table one day partition at a time with keyset
+    pagination. After every batch the accumulator state and cursor
+    (stage, partition, last id) are committed together, so a crash resumes
+    at the last committed batch without double counting. Days with no rows
+    are not checkpointed. Raises WaiverReportBusy if another worker is
+    running the quarter.
+    """
+    batch_size = batch_size or settings.WAIVER_REPORT_BATCH_SIZE
+    job = get_or_create_job(db, quarter)
+    if job.status == "completed" and not restart:
+        return json.loads(job.result)
+
+    resuming = job.status not in ("pending", "completed") and not restart
+    if not claim_job(db, job):
+        raise WaiverReportBusy(f"Waiver report {job.quarter} is already running")
+    if restart:
+        _reset_job(job)
+        db.commit()
+    elif resuming:
+        logger.info(f"Resuming waiver report {job.quarter} at {job.stage} "
+                    f"{job.partition_start} after id {job.last_id}")
+
+    quarter_start, quarter_end = parse_quarter(job.quarter)
+    accumulator = WaiverAccumulator(json.loads(job.state))
+
+    try:
+        for stage in STAGES[STAGES.index(job.stage):]:
+            fetch, add_name = STAGE_HANDLERS[stage]
+            add = getattr(accumulator, add_name)
+            day = job.partition_start if job.stage == stage and job.partition_start else quarter_start
+
+            while day < quarter_end:
+                day_end = day + timedelta(days=1)
+                last_id = job.last_id if job.stage == stage and job.partition_start == day else None
+                fetched = False
+
+                while True:
+                    rows = fetch(db, day, day_end, last_id, batch_size)
+                    if not rows:
+                        break
+                    fetched = True
+                    for row in rows:
+                        add(row)
+                    last_id = rows[-1].id
+
+                    # Checkpoint: state and cursor commit atomically
+                    job.stage = stage
+                    job.partition_start = day
+                    job.last_id = last_id
+                    job.state = json.dumps(accumulator.dump())
+                    job.rows_processed = (job.rows_processed or 0) + len(rows)
+                    job.updated_at = datetime.utcnow()
+                    db.commit()
+                    if len(rows) < batch_size:
+                        break
+
+                day = day_end
+                if fetched:
+                    # Move the cursor past the finished day; an empty day
+                    # costs only its re-read if the job resumes before it
+                    job.stage = stage
+                    job.partition_start = day
+                    job.last_id = None
+                    job.updated_at = datetime.utcnow()
+                    db.commit()
+
+            # Next stage starts from the first partition
+            job.partition_start = None
+            job.last_id = None
+
+        # Undated screenings fall in no day partition; report how many were
+        # ingested in the quarter so the gap in the measures is visible
+        undated = db.query(func.count(ScreeningSession.id)).filter(
+            ScreeningSession.screening_date.is_(None),
+            ScreeningSession.created_at >= quarter_start,
+            ScreeningSession.created_at < quarter_end
+        ).scalar() or 0
+        if undated:
+            logger.warning(f"Waiver report {job.quarter}: {undated} screenings have no screening date and are not counted")
+
+        result = {
+            "quarter": job.quarter,
+            "period_start": quarter_start.date().isoformat(),
+            "period_end": (quarter_end - timedelta(days=1)).date().isoformat(),
+            "generated_at": datetime.utcnow().isoformat(),
+            "rows_processed": job.rows_processed,
+            "measures": {**accumulator.measures(), "screenings_without_date": undated}
+        }
+        job.status = "completed"
+        job.result = json.dumps(result)
+        job.completed_at = datetime.utcnow()
+        job.updated_at = job.completed_at
+        db.commit()
+        logger.info(f"Waiver report {job.quarter} completed ({job.rows_processed} rows)")
+        return result
+
+    except Exception as e:
+        logger.error(f"Waiver report {job.quarter} failed at {job.stage} {job.partition_start}: {e}")
+        db.rollback()
+        job.status = "failed"
+        job.error_message = str(e)
+        db.commit()
+        raise
+
+def job_status(job: WaiverReportJob) -> Dict[str, Any]:
+    """Serialize job progress for the API"""
+    return {
+        "quarter": job.quarter,
+        "status": job.status,
+        "stage": job.stage,
+        "partition": job.partition_start.date().isoformat() if job.partition_start else None,
+        "rows_processed": job.rows_processed or 0,
+        "error_message": job.error_message,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+        "result": json.loads(job.result) if job.result else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the quarterly CMS 1115 waiver HRSN report")
+    parser.add_argument("quarter", help="Reporting quarter, e.g. 2024Q4")
+    parser.add_argument("--batch-size", type=int, default=None, help="Rows per checkpointed batch")
+    parser.add_argument("--restart", action="store_true", help="Discard any checkpoint and start over")
+    parser.add_argument("--output", help="Write the report JSON to this file")
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+    from .models import Base
+    from .database import engine
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        result = run_waiver_report(db, args.quarter, batch_size=args.batch_size, restart=args.restart)
+    finally:
+        db.close()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Ingest benchmark across bundle processors, database backends and data sizes
+
+Each processor variant saves the same seeded synthetic Bundles
+(app.synthetic_bundles) into a database pre-seeded with 1k, 100k or 1M
+members and screenings, and reports bundles/sec, per-bundle latency
+percentiles and SQL statements per bundle. Every run is a separate
+process on a fresh database. Postgres runs use (and drop) the
+`bench_ingest` schema of --postgres-url; without a URL only SQLite runs.
+Run from the repository root:
+
+    python -m benchmarks.bench_ingest [--scales 1000,100000,1000000] [--bundles 200]
+        [--postgres-url postgresql://localhost/hrsn_bench] [--output results.json]
+        [--baseline previous.json --max-regression 0.10]
+
+With --baseline the exit status is 1 when any run is slower (bundles/sec
+or p95) or issues more queries per bundle than the baseline by more than
+--max-regression.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VARIANTS = ["app", "app-batch", "simple-main", "app-fhir-resources"]
+BACKENDS = ["sqlite", "postgres"]
+PG_SCHEMA = "bench_ingest"
+SEED_BATCH = 10000
+
+def load_variant(name: str):
+    """(process(bundle, db), engine, session factory, Base, Member, ScreeningSession) for a processor"""
+    if name in ("app", "app-batch", "app-fhir-resources"):
+        from app.database import engine, SessionLocal
+        from app.models import Base, Member, ScreeningSession
+        if name == "app-fhir-resources":
+            # The fhir.resources-validated processor; needs that optional package
+            from app.fhir_processor import FHIRBundleProcessor as ValidatingProcessor
+            validating = ValidatingProcessor()
+            process = lambda bundle, db: asyncio.run(validating.process_bundle(bundle, db))
+        else:
+            from app.fhir_processor_simple import FHIRBundleProcessor
+            processor = FHIRBundleProcessor()
+            if name == "app":
+                process = lambda bundle, db: asyncio.run(processor.process_bundle(bundle, db, session_factory=SessionLocal))
+            else:
+                from app.fhir_batch import process_batch
+                process = lambda bundle, db: process_batch(bundle, db, processor.process_extraction)
+        return process, engine, SessionLocal, Base, Member, ScreeningSession
+    if name == "simple-main":
+        import simple_main
+        return (simple_main.fhir_processor.process_bundle, simple_main.engine, simple_main.SessionLocal,
+                simple_main.Base, simple_main.Member, simple_main.ScreeningSession)
+    raise ValueError(f"Unknown variant {name}")
+
+def seed_uuid() -> uuid.UUID:
+    """A uuid4 whose hex is never numeric text
+
+    SQLite gives the Postgres UUID columns NUMERIC affinity, so hex such
+    as '1234e567...' is stored as a REAL, and at 1M rows two such ids
+    eventually collide.
+    """
+    value = uuid.uuid4()
+    while not any(digit in "abcdf" for digit in value.hex):
+        value = uuid.uuid4()
+    return value
+
+def seed_rows(session_factory, Member, ScreeningSession, scale: int, ScreeningResponse=None) -> float:
+    """Bulk-insert `scale` members with one screening each; seconds taken
+
+    With a ScreeningResponse model every screening also gets its answers,
+    drawn from app.synthetic_bundles' answer weights, and the screening's
+    scores are computed from them.
+    """
+    import random
+    from sqlalchemy import insert
+    from app.screener_rules import registry
+    from app.synthetic_bundles import ANSWER_OPTIONS
+
+    rules = registry.default()
+    rng = random.Random(scale)
+    choices = {code: ([option[:2] for option in options], [option[2] for option in options])
+               for code, options in ANSWER_OPTIONS.items()}
+    started = time.perf_counter()
+    first = datetime(2023, 1, 1)
+    db = session_factory()
+    try:
+        for offset in range(0, scale, SEED_BATCH):
+            members = []
+            screenings = []
+            responses = []
+            for i in range(offset, min(scale, offset + SEED_BATCH)):
+                member_id = seed_uuid()
+                screening_id = seed_uuid()
+                members.append({"id": member_id, "fhir_id": f"seed-{i}", "first_name": "Seed", "last_name": str(i),
+                                "date_of_birth": datetime(1940, 1, 1) + timedelta(days=i * 7919 % 23725),
+                                "gender": "female" if i % 2 else "male", "state": "NY",
+                                "zip_code": f"{10000 + i % 5000:05d}"})
+                safety_score = i % 20
+                positive_count = i % 5
+                if ScreeningResponse is not None:
+                    safety_score = positive_count = 0
+                    for question_code, (options, weights) in choices.items():
+                        answer_code, answer_text = rng.choices(options, weights=weights)[0]
+                        score, positive, _, category = rules.decide(question_code, answer_code)
+                        safety_score += score
+                        positive_count += positive
+                        responses.append({"id": seed_uuid(), "screening_session_id": screening_id,
+                                          "question_code": question_code, "question_text": question_code,
+                                          "answer_code": answer_code, "answer_text": answer_text,
+                                          "sdoh_category": rules.question_categories.get(question_code),
+                                          "positive_screen": positive})
+                screenings.append({"id": screening_id, "member_id": member_id, "bundle_id": "seed",
+                                   "fhir_questionnaire_response_id": f"seed-qr-{i}",
+                                   "screening_date": first + timedelta(minutes=i), "screening_complete": True,
+                                   "total_safety_score": safety_score, "positive_screens_count": positive_count,
+                                   "questions_answered": 12})
+            db.execute(insert(Member), members)
+            db.execute(insert(ScreeningSession), screenings)
+            if responses:
+                db.execute(insert(ScreeningResponse), responses)
+            db.commit()
+    finally:
+        db.close()
+    return time.perf_counter() - started
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_one(variant: str, backend: str, scale: int, args) -> Dict[str, Any]:
+    """One measurement, in this (child) process; DATABASE_URL is already set"""
+    logging.disable(logging.WARNING)
+    from sqlalchemy import event
+    from app.synthetic_bundles import BundleGenerator, GeneratorOptions
+
+    try:
+        process, engine, session_factory, Base, Member, ScreeningSession = load_variant(variant)
+    except ImportError as e:
+        return {"variant": variant, "backend": backend, "scale": scale, "skipped": f"unavailable: {e}"}
+    Base.metadata.create_all(bind=engine)
+    seed_seconds = seed_rows(session_factory, Member, ScreeningSession, scale)
+
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*_):
+        statements[0] += 1
+
+    # The sample templates are collections; the batch variant needs entry.request
+    bundle_type = "batch" if variant == "app-batch" else None
+    generator = BundleGenerator(GeneratorOptions(seed=args.seed, min_patients=args.patients, bundle_type=bundle_type))
+    warmup = [generator.bundle() for _ in range(args.warmup)]
+    bundles = [generator.bundle() for _ in range(args.bundles)]
+
+    db = session_factory()
+    try:
+        for bundle in warmup:
+            process(bundle, db)
+        statements[0] = 0
+        latencies = []
+        started = time.perf_counter()
+        for bundle in bundles:
+            bundle_started = time.perf_counter()
+            process(bundle, db)
+            latencies.append((time.perf_counter() - bundle_started) * 1000)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    return {
+        "variant": variant,
+        "backend": backend,
+        "scale": scale,
+        "bundles": len(bundles),
+        "patients_per_bundle": args.patients,
+        "seed_seconds": round(seed_seconds, 2),
+        "seconds": round(elapsed, 3),
+        "bundles_per_sec": round(len(bundles) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(max(latencies), 3)
+        },
+        "queries_per_bundle": round(statements[0] / len(bundles), 2)
+    }
+
+def backend_url(backend: str, postgres_url: Optional[str], workdir: str, variant: str, scale: int) -> str:
+    """A fresh, empty database for one run"""
+    if backend == "sqlite":
+        return f"sqlite:///{os.path.join(workdir, f'{variant}-{scale}.db')}"
+    from sqlalchemy import create_engine, make_url, text
+    admin = create_engine(postgres_url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {PG_SCHEMA}"))
+    admin.dispose()
+    url = make_url(postgres_url).update_query_dict({"options": f"-csearch_path={PG_SCHEMA}"})
+    return url.render_as_string(hide_password=False)
+
+def spawn(variant: str, backend: str, scale: int, url: str, args) -> Dict[str, Any]:
+    env = dict(os.environ, DATABASE_URL=url, WEB_STORE_DIR="", SCREENER_RULES_DIR="", PYTHONPATH=ROOT)
+    command = [sys.executable, "-m", "benchmarks.bench_ingest", "--child", variant, backend, str(scale),
+               "--bundles", str(args.bundles), "--warmup", str(args.warmup), "--patients", str(args.patients),
+               "--seed", str(args.seed)]
+    completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+    if completed.returncode != 0 or not lines:
+        return {"variant": variant, "backend": backend, "scale": scale,
+                "error": (completed.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+def run_key(result: Dict[str, Any]) -> str:
+    return f"{result['variant']}/{result['backend']}/{result['scale']}"
+
+def regressions(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Runs worse than the baseline's matching run by more than threshold"""
+    previous = {run_key(result): result for result in baseline.get("results", []) if "bundles_per_sec" in result}
+    found = []
+    for result in results:
+        before = previous.get(run_key(result))
+        if before is None or "bundles_per_sec" not in result:
+            continue
+        key = run_key(result)
+        if result["bundles_per_sec"] < before["bundles_per_sec"] * (1 - threshold):
+            found.append(f"{key}: {before['bundles_per_sec']} -> {result['bundles_per_sec']} bundles/sec")
+        if result["latency_ms"]["p95"] > before["latency_ms"]["p95"] * (1 + threshold):
+            found.append(f"{key}: p95 {before['latency_ms']['p95']} -> {result['latency_ms']['p95']}ms")
+        if result["queries_per_bundle"] > before["queries_per_bundle"] * (1 + threshold):
+            found.append(f"{key}: {before['queries_per_bundle']} -> {result['queries_per_bundle']} queries/bundle")
+    return found
+
+def report(result: Dict[str, Any]):
+    key = run_key(result)
+    if "skipped" in result or "error" in result:
+        print(f"{key:<38} {result.get('skipped') or 'FAILED: ' + result['error']}")
+        return
+    latency = result["latency_ms"]
+    print(f"{key:<38} {result['bundles_per_sec']:8.1f} bundles/s  p50 {latency['p50']:7.2f}ms  "
+          f"p95 {latency['p95']:7.2f}ms  p99 {latency['p99']:7.2f}ms  {result['queries_per_bundle']:6.1f} queries/bundle")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", default=",".join(VARIANTS[:3]), help=f"Comma-separated, from {', '.join(VARIANTS)}")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--scales", default="1000,100000,1000000", help="Seeded member counts")
+    parser.add_argument("--bundles", type=int, default=200, help="Measured bundles per run")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--patients", type=int, default=1, help="Patients per bundle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--postgres-url", default=os.environ.get("BENCH_POSTGRES_URL"),
+                        help="Postgres database to benchmark in (schema bench_ingest is dropped and recreated)")
+    parser.add_argument("--output", help="Write the results JSON here")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed slowdown before failing (0.10 = 10%%)")
+    parser.add_argument("--child", nargs=3, metavar=("VARIANT", "BACKEND", "SCALE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        variant, backend, scale = args.child
+        print(json.dumps(run_one(variant, backend, int(scale), args)))
+        return
+
+    variants = [name for name in args.variants.split(",") if name]
+    backends = [name for name in args.backends.split(",") if name]
+    if "postgres" in backends and not args.postgres_url:
+        print("Skipping postgres: no --postgres-url (or BENCH_POSTGRES_URL)")
+        backends.remove("postgres")
+
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    results = []
+    try:
+        for backend in backends:
+            for scale in [int(value) for value in args.scales.split(",") if value]:
+                for variant in variants:
+                    url = backend_url(backend, args.postgres_url, workdir, variant, scale)
+                    result = spawn(variant, backend, scale, url, args)
+                    report(result)
+                    results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "options": {"bundles": args.bundles, "warmup": args.warmup, "patients": args.patients, "seed": args.seed},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+
+    failed = [run_key(result) for result in results if "error" in result]
+    found = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if not found:
+            print(f"No regressions beyond {args.max_regression:.0%} against {args.baseline}")
+    if failed or found:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""JSON decode/encode benchmark for the ingest and read routes
+
+Times the JSON work of each route the old way (FastAPI's dict body
+parsing, jsonable_encoder + stdlib json.dumps) and through app.json_codec,
+then measures the route's p50 end to end and reports what share of it
+the JSON work is before and after. Run from the repository root:
+
+    python -m benchmarks.bench_json [--repeat 300] [--members 1000]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Scratch SQLite database and no web store persistence; set before app.config loads
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_json_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ["WEB_STORE_DIR"] = ""
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+from app import json_codec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLES = ["hrsn_bundle_1.json", "hrsn_bundle_2.json", "hrsn_bundle_1_complete.json",
+           "hrsn_bundle_2_complete.json", "hrsn_bundle_3_complete.json"]
+DICT_BODY = TypeAdapter(Dict[str, Any])
+
+def legacy_decode(body: bytes) -> Any:
+    """What a `bundle: Dict[str, Any]` body parameter costs: stdlib parse plus model validation"""
+    return DICT_BODY.validate_python(json.loads(body))
+
+def legacy_encode(payload: Any) -> bytes:
+    """What returning a dict cost: jsonable_encoder, then JSONResponse.render"""
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+def per_call_us(fn, arg, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+def p50_us(call, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = call()
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+    return statistics.median(samples) * 1e6
+
+def members_payload(count: int) -> Dict[str, Any]:
+    """A /members-shaped payload with native UUIDs, as app.main builds it"""
+    return {"members": [{"id": uuid.uuid4(), "name": f"Member {i}", "age": 20 + i % 60,
+                         "zip_code": f"{10000 + i % 500}"} for i in range(count)]}
+
+def assessment_payload() -> Dict[str, Any]:
+    """A /members/{id}-shaped payload with a screening history"""
+    started = datetime(2024, 1, 1)
+    return {
+        "member": {"id": uuid.uuid4(), "name": "Maria Rodriguez", "date_of_birth": "1985-03-15",
+                   "gender": "female", "address": "123 Main St, Albany, NY 12203", "zip_code": "12203"},
+        "assessments": [{"id": uuid.uuid4(), "screening_date": started + timedelta(days=30 * i),
+                         "total_safety_score": i % 20, "questions_answered": 12, "positive_screens": i % 5,
+                         "high_risk": i % 20 >= 11} for i in range(24)],
+        "assessment_count": 24
+    }
+
+def report(name: str, p50: float, old_json: float, new_json: float):
+    # The route now spends new_json on JSON; the old route spent old_json instead
+    before = p50 - new_json + old_json
+    print(f"{name:<34} p50 {before:8.0f}us -> {p50:8.0f}us | JSON {old_json:7.0f}us "
+          f"({old_json / before:5.1%}) -> {new_json:7.0f}us ({new_json / p50:5.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=300)
+    parser.add_argument("--members", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"JSON codec: {'orjson ' + json_codec.orjson.__version__ if json_codec.orjson else 'stdlib json (orjson not installed)'}")
+
+    bodies = {name: open(os.path.join(ROOT, name), "rb").read() for name in BUNDLES}
+    print("\nIngest - request decoding")
+    for name, body in bodies.items():
+        old = per_call_us(legacy_decode, body, args.repeat)
+        new = per_call_us(json_codec.loads, body, args.repeat)
+        print(f"  {name:<30} {len(body) / 1024:5.1f}KB  {old:7.1f}us -> {new:6.1f}us  ({old / new:4.1f}x)")
+
+    print("\nRead - response encoding")
+    from app.bundle_extraction import extract_bundle, table_projection
+    payloads = {
+        f"/members ({args.members} members)": members_payload(args.members),
+        "/members/{id} (24 assessments)": assessment_payload(),
+        "table view (bundle_3_complete)": table_projection(extract_bundle(json.loads(bodies[BUNDLES[-1]])))
+    }
+    encode_times = {}
+    for name, payload in payloads.items():
+        old = per_call_us(legacy_encode, payload, args.repeat)
+        new = per_call_us(json_codec.dumps, payload, args.repeat)
+        encode_times[name] = (old, new)
+        print(f"  {name:<30} {old:7.1f}us -> {new:6.1f}us  ({old / new:4.1f}x)")
+
+    print("\nEnd to end (in-process TestClient), JSON share of p50")
+    from app import web_main
+    client = TestClient(web_main.app)
+    body = bodies[BUNDLES[-1]]
+    table = payloads["table view (bundle_3_complete)"]
+    p50 = p50_us(lambda: client.post("/api/process-bundle", content=body,
+                                     headers={"Content-Type": "application/json"}), args.repeat)
+    old_json = per_call_us(legacy_decode, body, args.repeat) + encode_times["table view (bundle_3_complete)"][0]
+    new_json = per_call_us(json_codec.loads, body, args.repeat) + per_call_us(json_codec.dumps, table, args.repeat)
+    report("POST /api/process-bundle (web)", p50, old_json, new_json)
+
+    os.makedirs(os.path.join(ROOT, "logs"), exist_ok=True)
+    from app.main import app
+    from app.config import settings
+    from app.database import SessionLocal
+    from app.models import Member
+    db = SessionLocal()
+    db.add_all([Member(fhir_id=f"bench-{i}", first_name="Member", last_name=str(i),
+                       zip_code=f"{10000 + i % 500}") for i in range(args.members)])
+    db.commit()
+    db.close()
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {settings.DEFAULT_API_KEY}"}
+    p50 = p50_us(lambda: client.get("/members", headers=headers), max(20, args.repeat // 10))
+    old_json, new_json = encode_times[f"/members ({args.members} members)"]
+    report(f"GET /members ({args.members} members)", p50, old_json, new_json)
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
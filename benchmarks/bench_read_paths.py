@@ -0,0 +1,231 @@
+"""Read-path benchmark for the member, assessment, export and analytics endpoints
+
+Seeds databases of increasing size (members, one screening each and its
+answers) and calls each read endpoint in-process through the ASGI app -
+no server, no network - recording latency percentiles, SQL statements
+per request, response size and peak Python memory (tracemalloc, in a
+separate pass so it does not skew latency). Cached endpoints are timed
+cold (cache generation bumped before every request) and warm. Each app
+and size runs in its own process on a fresh SQLite database, or in the
+bench_read schema of --postgres-url. Run from the repository root:
+
+    python -m benchmarks.bench_read_paths [--scales 1000,10000,100000] [--repeat 30]
+        [--postgres-url postgresql://localhost/hrsn_bench] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_ingest import percentile, seed_rows
+
+PG_SCHEMA = "bench_read"
+
+# app -> [(endpoint, path template, served from the response cache)]
+ENDPOINTS = {
+    "simple-main": [
+        ("/members", "/members", False),
+        ("/members/{id}", "/members/{member_id}", False),
+        ("/assessments/{id}", "/assessments/{assessment_id}", False),
+        ("/members/export/csv", "/members/export/csv", False)
+    ],
+    "app": [
+        ("/members", "/members", False),
+        ("/analytics/dashboard", "/analytics/dashboard", True),
+        ("/reports/safety-scores", "/reports/safety-scores", True)
+    ]
+}
+
+# Endpoints whose cost grows with the whole table: this many timed requests, no warm-up
+MAX_REQUESTS = {"/members/export/csv": 1}
+
+def load_app(name: str):
+    """(ASGI app, engine, Base, Member, ScreeningSession, ScreeningResponse, API key)"""
+    if name == "simple-main":
+        import simple_main
+        return (simple_main.app, simple_main.engine, simple_main.Base, simple_main.Member,
+                simple_main.ScreeningSession, simple_main.ScreeningResponse, simple_main.DEFAULT_API_KEY), \
+            simple_main.SessionLocal
+    os.makedirs(os.path.join(ROOT, "logs"), exist_ok=True)
+    from app.main import app
+    from app.config import settings
+    from app.database import engine, SessionLocal
+    from app.models import Base, Member, ScreeningSession, ScreeningResponse
+    return (app, engine, Base, Member, ScreeningSession, ScreeningResponse, settings.DEFAULT_API_KEY), SessionLocal
+
+def run_one(app_name: str, scale: int, repeat: int) -> List[Dict[str, Any]]:
+    """Every endpoint of one app at one size, in this (child) process"""
+    logging.disable(logging.WARNING)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from app.cache import response_cache
+
+    (app, engine, Base, Member, ScreeningSession, ScreeningResponse, api_key), session_factory = load_app(app_name)
+    Base.metadata.create_all(bind=engine)
+    seed_seconds = seed_rows(session_factory, Member, ScreeningSession, scale, ScreeningResponse)
+
+    db = session_factory()
+    ids = {
+        "member_id": [str(row[0]) for row in db.query(Member.id).limit(repeat).all()],
+        "assessment_id": [str(row[0]) for row in db.query(ScreeningSession.id).limit(repeat).all()]
+    }
+    db.close()
+
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*_):
+        statements[0] += 1
+
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    def paths(template: str) -> List[str]:
+        for name, values in ids.items():
+            if "{" + name + "}" in template:
+                return [template.replace("{" + name + "}", values[i % len(values)]) for i in range(repeat)]
+        return [template] * repeat
+
+    def call(path: str, cold: bool) -> int:
+        if cold:
+            response_cache.bump_generation()
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, f"{path}: {response.status_code} {response.text[:200]}"
+        return len(response.content)
+
+    results = []
+    for endpoint, template, cached in ENDPOINTS[app_name]:
+        for mode in (("cold", "warm") if cached else ("uncached",)):
+            cold = mode == "cold"
+            targets = paths(template)[:MAX_REQUESTS.get(endpoint, repeat)]
+            if endpoint not in MAX_REQUESTS:
+                call(targets[0], cold)  # warm-up
+            statements[0] = 0
+            latencies = []
+            for path in targets:
+                started = time.perf_counter()
+                size = call(path, cold)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries = statements[0] / len(targets)
+
+            tracemalloc.start()
+            peak = 0
+            for path in targets[:max(1, min(5, repeat))]:
+                tracemalloc.reset_peak()
+                call(path, cold)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            results.append({
+                "app": app_name,
+                "endpoint": endpoint if mode == "uncached" else f"{endpoint} ({mode})",
+                "scale": scale,
+                "requests": len(targets),
+                "seed_seconds": round(seed_seconds, 2),
+                "latency_ms": {
+                    "p50": round(statistics.median(latencies), 3),
+                    "p95": round(percentile(latencies, 0.95), 3),
+                    "max": round(max(latencies), 3)
+                },
+                "queries_per_request": round(queries, 2),
+                "response_bytes": size,
+                "peak_memory_kb": round(peak / 1024, 1)
+            })
+    return results
+
+def database_url(postgres_url: str, workdir: str, app_name: str, scale: int) -> str:
+    if not postgres_url:
+        return f"sqlite:///{os.path.join(workdir, f'{app_name}-{scale}.db')}"
+    from sqlalchemy import create_engine, make_url, text
+    admin = create_engine(postgres_url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {PG_SCHEMA}"))
+    admin.dispose()
+    url = make_url(postgres_url).update_query_dict({"options": f"-csearch_path={PG_SCHEMA}"})
+    return url.render_as_string(hide_password=False)
+
+def spawn(app_name: str, scale: int, url: str, repeat: int) -> List[Dict[str, Any]]:
+    env = dict(os.environ, DATABASE_URL=url, WEB_STORE_DIR="", SCREENER_RULES_DIR="", PYTHONPATH=ROOT)
+    command = [sys.executable, "-m", "benchmarks.bench_read_paths", "--child", app_name, str(scale),
+               "--repeat", str(repeat)]
+    completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith("[")]
+    if completed.returncode != 0 or not lines:
+        return [{"app": app_name, "scale": scale, "endpoint": "*",
+                 "error": (completed.stderr.strip().splitlines() or ["no output"])[-1]}]
+    return json.loads(lines[-1])
+
+def report(results: List[Dict[str, Any]], scales: List[int]):
+    """p50 per endpoint across sizes, with queries and peak memory at the largest"""
+    rows: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for result in results:
+        rows.setdefault(f"{result['app']} {result['endpoint']}", {})[result["scale"]] = result
+    print(f"\n{'p50 ms':<46}" + "".join(f"{scale:>12,}" for scale in scales) + "   queries   peak KB")
+    for name, by_scale in rows.items():
+        cells = []
+        for scale in scales:
+            result = by_scale.get(scale)
+            if result is None:
+                cells.append(f"{'-':>12}")
+            elif "error" in result:
+                cells.append(f"{'FAILED':>12}")
+            else:
+                cells.append(f"{result['latency_ms']['p50']:>12.2f}")
+        largest = by_scale.get(scales[-1], {})
+        tail = f"{largest['queries_per_request']:>10.1f}{largest['peak_memory_kb']:>10.0f}" if "latency_ms" in largest else ""
+        print(f"{name:<46}" + "".join(cells) + tail)
+    for result in results:
+        if "error" in result:
+            print(f"FAILED {result['app']} at {result['scale']}: {result['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", default=",".join(ENDPOINTS), help=f"Comma-separated, from {', '.join(ENDPOINTS)}")
+    parser.add_argument("--scales", default="1000,10000,100000", help="Seeded member counts")
+    parser.add_argument("--repeat", type=int, default=30, help="Requests per endpoint and size")
+    parser.add_argument("--postgres-url", default=os.environ.get("BENCH_POSTGRES_URL"),
+                        help="Run against Postgres (schema bench_read is dropped and recreated) instead of SQLite")
+    parser.add_argument("--output", help="Write the results JSON here")
+    parser.add_argument("--child", nargs=2, metavar=("APP", "SCALE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        app_name, scale = args.child
+        print(json.dumps(run_one(app_name, int(scale), args.repeat)))
+        return
+
+    scales = sorted(int(value) for value in args.scales.split(",") if value)
+    workdir = tempfile.mkdtemp(prefix="bench_read_")
+    results = []
+    try:
+        for scale in scales:
+            for app_name in [name for name in args.apps.split(",") if name]:
+                url = database_url(args.postgres_url, workdir, app_name, scale)
+                print(f"{app_name} at {scale:,} members...", flush=True)
+                results.extend(spawn(app_name, scale, url, args.repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results, scales)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": datetime.utcnow().isoformat(), "backend": "postgres" if args.postgres_url else "sqlite",
+                       "repeat": args.repeat, "results": results}, f, indent=2)
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Chatbot intent router benchmark
+
+Checks every phrasing in chatbot_questions.json routes to its expected
+intent and slots, then times the compiled router against the keyword
+chain it replaced. Run from the repository root:
+
+    python -m benchmarks.bench_router [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.chatbot_router import IntentRouter, VOCABULARY, router
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_questions.json")
+
+def legacy_classify(question: str) -> str:
+    """The substring chain the chatbots used before the router (intent only, no slots)"""
+    if "food" in question and ("insecurity" in question or "insecure" in question):
+        return "food"
+    if "housing" in question or "homeless" in question or "shelter" in question:
+        return "housing"
+    if "transport" in question:
+        return "transportation"
+    if "utilit" in question or "shut off" in question or "electric" in question:
+        return "utilities"
+    if "employ" in question or "job" in question:
+        return "employment"
+    if "safety" in question or "violence" in question or "hurt" in question or "risk" in question:
+        return "safety"
+    if "how many" in question or "count" in question or "number" in question:
+        return "food" if "food" in question else "statistics"
+    if "who" in question or "which members" in question or "tell me" in question:
+        return "food" if "food" in question else "members"
+    if "stats" in question or "statistics" in question or "summary" in question:
+        return "statistics"
+    if "database" in question or "overview" in question or "show all" in question:
+        return "overview"
+    return "help"
+
+def time_per_question(fn, questions, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for question in questions:
+            fn(question)
+    return (time.perf_counter() - started) / (repeat * len(questions)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(CORPUS) as f:
+        corpus = json.load(f)
+    today = date.fromisoformat(corpus["today"])
+    entries = corpus["questions"]
+
+    failures = 0
+    for entry in entries:
+        routed = router.route(entry["question"], today=today)
+        if routed["intent"] != entry["intent"] or routed["slots"] != entry["slots"]:
+            failures += 1
+            print(f"MISMATCH {entry['question']!r}: expected {entry['intent']} {entry['slots']}, "
+                  f"got {routed['intent']} {routed['slots']}")
+    print(f"{len(entries) - failures}/{len(entries)} phrasings routed as expected")
+
+    started = time.perf_counter()
+    IntentRouter(VOCABULARY)
+    print(f"Automaton build: {(time.perf_counter() - started) * 1000:.2f}ms "
+          f"({len(VOCABULARY)} terms, {len(router.goto)} states)")
+
+    questions = [entry["question"].strip().lower() for entry in entries]
+    legacy = time_per_question(legacy_classify, questions, args.repeat)
+    routed = time_per_question(lambda q: router.route(q, today=today), questions, args.repeat)
+    print(f"Legacy keyword chain (intent only): {legacy:.2f}us/question")
+    print(f"Compiled router (intent + slots):   {routed:.2f}us/question")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
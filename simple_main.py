@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine, text, Column, String, Integer, Boolean, DateTime, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
@@ -15,6 +16,18 @@ import re
 import csv
 import io
 
+from app.cache import response_cache
+from app.chatbot_db import record_screening_flags, remove_member_flags, answer_question, create_chatbot_tables
+from app.bundle_extraction import extract_bundle, table_projection
+from app.screener_rules import ScreenerRules
+from app.bundle_partition import PartialBundleError, should_partition, process_partitioned
+from app.json_codec import FastJSONResponse, read_json_body, JSON_BODY_OPENAPI
+from app.compression import CompressionMiddleware
+from app.fhir_batch import is_batch, process_batch
+from app.metrics import MetricsMiddleware, StageTimer, bundles_total, instrument_engine, metrics_response
+from app.query_instrumentation import QueryInstrumentationMiddleware, instrument_queries
+from app.profiler import profile
+
 # Database setup
 DATABASE_URL = os.environ.get("DATABASE_URL")
 engine = None
@@ -139,23 +152,40 @@ HRSN_QUESTION_MAPPINGS = {
     }
 }
 
+# This server scores every screener against its own reduced question set
+SCREENER_RULES = ScreenerRules("simple-main", 1, HRSN_QUESTION_MAPPINGS)
+
 class FHIRBundleProcessor:
     """Simple FHIR bundle processor for basic functionality"""
     
-    def __init__(self):
-        self.safety_questions = ["95618-5", "95617-7", "95616-9", "95615-1"]
-    
-    def process_bundle(self, bundle_dict: dict, db: Session) -> dict:
+    def process_bundle(self, bundle_dict: dict, db: Session, timer: StageTimer = None) -> dict:
         """Main entry point for processing FHIR bundles"""
+        # Basic validation
+        if not isinstance(bundle_dict, dict) or bundle_dict.get("resourceType") != "Bundle":
+            raise ValueError("Invalid FHIR Bundle structure")
+        
+        timer = timer or StageTimer()
+        return self.save_extraction(extract_bundle(bundle_dict, SCREENER_RULES, timer), db, timer)
+    
+    def save_extraction(self, extraction: dict, db: Session, timer: StageTimer = None) -> dict:
+        """Save an extraction, as concurrent per-patient partitions when the bundle covers many patients"""
+        if should_partition(extraction, db):
+            # The partitions time their own stages
+            result = process_partitioned(self.process_extraction, extraction, SessionLocal)
+            if timer is not None:
+                timer.lap("write", observe=False)
+            return result
+        return self.process_extraction(extraction, db, timer=timer)
+    
+    def process_extraction(self, extraction: dict, db: Session, commit: bool = True, timer: StageTimer = None) -> dict:
+        """Save an already-extracted bundle (see app.bundle_extraction)
+        
+        With commit=False the rows are only flushed, for a caller that owns
+        the transaction (app.fhir_batch).
+        """
         try:
-            logging.info(f"Processing FHIR bundle: {bundle_dict.get('id', 'unknown')}")
-            
-            # Basic validation
-            if not isinstance(bundle_dict, dict) or bundle_dict.get("resourceType") != "Bundle":
-                raise ValueError("Invalid FHIR Bundle structure")
-            
-            bundle_id = bundle_dict.get("id")
-            entries = bundle_dict.get("entry", [])
+            bundle_id = extraction["bundle_id"]
+            logging.info(f"Processing FHIR bundle: {bundle_id or 'unknown'}")
             
             result = {
                 "bundle_id": bundle_id,
@@ -164,30 +194,40 @@ class FHIRBundleProcessor:
                 "status": "completed"
             }
             
-            # Process each resource in the bundle
-            for entry in entries:
-                resource = entry.get("resource", {})
-                resource_type = resource.get("resourceType")
-                
-                if resource_type == "Patient":
-                    self._process_member(resource, db)
-                    result["members_processed"] += 1
-                elif resource_type == "QuestionnaireResponse":
-                    self._process_questionnaire_response(resource, db)
+            # Dependency order: members first, so screenings resolve their
+            # subject to a member saved from this same bundle
+            timer = timer or StageTimer()
+            members = []
+            for patient in extraction["patients"]:
+                members.append(self._process_member(patient, db))
+                result["members_processed"] += 1
+            timer.lap("match")
+            for screening in extraction["screenings"]:
+                skipped = self._process_questionnaire_response(screening, members, db)
+                if skipped:
+                    result.setdefault("screenings_skipped", []).append({"id": screening["session_id"], "reason": skipped})
+                else:
                     result["screenings_processed"] += 1
+            timer.lap("write")
             
-            db.commit()
-            logging.info(f"Successfully processed bundle {bundle_id}")
+            if commit:
+                db.commit()
+                timer.lap("commit")
+                
+                # New data committed - cached chatbot answers are now stale
+                response_cache.bump_generation()
+                logging.info(f"Successfully processed bundle {bundle_id}")
             return result
             
         except Exception as e:
             logging.error(f"Error processing bundle: {e}")
-            db.rollback()
+            if commit:
+                db.rollback()
             raise
     
-    def _process_member(self, patient_resource: dict, db: Session) -> Member:
-        """Process a FHIR Patient resource into a Member"""
-        fhir_id = patient_resource.get("id")
+    def _process_member(self, patient: dict, db: Session) -> Member:
+        """Create a Member from an extracted Patient"""
+        fhir_id = patient["fhir_id"]
         if not fhir_id:
             raise ValueError("Patient resource missing ID")
         
@@ -196,165 +236,72 @@ class FHIRBundleProcessor:
         if existing_member:
             return existing_member
         
-        # Extract name
-        name_data = patient_resource.get("name", [])
-        first_name = ""
-        last_name = ""
-        if name_data and isinstance(name_data, list) and len(name_data) > 0:
-            name = name_data[0]
-            given = name.get("given", [])
-            if given:
-                first_name = " ".join(given) if isinstance(given, list) else str(given)
-            last_name = name.get("family", "")
-        
-        # Extract other data
-        gender = patient_resource.get("gender", "")
-        birth_date_str = patient_resource.get("birthDate", "")
-        birth_date = None
-        if birth_date_str:
-            try:
-                birth_date = datetime.strptime(birth_date_str, "%Y-%m-%d")
-            except:
-                pass
-        
-        # Extract address
-        addresses = patient_resource.get("address", [])
-        address_line1 = ""
-        city = ""
-        state = ""
-        zip_code = ""
-        address_full = ""
-        if addresses and len(addresses) > 0:
-            addr = addresses[0]
-            lines = addr.get("line", [])
-            if lines:
-                address_line1 = lines[0] if isinstance(lines, list) else str(lines)
-            city = addr.get("city", "")
-            state = addr.get("state", "")
-            zip_code = addr.get("postalCode", "")
-            
-            # Build full address
-            parts = []
-            if address_line1:
-                parts.append(address_line1)
-            if city:
-                parts.append(city)
-            if state:
-                parts.append(state)
-            if zip_code:
-                parts.append(zip_code)
-            address_full = ", ".join(parts)
-        
-        # Create new member
         member = Member(
             fhir_id=fhir_id,
-            first_name=first_name,
-            last_name=last_name,
-            date_of_birth=birth_date,
-            gender=gender,
-            address=address_full,
-            address_line1=address_line1,
-            city=city,
-            state=state,
-            zip_code=zip_code
+            first_name=patient["first_name"],
+            last_name=patient["last_name"],
+            date_of_birth=patient["date_of_birth"],
+            gender=patient["gender"] or "",
+            address=patient["address"],
+            address_line1=patient["address_line1"],
+            city=patient["city"],
+            state=patient["state"],
+            zip_code=patient["zip_code"]
         )
         
         db.add(member)
         db.flush()  # Get the ID
         return member
     
-    def _process_questionnaire_response(self, qr_resource: dict, db: Session):
-        """Process a QuestionnaireResponse into screening data"""
-        session_id = qr_resource.get("id")
+    def _process_questionnaire_response(self, extracted: dict, members: list, db: Session):
+        """Save an extracted QuestionnaireResponse as screening data
+        
+        Returns why the screening was skipped, or None once it is saved.
+        """
+        session_id = extracted["session_id"]
         if not session_id:
-            return
+            return "QuestionnaireResponse missing ID"
         
-        # Get member reference
-        subject_ref = qr_resource.get("subject", {}).get("reference", "")
-        if subject_ref.startswith("Patient/"):
-            member_fhir_id = subject_ref.replace("Patient/", "")
-            member = db.query(Member).filter(Member.fhir_id == member_fhir_id).first()
+        # Subjects in this bundle were resolved during extraction; only a
+        # Patient outside it needs the database
+        subject_ref = extracted["subject_reference"]
+        if extracted["subject_patient"] is not None:
+            member = members[extracted["subject_patient"]]
+        elif extracted["member_fhir_id"]:
+            member = db.query(Member).filter(Member.fhir_id == extracted["member_fhir_id"]).first()
             if not member:
                 logging.warning(f"Member not found for reference: {subject_ref}")
-                return
+                return f"Member not found for reference: {subject_ref}"
         else:
             logging.warning(f"Invalid subject reference: {subject_ref}")
-            return
-        
-        # Create screening session
-        authored_date_str = qr_resource.get("authored", "")
-        screening_date = datetime.utcnow()
-        if authored_date_str:
-            try:
-                screening_date = datetime.fromisoformat(authored_date_str.replace("Z", "+00:00"))
-            except:
-                pass
+            return f"Invalid subject reference: {subject_ref}"
         
+        # Scores and counts were computed during extraction
         screening = ScreeningSession(
             member_id=member.id,
-            screening_date=screening_date,
-            fhir_questionnaire_response_id=session_id
+            screening_date=extracted["screening_date"] or datetime.utcnow(),
+            fhir_questionnaire_response_id=session_id,
+            total_safety_score=extracted["total_safety_score"],
+            positive_screens_count=extracted["positive_answers"],
+            questions_answered=extracted["questions_answered"]
         )
         
         db.add(screening)
         db.flush()  # Get the ID
         
-        # Process responses
-        safety_score = 0
-        positive_screens = 0
-        answered_questions = set()  # Track unique questions answered
+        db.add_all([
+            ScreeningResponse(
+                screening_session_id=screening.id,
+                question_code=answer["question_code"],
+                question_text=answer["question_text"],
+                answer_code=answer["answer_code"],
+                answer_text=answer["answer_text"]
+            )
+            for answer in extracted["answers"] if answer["mapped"]
+        ])
         
-        items = qr_resource.get("item", [])
-        for item in items:
-            question_code = item.get("linkId")
-            question_text = item.get("text", "")
-            
-            # Track that this question was answered (excluding calculated fields like safety score)
-            if question_code and item.get("answer") and question_code != "95614-4":
-                answered_questions.add(question_code)
-            
-            if question_code and question_code in HRSN_QUESTION_MAPPINGS:
-                
-                for answer in item.get("answer", []):
-                    answer_code = None
-                    answer_text = ""
-                    
-                    if "valueCoding" in answer:
-                        coding = answer["valueCoding"]
-                        answer_code = coding.get("code")
-                        answer_text = coding.get("display", answer_code or "")
-                    elif "valueString" in answer:
-                        answer_text = answer["valueString"]
-                    elif "valueBoolean" in answer:
-                        answer_text = "Yes" if answer["valueBoolean"] else "No"
-                    elif "valueInteger" in answer:
-                        answer_text = str(answer["valueInteger"])
-                    
-                    # Calculate safety score
-                    if question_code in self.safety_questions and answer_code:
-                        score_mapping = HRSN_QUESTION_MAPPINGS[question_code].get("score_mapping", {})
-                        if answer_code in score_mapping:
-                            safety_score += score_mapping[answer_code]
-                    
-                    # Check for positive screen
-                    positive_answers = HRSN_QUESTION_MAPPINGS[question_code].get("positive_answers", [])
-                    if answer_code in positive_answers:
-                        positive_screens += 1
-                    
-                    # Create response record
-                    response = ScreeningResponse(
-                        screening_session_id=screening.id,
-                        question_code=question_code,
-                        question_text=question_text,
-                        answer_code=answer_code,
-                        answer_text=answer_text
-                    )
-                    db.add(response)
-        
-        # Update screening with calculated values
-        screening.total_safety_score = safety_score
-        screening.positive_screens_count = positive_screens
-        screening.questions_answered = len(answered_questions)
+        # Keep the chatbot's condition flags current in the same transaction
+        record_screening_flags(db, member.id, screening, extracted["positive_categories"])
 
 # Database connection
 if DATABASE_URL and DATABASE_URL != "Postgres.DATABASE_URL":
@@ -368,6 +315,7 @@ if DATABASE_URL and DATABASE_URL != "Postgres.DATABASE_URL":
         
         # Create tables
         Base.metadata.create_all(bind=engine)
+        create_chatbot_tables(engine)
         print("Database tables created successfully")
         
     except Exception as e:
@@ -387,6 +335,7 @@ else:
         
         # Create tables
         Base.metadata.create_all(bind=engine)
+        create_chatbot_tables(engine)
         print("Database connected successfully using fallback URL")
         
     except Exception as e:
@@ -394,6 +343,10 @@ else:
         engine = None
         SessionLocal = None
 
+if engine is not None:
+    instrument_engine(engine)
+    instrument_queries(engine)
+
 def get_db():
     """Database dependency"""
     if SessionLocal:
@@ -415,14 +368,31 @@ def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)
         raise HTTPException(status_code=401, detail="Invalid API key")
     return credentials.credentials
 
+def parse_uuid(value: str, name: str) -> uuid.UUID:
+    """A path id as a UUID; anything else is a malformed request, not a missing row"""
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a UUID")
+
 app = FastAPI(
     title="HRSN FHIR Processing Server",
     description="NY State 1115 Waiver HRSN Data Processing API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse
 )
 
+# gzip/zstd for JSON and CSV responses, negotiated per request
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get("COMPRESSION_MIN_BYTES", "1024")))
+
+# Statements per request, logged when excessive (and as headers in debug mode)
+app.add_middleware(QueryInstrumentationMiddleware, debug_headers=os.environ.get("DEBUG", "False").lower() == "true")
+
+# Per-route latency and in-flight requests for /metrics (outermost, so it times everything)
+app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -494,6 +464,17 @@ async def health_check():
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: route latency, bundle ingest and the database pool"""
+    return metrics_response()
+
+@app.get("/admin/profile")
+async def profile_server(request: Request, seconds: float = 30, hz: int = 100, idle: bool = False,
+                         api_key: str = Depends(verify_api_key)):
+    """Sample every thread of this worker for `seconds`; collapsed stacks for a flamegraph (authenticated endpoint)"""
+    return await profile(request, seconds, hz, idle)
+
 @app.get("/members/count")
 async def get_members_count():
     """Get count of members"""
@@ -541,7 +522,7 @@ async def list_members(db: Session = Depends(get_db), api_key: str = Depends(ver
                 "zip_code": zip_code
             })
         
-        return {"members": member_list}
+        return FastJSONResponse({"members": member_list})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
@@ -552,7 +533,7 @@ async def get_member_detail(member_id: str, db: Session = Depends(get_db), api_k
         raise HTTPException(status_code=503, detail="Database not available")
     
     try:
-        member = db.query(Member).filter(Member.id == member_id).first()
+        member = db.query(Member).filter(Member.id == parse_uuid(member_id, "member_id")).first()
         
         if not member:
             raise HTTPException(status_code=404, detail="Member not found")
@@ -588,7 +569,7 @@ async def get_member_detail(member_id: str, db: Session = Depends(get_db), api_k
                 "high_risk": screening.total_safety_score >= 11 if screening.total_safety_score else False
             })
         
-        return {
+        return FastJSONResponse({
             "member": {
                 "id": str(member.id),
                 "name": f"{member.first_name or ''} {member.last_name or ''}".strip(),
@@ -604,7 +585,7 @@ async def get_member_detail(member_id: str, db: Session = Depends(get_db), api_k
             },
             "assessments": assessments,
             "assessment_count": len(assessments)
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -618,7 +599,7 @@ async def delete_member(member_id: str, db: Session = Depends(get_db), api_key:
     
     try:
         # Check if member exists
-        member = db.query(Member).filter(Member.id == member_id).first()
+        member = db.query(Member).filter(Member.id == parse_uuid(member_id, "member_id")).first()
         if not member:
             raise HTTPException(status_code=404, detail="Member not found")
         
@@ -635,9 +616,13 @@ async def delete_member(member_id: str, db: Session = Depends(get_db), api_key:
         # Delete screening sessions
         db.query(ScreeningSession).filter(ScreeningSession.member_id == member.id).delete()
         
+        # Take the member out of the chatbot flags and aggregates
+        remove_member_flags(db, member.id)
+        
         # Delete the member
         db.delete(member)
         db.commit()
+        response_cache.bump_generation()
         
         return {
             "message": f"Member {member_name} deleted successfully",
@@ -661,7 +646,9 @@ async def get_assessment_detail(assessment_id: str, db: Session = Depends(get_db
     
     try:
         # Get screening session
-        screening = db.query(ScreeningSession).filter(ScreeningSession.id == assessment_id).first()
+        screening = db.query(ScreeningSession).filter(
+            ScreeningSession.id == parse_uuid(assessment_id, "assessment_id")
+        ).first()
         if not screening:
             raise HTTPException(status_code=404, detail="Assessment not found")
         
@@ -697,7 +684,7 @@ async def get_assessment_detail(assessment_id: str, db: Session = Depends(get_db
                 "is_safety_question": response.question_code in ["95618-5", "95617-7", "95616-9", "95615-1"]
             })
         
-        return {
+        return FastJSONResponse({
             "assessment": {
                 "id": str(screening.id),
                 "screening_date": screening.screening_date.isoformat() if screening.screening_date else None,
@@ -725,105 +712,119 @@ async def get_assessment_detail(assessment_id: str, db: Session = Depends(get_db
             },
             "responses": responses_by_category,
             "response_count": len(responses)
-        }
+        })
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-@app.get("/members/export/csv")
-async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depends(verify_api_key)):
-    """Export all screening events with member and response data to CSV format (one row per screening)"""
-    if not db:
-        raise HTTPException(status_code=503, detail="Database not available")
+def export_screening_batches(db: Session, limit: int, batch_size: int):
+    """(screening, member, responses) for up to `limit` screenings, a batch at a time
     
-    try:
-        # Get all screening sessions with related member and response data
-        screenings = db.query(ScreeningSession).join(Member).limit(5000).all()  # Limit to prevent huge exports
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header with comprehensive columns
-        writer.writerow([
-            # Member Information
-            'Member ID',
-            'Member Name',
-            'First Name',
-            'Last Name', 
-            'Age',
-            'Date of Birth',
-            'Gender',
-            'Address',
-            'City',
-            'State',
-            'Zip Code',
-            'Phone',
-            'MRN',
-            'Member Created At',
-            
-            # Screening Session Information
-            'Assessment ID',
-            'Assessment Date',
-            'Total Safety Score',
-            'High Risk',
-            'Questions Answered',
-            'Positive Screens Count',
-            'Consent Given',
-            'Screening Complete',
-            'Bundle ID',
-            'FHIR Response ID',
-            
-            # HRSN Category Responses (answer values only)
-            'Food_Insecurity_Answers',
-            'Transportation_Issue_Answers',
-            'Housing_Problem_Answers',
-            'Safety_Concern_Answers',
-            'Other_Response_Answers',
-            
-            # Safety Questions 9-12 (answer values)
-            'Q9_Physical_Hurt_Frequency_Answer',
-            'Q10_Insult_TalkDown_Frequency_Answer', 
-            'Q11_Threaten_Harm_Frequency_Answer',
-            'Q12_Scream_Curse_Frequency_Answer',
-            
-            # Key HRSN Questions (answer values)
-            'Food_Worry_12Months_Answer',
-            'Food_Didnt_Last_12Months_Answer',
-            'Transportation_Barriers_Answer',
-            
-            # Response Summary (pipe-separated lists)
-            'All_Question_Codes_List',
-            'All_Answer_Texts_List',
-            'Positive_Screen_Code_Answer_Pairs'
-        ])
+    Batches are keyset-paged by screening id and joined to their members;
+    each batch's responses come from a single IN query.
+    """
+    last_id = None
+    while limit > 0:
+        query = db.query(ScreeningSession, Member).join(Member, Member.id == ScreeningSession.member_id)
+        if last_id is not None:
+            query = query.filter(ScreeningSession.id > last_id)
+        page_size = min(batch_size, limit)
+        batch = query.order_by(ScreeningSession.id).limit(page_size).all()
+        if not batch:
+            return
+        responses = {screening.id: [] for screening, _ in batch}
+        for response in db.query(ScreeningResponse).filter(
+            ScreeningResponse.screening_session_id.in_(list(responses))
+        ):
+            responses[response.screening_session_id].append(response)
+        yield [(screening, member, responses[screening.id]) for screening, member in batch]
+        if len(batch) < page_size:
+            return
+        last_id = batch[-1][0].id
+        limit -= len(batch)
+
+def export_csv_chunks(db: Session, limit: int = 5000, batch_size: int = 200):
+    """CSV text for the screening export, yielded once per batch of screenings
+    
+    The export streams (and compresses) as it is generated instead of
+    being built in memory first, at two queries per batch.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    
+    # Write header with comprehensive columns
+    writer.writerow([
+        # Member Information
+        'Member ID',
+        'Member Name',
+        'First Name',
+        'Last Name', 
+        'Age',
+        'Date of Birth',
+        'Gender',
+        'Address',
+        'City',
+        'State',
+        'Zip Code',
+        'Phone',
+        'MRN',
+        'Member Created At',
         
-        # Process each screening session
-        for screening in screenings:
-            member = screening.member if hasattr(screening, 'member') else db.query(Member).filter(Member.id == screening.member_id).first()
-            
-            if not member:
-                continue
-                
+        # Screening Session Information
+        'Assessment ID',
+        'Assessment Date',
+        'Total Safety Score',
+        'High Risk',
+        'Questions Answered',
+        'Positive Screens Count',
+        'Consent Given',
+        'Screening Complete',
+        'Bundle ID',
+        'FHIR Response ID',
+        
+        # HRSN Category Responses (answer values only)
+        'Food_Insecurity_Answers',
+        'Transportation_Issue_Answers',
+        'Housing_Problem_Answers',
+        'Safety_Concern_Answers',
+        'Other_Response_Answers',
+        
+        # Safety Questions 9-12 (answer values)
+        'Q9_Physical_Hurt_Frequency_Answer',
+        'Q10_Insult_TalkDown_Frequency_Answer', 
+        'Q11_Threaten_Harm_Frequency_Answer',
+        'Q12_Scream_Curse_Frequency_Answer',
+        
+        # Key HRSN Questions (answer values)
+        'Food_Worry_12Months_Answer',
+        'Food_Didnt_Last_12Months_Answer',
+        'Transportation_Barriers_Answer',
+        
+        # Response Summary (pipe-separated lists)
+        'All_Question_Codes_List',
+        'All_Answer_Texts_List',
+        'Positive_Screen_Code_Answer_Pairs'
+    ])
+    
+    # Process each screening session
+    for batch in export_screening_batches(db, limit, batch_size):
+        for screening, member, responses in batch:
             # Calculate age
             age = None
             if member.date_of_birth:
                 today = date.today()
                 birth_date = member.date_of_birth.date() if hasattr(member.date_of_birth, 'date') else member.date_of_birth
                 age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
-            
-            # Get all responses for this screening
-            responses = db.query(ScreeningResponse).filter(ScreeningResponse.screening_session_id == screening.id).all()
-            
+        
             # Organize responses by category and specific questions
             food_responses = []
             transport_responses = []
             housing_responses = []
             safety_responses = []
             other_responses = []
-            
+        
             # Safety questions (9-12) mapping
             safety_questions = {
                 "95618-5": "",  # Q9 - Physical hurt
@@ -831,29 +832,29 @@ async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depen
                 "95616-9": "",  # Q11 - Threaten harm
                 "95615-1": ""   # Q12 - Scream/curse
             }
-            
+        
             # Key HRSN questions
             hrsn_questions = {
                 "88122-7": "",  # Food worry 12 months
                 "88123-5": "",  # Food didn't last 12 months
                 "93030-5": ""   # Transportation barriers
             }
-            
+        
             all_question_codes = []
             all_answer_texts = []
             positive_screen_questions = []
-            
+        
             for response in responses:
                 question_code = response.question_code
                 answer_text = response.answer_text or ""
                 question_text = response.question_text or ""
-                
+            
                 all_question_codes.append(question_code or "")
                 all_answer_texts.append(answer_text)
-                
+            
                 if response.positive_screen:
                     positive_screen_questions.append(f"{question_code}={answer_text}")
-                
+            
                 # Categorize responses (just store answer text, not full question)
                 if question_code in ["88122-7", "88123-5"]:  # Food questions
                     food_responses.append(answer_text)
@@ -866,11 +867,11 @@ async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depen
                     safety_questions[question_code] = answer_text
                 else:
                     other_responses.append(answer_text)
-                
+            
                 # Capture specific HRSN questions
                 if question_code in hrsn_questions:
                     hrsn_questions[question_code] = answer_text
-            
+        
             # Prepare row data
             row = [
                 # Member Information
@@ -888,7 +889,7 @@ async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depen
                 member.phone or '',
                 member.mrn or '',
                 member.created_at.isoformat() if member.created_at else '',
-                
+            
                 # Screening Session Information
                 str(screening.id),
                 screening.screening_date.isoformat() if screening.screening_date else '',
@@ -900,37 +901,47 @@ async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depen
                 'Yes' if screening.screening_complete else 'No' if screening.screening_complete is not None else '',
                 screening.bundle_id or '',
                 screening.fhir_questionnaire_response_id or '',
-                
+            
                 # HRSN Category Responses
                 ' | '.join(food_responses) if food_responses else '',
                 ' | '.join(transport_responses) if transport_responses else '',
                 ' | '.join(housing_responses) if housing_responses else '',
                 ' | '.join(safety_responses) if safety_responses else '',
                 ' | '.join(other_responses) if other_responses else '',
-                
+            
                 # Safety Questions (9-12)
                 safety_questions["95618-5"],  # Q9
                 safety_questions["95617-7"],  # Q10
                 safety_questions["95616-9"],  # Q11
                 safety_questions["95615-1"],  # Q12
-                
+            
                 # Key HRSN Questions
                 hrsn_questions["88122-7"],  # Food worry
                 hrsn_questions["88123-5"],  # Food didn't last
                 hrsn_questions["93030-5"],  # Transportation
-                
+            
                 # Response Summary
                 ' | '.join(all_question_codes) if all_question_codes else '',
                 ' | '.join(all_answer_texts) if all_answer_texts else '',
                 ' | '.join(positive_screen_questions) if positive_screen_questions else ''
             ]
-            
-            writer.writerow(row)
         
-        # Create response
+            writer.writerow(row)
+        yield output.getvalue()
         output.seek(0)
+        output.truncate()
+    
+    yield output.getvalue()
+
+@app.get("/members/export/csv")
+async def export_members_csv(db: Session = Depends(get_db), api_key: str = Depends(verify_api_key)):
+    """Export all screening events with member and response data to CSV format (one row per screening)"""
+    if not db:
+        raise HTTPException(status_code=503, detail="Database not available")
+    
+    try:
         response = StreamingResponse(
-            io.BytesIO(output.getvalue().encode('utf-8')), 
+            export_csv_chunks(db, limit=5000),  # Limit to prevent huge exports
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename=screening_export_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
         )
@@ -971,271 +982,55 @@ async def debug_env(api_key: str = Depends(verify_api_key)):
         "total_env_vars": len(os.environ)
     }
 
-# Original extraction functions for web interface compatibility
-def extract_bundle_data(bundle: dict) -> dict:
-    """Extract data from FHIR bundle and organize into table format"""
-    members = []
-    screenings = []
-    responses = []
-    organizations = []
-    summary = {}
-    
-    entries = bundle.get("entry", [])
-    
-    # Process each resource in the bundle
-    for entry in entries:
-        resource = entry.get("resource", {})
-        resource_type = resource.get("resourceType")
-        
-        if resource_type == "Patient":
-            members.append(extract_member_data(resource))
-        elif resource_type == "QuestionnaireResponse":
-            screening_data, response_data = extract_questionnaire_response(resource)
-            if screening_data:
-                screenings.append(screening_data)
-            responses.extend(response_data)
-        elif resource_type == "Organization":
-            organizations.append(extract_organization_data(resource))
-    
-    # Calculate summary statistics
-    if screenings:
-        summary = calculate_summary(screenings, responses)
-    
-    return {
-        "members": members,
-        "screenings": screenings,
-        "responses": responses,
-        "organizations": organizations,
-        "summary": summary
-    }
-
-def extract_member_data(member: dict) -> dict:
-    """Extract member information"""
-    name = ""
-    if member.get("name"):
-        name_obj = member["name"][0] if isinstance(member["name"], list) else member["name"]
-        given = " ".join(name_obj.get("given", []))
-        family = name_obj.get("family", "")
-        name = f"{given} {family}".strip()
-    
-    return {
-        "member_id": member.get("id"),
-        "name": name,
-        "gender": member.get("gender"),
-        "birth_date": member.get("birthDate"),
-        "address": extract_address(member.get("address", [])),
-        "phone": extract_phone(member.get("telecom", [])),
-        "created_at": datetime.utcnow().isoformat()
-    }
-
-def extract_address(addresses: list) -> str:
-    """Extract formatted address"""
-    if not addresses:
-        return ""
-    
-    addr = addresses[0]
-    parts = []
-    if addr.get("line"):
-        parts.extend(addr["line"])
-    if addr.get("city"):
-        parts.append(addr["city"])
-    if addr.get("state"):
-        parts.append(addr["state"])
-    if addr.get("postalCode"):
-        parts.append(addr["postalCode"])
-    
-    return ", ".join(parts)
-
-def extract_phone(telecoms: list) -> str:
-    """Extract phone number"""
-    for telecom in telecoms:
-        if telecom.get("system") == "phone":
-            return telecom.get("value", "")
-    return ""
-
-def extract_questionnaire_response(response: dict) -> tuple:
-    """Extract questionnaire response data"""
-    screening_data = {
-        "session_id": response.get("id"),
-        "member_id": response.get("subject", {}).get("reference", "").replace("Patient/", ""),
-        "screening_date": response.get("authored") or datetime.utcnow().isoformat(),
-        "status": response.get("status"),
-        "questionnaire": response.get("questionnaire", ""),
-        "total_safety_score": 0,
-        "questions_answered": 0,
-        "positive_screens": 0
-    }
-    
-    response_data = []
-    safety_score = 0
-    questions_answered = 0
-    positive_screens = 0
-    answered_questions = set()  # Track unique questions answered
-    
-    # Process individual question responses
-    for item in response.get("item", []):
-        question_code = item.get("linkId")
-        question_text = item.get("text", "")
-        
-        # Track that this question was answered (excluding calculated fields like safety score)
-        if question_code and item.get("answer") and question_code != "95614-4":
-            answered_questions.add(question_code)
-        
-        for answer in item.get("answer", []):
-            answer_value = None
-            answer_code = None
-            
-            if "valueCoding" in answer:
-                answer_code = answer["valueCoding"].get("code")
-                answer_value = answer["valueCoding"].get("display", answer_code)
-            elif "valueString" in answer:
-                answer_value = answer["valueString"]
-            elif "valueInteger" in answer:
-                answer_value = str(answer["valueInteger"])
-            elif "valueBoolean" in answer:
-                answer_value = "Yes" if answer["valueBoolean"] else "No"
-            
-            if answer_value:
-                # Check for positive screens (simplified logic)
-                if is_positive_screen(question_code, answer_code, answer_value):
-                    positive_screens += 1
-                
-                # Calculate safety score for questions 9-12
-                score = get_safety_score(question_code, answer_code)
-                if score:
-                    safety_score += score
-                
-                response_data.append({
-                    "session_id": screening_data["session_id"],
-                    "question_code": question_code,
-                    "question_text": question_text,
-                    "answer_code": answer_code,
-                    "answer_value": answer_value,
-                    "safety_score": score or 0,
-                    "is_positive": is_positive_screen(question_code, answer_code, answer_value)
-                })
-    
-    # Use the count of unique questions answered instead of individual answers
-    questions_answered = len(answered_questions)
-    
-    screening_data.update({
-        "total_safety_score": safety_score,
-        "questions_answered": questions_answered,
-        "positive_screens": positive_screens
-    })
-    
-    return screening_data, response_data
-
-def extract_organization_data(org: dict) -> dict:
-    """Extract organization information"""
-    return {
-        "organization_id": org.get("id"),
-        "name": org.get("name"),
-        "type": get_organization_type(org.get("type", [])),
-        "address": extract_address(org.get("address", [])),
-        "phone": extract_phone(org.get("telecom", [])),
-        "active": org.get("active", True)
-    }
-
-def get_organization_type(types: list) -> str:
-    """Extract organization type"""
-    if not types:
-        return ""
-    
-    type_obj = types[0]
-    if "coding" in type_obj:
-        coding = type_obj["coding"][0]
-        return coding.get("display", coding.get("code", ""))
-    
-    return type_obj.get("text", "")
-
-def is_positive_screen(question_code: str, answer_code: str, answer_value: str) -> bool:
-    """Determine if a response indicates a positive screen"""
-    # Simplified logic - in real implementation, this would use the mapping from config
-    positive_patterns = [
-        "worried", "threatened", "shut off", "didn't last", "run out",
-        "lack of", "help finding", "help keeping", "yes"
-    ]
-    
-    if answer_value:
-        answer_lower = answer_value.lower()
-        return any(pattern in answer_lower for pattern in positive_patterns)
-    
-    return False
-
-def get_safety_score(question_code: str, answer_code: str) -> int:
-    """Calculate safety score for questions 9-12"""
-    # Safety questions mapping (simplified)
-    safety_mappings = {
-        "LA6270-8": 1,    # Never
-        "LA10066-1": 2,   # Rarely
-        "LA10082-8": 3,   # Sometimes
-        "LA16644-9": 4,   # Fairly often
-        "LA6482-9": 5     # Frequently
-    }
-    
-    # Check if this is a safety question (9-12) by question code
-    safety_questions = ["95618-5", "95617-7", "95616-9", "95615-1"]
-    
-    if question_code in safety_questions and answer_code in safety_mappings:
-        return safety_mappings[answer_code]
-    
-    return 0
-
-def calculate_summary(screenings: list, responses: list) -> dict:
-    """Calculate summary statistics"""
-    if not screenings:
-        return {}
-    
-    screening = screenings[0]  # Assuming one screening session per bundle
-    
-    return {
-        "total_safety_score": screening.get("total_safety_score", 0),
-        "high_risk": screening.get("total_safety_score", 0) >= 11,
-        "positive_screens": screening.get("positive_screens", 0),
-        "questions_answered": screening.get("questions_answered", 0),
-        "completion_rate": round((screening.get("questions_answered", 0) / 12) * 100, 1)
-    }
-
 # Initialize FHIR processor
 fhir_processor = FHIRBundleProcessor()
 
-@app.post("/api/process-bundle")
-async def process_bundle(bundle: dict, db: Session = Depends(get_db)):
+@app.post("/api/process-bundle", openapi_extra=JSON_BODY_OPENAPI)
+async def process_bundle(request: Request, db: Session = Depends(get_db)):
     """Process a FHIR bundle and extract data into table format (for web interface)"""
     try:
-        logging.info(f"Processing FHIR bundle: {bundle.get('id', 'unknown')}")
+        timer = StageTimer()
+        bundle = await read_json_body(request)
+        timer.lap("parse")
         
         # Validate bundle structure
         if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle":
+            bundles_total.inc("web", "rejected")
             raise HTTPException(status_code=400, detail="Invalid FHIR Bundle structure")
+        logging.info(f"Processing FHIR bundle: {bundle.get('id', 'unknown')}")
         
-        # Extract bundle information
+        # One walk of the bundle feeds both the table view and the database save
+        extraction = extract_bundle(bundle, SCREENER_RULES, timer)
         bundle_info = {
-            "id": bundle.get("id"),
-            "type": bundle.get("type"),
-            "total": len(bundle.get("entry", []))
+            "id": extraction["bundle_id"],
+            "type": extraction["type"],
+            "total": extraction["entry_count"]
         }
         
-        # Process bundle entries using original logic
-        result = extract_bundle_data(bundle)
+        result = table_projection(extraction)
         result["bundle_info"] = bundle_info
         
         # If database is available, also save to database
         if db:
+            timer.skip()  # The table view is not an ingest stage
             try:
-                db_result = fhir_processor.process_bundle(bundle, db)
+                # In the threadpool, so the event loop keeps serving other requests
+                db_result = await run_in_threadpool(fhir_processor.save_extraction, extraction, db, timer)
                 result["database_saved"] = True
                 result["db_result"] = db_result
+                bundles_total.inc("web", "processed")
             except Exception as e:
+                bundles_total.inc("web", "failed")
                 logging.warning(f"Database save failed: {e}")
                 result["database_saved"] = False
                 result["db_error"] = str(e)
+                if isinstance(e, PartialBundleError):
+                    result["db_result"] = e.result
         else:
             result["database_saved"] = False
         
         logging.info(f"Successfully processed bundle {bundle_info['id']}")
-        return result
+        return FastJSONResponse(result)
         
     except HTTPException:
         raise
@@ -1243,8 +1038,30 @@ async def process_bundle(bundle: dict, db: Session = Depends(get_db)):
         logging.error(f"Error processing bundle: {e}")
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
-@app.post("/fhir/Bundle")
-async def receive_fhir_bundle(bundle: dict, db: Session = Depends(get_db), api_key: str = Depends(verify_api_key)):
+@app.post("/api/chatbot")
+async def chatbot_query(query_data: dict, db: Session = Depends(get_db)):
+    """Answer chatbot questions from precomputed condition flags (for web interface)"""
+    if not db:
+        raise HTTPException(status_code=503, detail="Database not available")
+    
+    question = (query_data.get("question") or "").strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+    
+    try:
+        result, cache_status = answer_question(db, question)
+        return {
+            "question": question,
+            "answer": result["answer"],
+            "data": result.get("data", []),
+            "summary": result.get("summary", {})
+        }
+    except Exception as e:
+        logging.error(f"Chatbot error: {e}")
+        raise HTTPException(status_code=500, detail=f"Chatbot error: {str(e)}")
+
+@app.post("/fhir/Bundle", openapi_extra=JSON_BODY_OPENAPI)
+async def receive_fhir_bundle(request: Request, db: Session = Depends(get_db), api_key: str = Depends(verify_api_key)):
     """Receive and process FHIR Bundle containing HRSN screening data (authenticated endpoint)"""
     if not db:
         raise HTTPException(status_code=503, detail="Database not available")
@@ -1253,18 +1070,43 @@ async def receive_fhir_bundle(bundle: dict, db: Session = Depends(get_db), api_k
         # Generate processing ID
         processing_id = str(uuid.uuid4())
         
+        # Raw body straight to dicts - bundles skip body model validation
+        timer = StageTimer()
+        bundle = await read_json_body(request)
+        timer.lap("parse")
+        
         # Basic validation
         if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle":
+            bundles_total.inc("document", "rejected")
             raise HTTPException(status_code=400, detail="Invalid FHIR Bundle structure")
         
+        # batch/transaction: per-entry statuses in a batch-response Bundle
+        if is_batch(bundle):
+            try:
+                status_code, response = await run_in_threadpool(
+                    process_batch, bundle, db, fhir_processor.process_extraction, SCREENER_RULES, timer)
+            except Exception:
+                bundles_total.inc(bundle["type"], "failed")
+                raise
+            bundles_total.inc(bundle["type"], "processed" if status_code == 200 else "failed")
+            if status_code == 200:
+                response_cache.bump_generation()
+            return FastJSONResponse(response, status_code=status_code, media_type="application/fhir+json")
+        
         bundle_id = bundle.get("id")
         if not bundle_id:
+            bundles_total.inc("document", "rejected")
             raise HTTPException(status_code=400, detail="Bundle must have an ID")
         
         logging.info(f"Received FHIR Bundle {bundle_id} for processing {processing_id}")
         
         # Process bundle
-        result = fhir_processor.process_bundle(bundle, db)
+        try:
+            result = await run_in_threadpool(fhir_processor.process_bundle, bundle, db, timer)
+        except Exception:
+            bundles_total.inc("document", "failed")
+            raise
+        bundles_total.inc("document", "processed")
         
         return {
             "bundle_id": bundle_id,
@@ -0,0 +1,15 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.main and simple_main create their tables and log file at import; keep both in a scratch directory
+SCRATCH = tempfile.mkdtemp(prefix="hrsn-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH, 'hrsn_test.db')}")
+
+from app.config import settings  # noqa: E402
+
+settings.LOG_FILE = os.path.join(SCRATCH, "hrsn-server.log")
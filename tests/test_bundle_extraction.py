@@ -0,0 +1,109 @@
+# tests/test_bundle_extraction.py
+import copy
+import json
+import os
+
+import pytest
+
+from app.bundle_extraction import ReferenceIndex, extract_bundle, reference_type_id, table_projection
+from app.screener_rules import builtin_rules
+
+from conftest import ROOT
+
+PATIENT_URN = "urn:uuid:6b1c2a52-1f0e-4b8e-9d0e-3a1f5c2d7e90"
+
+def patient(fhir_id, full_url=None):
+    return {"fullUrl": full_url or f"http://example.org/fhir/Patient/{fhir_id}",
+            "resource": {"resourceType": "Patient", "id": fhir_id}}
+
+def response(response_id, subject):
+    return {"resource": {"resourceType": "QuestionnaireResponse", "id": response_id,
+                         "subject": {"reference": subject}, "item": []}}
+
+@pytest.mark.parametrize("reference,expected", [
+    ("Patient/p1", ("Patient", "p1")),
+    ("http://example.org/fhir/Patient/p1", ("Patient", "p1")),
+    ("Patient/p1/_history/3", ("Patient", "p1")),
+    (PATIENT_URN, None),
+    ("p1", None),
+    (None, None),
+])
+def test_reference_type_id(reference, expected):
+    assert reference_type_id(reference) == expected
+
+def test_index_resolves_full_urls_and_relative_references():
+    index = ReferenceIndex()
+    index.add(PATIENT_URN, "Patient", "p1", 0)
+    index.add("http://example.org/fhir/Patient/p2", "Patient", "p2", 1)
+    index.add(None, "Organization", "o1", 0)
+
+    assert index.resolve(PATIENT_URN) == ("Patient", 0)
+    assert index.resolve("Patient/p1") == ("Patient", 0)
+    assert index.resolve("http://example.org/fhir/Patient/p2") == ("Patient", 1)
+    assert index.resolve("Patient/p2/_history/1") == ("Patient", 1)
+    assert index.resolve("https://other.example.org/Patient/p2") == ("Patient", 1)
+    assert index.resolve("Organization/o1") == ("Organization", 0)
+
+    assert index.resolve("urn:uuid:00000000-0000-4000-8000-000000000000") is None
+    assert index.resolve("Patient/outside") is None
+    assert index.resolve("Organization/p1") is None
+    assert index.resolve(None) is None
+
+def test_subjects_resolve_whatever_the_entry_order():
+    bundle = {"id": "b1", "type": "collection", "entry": [
+        # Responses ahead of the patients they point at
+        response("r-urn", PATIENT_URN),
+        response("r-relative", "Patient/p2"),
+        patient("p1", PATIENT_URN),
+        patient("p2"),
+        response("r-outside", "Patient/outside"),
+        response("r-unknown-urn", "urn:uuid:00000000-0000-4000-8000-000000000000"),
+        response("r-organization", "Organization/p1"),
+    ]}
+
+    screenings = {screening["session_id"]: screening for screening in extract_bundle(bundle)["screenings"]}
+
+    assert (screenings["r-urn"]["subject_patient"], screenings["r-urn"]["member_fhir_id"]) == (0, "p1")
+    assert (screenings["r-relative"]["subject_patient"], screenings["r-relative"]["member_fhir_id"]) == (1, "p2")
+    # Outside the bundle: a Patient/id is kept for the database lookup
+    assert (screenings["r-outside"]["subject_patient"], screenings["r-outside"]["member_fhir_id"]) == (None, "outside")
+    for unresolved in ("r-unknown-urn", "r-organization"):
+        assert (screenings[unresolved]["subject_patient"], screenings[unresolved]["member_fhir_id"]) == (None, None)
+
+SAMPLE_BUNDLES = ["hrsn_bundle_1.json", "hrsn_bundle_1_complete.json", "hrsn_bundle_2.json",
+                  "hrsn_bundle_2_complete.json", "hrsn_bundle_3_complete.json"]
+
+# web_main's per-resource extract_bundle_data() output for the sample bundles,
+# recorded before the single-pass extraction replaced it (member created_at omitted)
+with open(os.path.join(os.path.dirname(__file__), "data", "table_projection_baseline.json")) as f:
+    BASELINE = json.load(f)
+
+NY, _ = builtin_rules()
+
+def expected_tables(name):
+    """The baseline, with coded answers marked positive by the screener rules' decision
+
+    The old table guessed is_positive from the answer text for every answer;
+    answers the ruleset covers now take its decision instead.
+    """
+    expected = copy.deepcopy(BASELINE[name])
+    for response in expected["responses"]:
+        if response["question_code"] in NY.questions and response["answer_code"]:
+            response["is_positive"] = NY.decide(response["question_code"], response["answer_code"])[1]
+    for screening in expected["screenings"]:
+        screening["positive_screens"] = sum(response["is_positive"] for response in expected["responses"]
+                                            if response["session_id"] == screening["session_id"])
+    expected["summary"]["positive_screens"] = expected["screenings"][0]["positive_screens"]
+    return expected
+
+@pytest.mark.parametrize("name", SAMPLE_BUNDLES)
+def test_table_projection_matches_the_old_extraction(name):
+    with open(os.path.join(ROOT, name)) as f:
+        tables = table_projection(extract_bundle(json.load(f)))
+
+    for member in tables["members"]:
+        assert member.pop("created_at")
+    for screening in tables["screenings"]:
+        # Added with the versioned screener rules, after the baseline was recorded
+        assert screening.pop("screener") == NY.key
+    assert tables == expected_tables(name)
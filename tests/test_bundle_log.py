@@ -0,0 +1,114 @@
+# tests/test_bundle_log.py
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from app.bundle_log import TIMING_COLUMNS, add_timing_columns, record_processing, slow_bundles
+from app.metrics import StageTimer
+from app.models import BundleProcessingLog
+
+# bundle_processing_logs as it was before the timing columns
+OLD_TABLE = """
+CREATE TABLE bundle_processing_logs (
+    id CHAR(32) PRIMARY KEY, bundle_id VARCHAR(64) NOT NULL, processing_id VARCHAR(64) NOT NULL UNIQUE,
+    status VARCHAR(20), error_message TEXT, resources_processed INTEGER, members_created INTEGER,
+    screenings_created INTEGER, started_at DATETIME, completed_at DATETIME, created_at DATETIME
+)
+"""
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bundle_log.db'}")
+    BundleProcessingLog.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+def timer_with(**seconds):
+    timer = StageTimer()
+    timer.durations.update(seconds)
+    return timer
+
+def log(db, bundle_id, **seconds):
+    record_processing(db, {"id": bundle_id, "entry": [{}, {}]}, f"processing-{bundle_id}", timer_with(**seconds),
+                      datetime.utcnow(), {"members_processed": 1, "screenings_processed": 1})
+
+def test_old_table_gets_the_timing_columns_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(OLD_TABLE))
+
+    add_timing_columns(engine)
+    add_timing_columns(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("bundle_processing_logs")}
+    assert set(TIMING_COLUMNS) <= columns
+    assert "ix_bundle_processing_logs_duration_ms" in {index["name"] for index in
+                                                        inspect(engine).get_indexes("bundle_processing_logs")}
+    with Session(engine) as db:
+        log(db, "upgraded", parse=0.5)
+        assert db.query(BundleProcessingLog).one().parse_ms == 500.0
+    engine.dispose()
+
+def test_record_processing_saves_stage_columns(engine):
+    with Session(engine) as db:
+        timer = timer_with(parse=0.001, match=0.25, write=0.0125)
+        timer._statements.extend([None] * 7)
+        record_processing(db, {"id": "b1", "entry": [{}, {}, {}]}, "p1", timer, datetime.utcnow(),
+                          error=ValueError("bad answer code"))
+
+        row = db.query(BundleProcessingLog).one()
+        assert (row.parse_ms, row.match_ms, row.write_ms) == (1.0, 250.0, 12.5)
+        assert row.validate_ms == row.resolve_ms == row.commit_ms == 0.0
+        assert row.duration_ms == 263.5
+        assert row.query_count == 7
+        assert row.status == "failed"
+        assert row.error_message == "bad answer code"
+        assert row.resources_processed == 3
+
+def test_slow_bundles_ranks_by_stage_or_total(engine):
+    with Session(engine) as db:
+        log(db, "slow-match", match=0.4, write=0.05)
+        log(db, "slow-write", match=0.1, write=0.3)
+        log(db, "fast", parse=0.01)
+        old = db.query(BundleProcessingLog).filter(BundleProcessingLog.bundle_id == "fast").one()
+        old.started_at = datetime.utcnow() - timedelta(hours=48)
+        log(db, "quick", parse=0.02)
+        db.commit()
+
+        total = slow_bundles(db)
+        assert [bundle["bundle_id"] for bundle in total["bundles"]] == ["slow-match", "slow-write", "quick"]
+        assert total["bundles"][0]["slowest_stage"] == "match"
+        assert total["bundles"][0]["stages_ms"]["write"] == 50.0
+
+        write = slow_bundles(db, "write", limit=1)
+        assert [bundle["bundle_id"] for bundle in write["bundles"]] == ["slow-write"]
+
+        assert "fast" in [bundle["bundle_id"] for bundle in slow_bundles(db, hours=72)["bundles"]]
+
+def test_slow_bundles_endpoint(engine):
+    from fastapi.testclient import TestClient
+    from app.database import get_db
+    from app.main import app
+
+    with Session(engine) as db:
+        log(db, "slow-match", match=0.4)
+        log(db, "slow-commit", commit=0.2)
+
+    def test_db():
+        with Session(engine) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = test_db
+    try:
+        client = TestClient(app)
+        headers = {"Authorization": "Bearer MookieWilson"}
+        response = client.get("/admin/slow-bundles?stage=commit", headers=headers)
+        assert response.status_code == 200
+        assert [bundle["bundle_id"] for bundle in response.json()["bundles"]] == ["slow-commit", "slow-match"]
+        assert response.json()["bundles"][0]["slowest_stage"] == "commit"
+
+        assert client.get("/admin/slow-bundles?stage=queue", headers=headers).status_code == 400
+    finally:
+        app.dependency_overrides.pop(get_db)
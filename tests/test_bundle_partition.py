@@ -0,0 +1,113 @@
+# tests/test_bundle_partition.py
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.bundle_partition import PartialBundleError, partition_extraction, plan_chunks, process_partitioned
+from app.fhir_processor_simple import FHIRBundleProcessor
+from app.models import ChatbotAggregate
+
+from conftest import ROOT
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'partition.db'}")
+    ChatbotAggregate.__table__.create(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+def extraction(*zips):
+    return {
+        "bundle_id": "bundle-1",
+        "type": "collection",
+        "entry_count": 2 * len(zips),
+        "patients": [{"fhir_id": f"p{i}", "zip_code": zip_code} for i, zip_code in enumerate(zips)],
+        "screenings": [{"session_id": f"s{i}", "subject_patient": i, "member_fhir_id": f"p{i}"}
+                       for i in range(len(zips))],
+        "organizations": []
+    }
+
+class FakeProcess:
+    """process_extraction stand-in that fails the chunk holding `fail_patient` `failures` times"""
+
+    def __init__(self, fail_patient=None, error=None, failures=1):
+        self.fail_patient = fail_patient
+        self.error = error
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, chunk, db):
+        ids = [patient["fhir_id"] for patient in chunk["patients"]]
+        with self.lock:
+            self.calls.append(ids)
+            fail = self.fail_patient in ids and self.failures > 0
+            if fail:
+                self.failures -= 1
+        if fail:
+            raise self.error
+        return {"members_processed": len(chunk["patients"]), "screenings_processed": len(chunk["screenings"]),
+                "organizations_processed": 0}
+
+def test_patients_sharing_a_zip_share_a_chunk():
+    bundle = extraction("10001", "12008", "10001", "14201")
+    chunks = plan_chunks(bundle, partition_extraction(bundle), 2)
+
+    assert len(chunks) == 2
+    by_patient = {patient["fhir_id"]: index for index, chunk in enumerate(chunks) for patient in chunk["patients"]}
+    assert by_patient["p0"] == by_patient["p2"]
+    for chunk in chunks:
+        # Subjects point at the patient's slot within its own chunk
+        for screening in chunk["screenings"]:
+            assert chunk["patients"][screening["subject_patient"]]["fhir_id"] == screening["member_fhir_id"]
+
+def test_a_chunk_that_lost_a_race_is_replayed(session_factory):
+    process = FakeProcess("p1", OperationalError("UPDATE chatbot_aggregates", {}, Exception("deadlock detected")))
+
+    result = process_partitioned(process, extraction("10001", "12008", "14201"), session_factory, workers=3)
+
+    assert result["status"] == "completed"
+    assert result["members_processed"] == 3
+    assert sum(1 for ids in process.calls if "p1" in ids) == 2
+
+def test_a_data_error_is_not_replayed_and_fails_the_bundle(session_factory):
+    process = FakeProcess("p1", ValueError("bad answer code"))
+
+    with pytest.raises(PartialBundleError) as raised:
+        process_partitioned(process, extraction("10001", "12008", "14201"), session_factory, workers=3)
+
+    assert sum(1 for ids in process.calls if "p1" in ids) == 1
+    assert raised.value.result["status"] == "partial"
+    assert raised.value.result["members_processed"] == 2
+    assert raised.value.result["errors"] == ["bad answer code"]
+
+def test_nothing_saved_raises_the_error_itself(session_factory):
+    process = FakeProcess("p0", ValueError("bad answer code"))
+
+    with pytest.raises(ValueError):
+        process_partitioned(process, extraction("10001"), session_factory, workers=2)
+
+def test_unpartitioned_bundles_are_saved_off_the_event_loop(monkeypatch):
+    with open(os.path.join(ROOT, "hrsn_bundle_1.json")) as f:
+        bundle = json.load(f)
+    processor = FHIRBundleProcessor()
+    threads = []
+
+    def process_extraction(extraction, db, timer=None):
+        threads.append(threading.get_ident())
+        return {"bundle_id": extraction["bundle_id"], "status": "completed"}
+    monkeypatch.setattr(processor, "process_extraction", process_extraction)
+
+    async def run():
+        result = await processor.process_bundle(bundle, db=None)
+        return threading.get_ident(), result
+
+    loop_thread, result = asyncio.run(run())
+    assert result["bundle_id"] == bundle["id"]
+    assert threads and threads[0] != loop_thread
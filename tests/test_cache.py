@@ -0,0 +1,66 @@
+# tests/test_cache.py
+from starlette.requests import Request
+
+from app.cache import LRUCacheBackend, ResponseCache
+
+def make_request(if_none_match: str = "") -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/analytics", "query_string": b"days=30",
+                    "headers": headers})
+
+def test_hit_then_conditional_304():
+    cache = ResponseCache(LRUCacheBackend())
+    calls = []
+    compute = lambda: calls.append(1) or {"total": 3}
+
+    first = cache.respond(make_request(), "/analytics", compute)
+    assert first.headers["X-Cache"] == "miss"
+    second = cache.respond(make_request(), "/analytics", compute)
+    assert second.headers["X-Cache"] == "hit"
+    assert second.body == first.body
+    assert cache.respond(make_request(first.headers["ETag"]), "/analytics", compute).status_code == 304
+    assert len(calls) == 1
+
+def test_bump_invalidates_cached_body_and_etag():
+    cache = ResponseCache(LRUCacheBackend())
+    etag = cache.respond(make_request(), "/analytics", lambda: {"total": 3}).headers["ETag"]
+    cache.bump_generation()
+
+    response = cache.respond(make_request(etag), "/analytics", lambda: {"total": 4})
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "miss"
+    assert response.headers["ETag"] != etag
+
+def test_fresh_process_never_honours_an_old_etag():
+    # A restart or another worker builds a new backend; an ETag from the
+    # old one must not earn a 304 even though neither has bumped
+    old = ResponseCache(LRUCacheBackend())
+    etag = old.respond(make_request(), "/analytics", lambda: {"total": 3}).headers["ETag"]
+
+    restarted = ResponseCache(LRUCacheBackend())
+    assert restarted.respond(make_request(etag), "/analytics", lambda: {"total": 4}).status_code == 200
+
+def test_lru_evicts_oldest_entry():
+    backend = LRUCacheBackend(max_entries=2)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+
+def test_backfills_bump_the_generation(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app import cache, geo, sketches, trajectories, chatbot_db
+    from app.models import Base
+
+    bumps = []
+    monkeypatch.setattr(cache.response_cache, "bump_generation", lambda: bumps.append(1))
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for rebuild in (geo.rebuild_geo_rollups, sketches.rebuild_sketches,
+                        trajectories.rebuild_trajectories, chatbot_db.rebuild_condition_flags):
+            rebuild(db)
+    assert len(bumps) == 4
@@ -0,0 +1,142 @@
+# tests/test_chatbot_db.py
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import chatbot_db
+from app.chatbot_db import compute_intent, get_aggregates, record_screening_flags, remove_member_flags
+from app.models import Base, ChatbotAggregate, Member, MemberConditionFlags
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    for table in (MemberConditionFlags.__table__, ChatbotAggregate.__table__):
+        table.create(engine)
+    with Session(engine) as session:
+        yield session
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chatbot.db'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+def db_screening(date, score):
+    return SimpleNamespace(id=uuid.uuid4(), screening_date=date, total_safety_score=score)
+
+def aggregate(factory, name):
+    with factory() as db:
+        row = db.query(ChatbotAggregate).filter(ChatbotAggregate.name == name).first()
+        return row.value if row else None
+
+def test_condition_flags_follow_the_latest_screening_by_date(db):
+    member_id = uuid.uuid4()
+    latest = db_screening(datetime(2024, 6, 1), 14)
+    for screening in (latest, db_screening(datetime(2024, 1, 1), 3), db_screening(None, 2)):
+        record_screening_flags(db, member_id, screening, set())
+    db.commit()
+
+    flags = db.query(MemberConditionFlags).one()
+    assert flags.latest_screening_id == latest.id
+    assert flags.safety
+    assert flags.screening_count == 3
+
+def test_counters_move_only_when_a_flag_changes(db):
+    member_id = uuid.uuid4()
+    record_screening_flags(db, member_id, db_screening(datetime(2024, 1, 1), 12), {"food-insecurity"})
+    record_screening_flags(db, member_id, db_screening(datetime(2024, 3, 1), 4),
+                           {"food-insecurity", "homelessness"})
+    record_screening_flags(db, uuid.uuid4(), db_screening(datetime(2024, 2, 1), 2), set())
+    db.commit()
+
+    counts = get_aggregates(db)
+    assert (counts["screened_members"], counts["screenings"]) == (2, 3)
+    assert (counts["food"], counts["housing"], counts["safety"]) == (1, 1, 0)
+
+    remove_member_flags(db, member_id)
+    db.commit()
+    counts = get_aggregates(db)
+    assert (counts["screened_members"], counts["screenings"], counts["food"], counts["housing"]) == (1, 1, 0, 0)
+
+def test_counters_are_applied_at_commit_in_one_statement(session_factory):
+    assert not event.contains(Session, "before_commit", chatbot_db._apply_aggregate_deltas)
+    statements = []
+    with session_factory() as db:
+        event.listen(db.get_bind(), "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        chatbot_db._adjust(db, "members", 2)
+        chatbot_db._adjust(db, "screenings", 1)
+        chatbot_db._adjust(db, "members", 1)
+        assert db.info[chatbot_db.PENDING_AGGREGATES] == {"members": 3, "screenings": 1}
+        assert statements == []
+        db.commit()
+        assert db.info[chatbot_db.PENDING_AGGREGATES] == {}
+
+        chatbot_db._adjust(db, "members", 1)
+        db.commit()
+
+    assert len([statement for statement in statements if "chatbot_aggregates" in statement]) == 2
+    assert (aggregate(session_factory, "members"), aggregate(session_factory, "screenings")) == (4, 1)
+
+def test_concurrent_first_inserts_of_a_counter_both_count(session_factory):
+    first, second = session_factory(), session_factory()
+    try:
+        chatbot_db._adjust(first, "members", 1)
+        chatbot_db._adjust(second, "members", 2)
+        second.commit()
+        first.commit()
+    finally:
+        first.close()
+        second.close()
+    assert aggregate(session_factory, "members") == 3
+
+def test_counters_follow_savepoints_and_rollbacks(session_factory):
+    with session_factory() as db:
+        chatbot_db._adjust(db, "members", 1)
+        savepoint = db.begin_nested()
+        chatbot_db._adjust(db, "members", 5)
+        savepoint.rollback()
+        db.commit()
+    assert aggregate(session_factory, "members") == 1
+
+    with session_factory() as db:
+        chatbot_db._adjust(db, "members", 5)
+        db.rollback()
+        db.commit()
+    assert aggregate(session_factory, "members") == 1
+
+    with session_factory() as db:
+        # A savepoint opened before the first change
+        with db.begin_nested():
+            chatbot_db._adjust(db, "members", 2)
+            db.begin_nested().rollback()
+        db.commit()
+    assert aggregate(session_factory, "members") == 3
+
+def test_condition_answers_rank_members_by_safety_score(session_factory):
+    with session_factory() as db:
+        for name, score, zip_code, categories in (("Ana", 9, "10001", {"food-insecurity"}),
+                                                  ("Ben", 15, "12008", {"food-insecurity"}),
+                                                  ("Cy", 3, "10002", set())):
+            member = Member(fhir_id=name.lower(), first_name=name, last_name="Lee", zip_code=zip_code)
+            db.add(member)
+            db.flush()
+            record_screening_flags(db, member.id, db_screening(datetime(2024, 5, 1), score), categories)
+        db.commit()
+
+        food = compute_intent(db, "food")
+        assert (food["summary"]["affected_count"], food["summary"]["total_members"]) == (2, 3)
+        assert [member["member_id"] for member in food["data"]] == ["ben", "ana"]
+
+        safety = compute_intent(db, "safety")
+        assert [member["member_id"] for member in safety["data"]] == ["ben"]
+        assert safety["data"][0]["safety_score"] == 15
+
+        narrowed = compute_intent(db, "food", {"zip_code": "100"})
+        assert [member["member_id"] for member in narrowed["data"]] == ["ana"]
+        assert narrowed["summary"]["filters"] == {"zip_code": "100"}
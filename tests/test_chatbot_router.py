@@ -0,0 +1,67 @@
+# tests/test_chatbot_router.py
+import json
+import os
+from datetime import date
+
+import pytest
+
+from app.chatbot_router import describe_slots, router
+
+from conftest import ROOT
+
+TODAY = date(2025, 1, 15)
+
+with open(os.path.join(ROOT, "benchmarks", "chatbot_questions.json")) as f:
+    CORPUS = json.load(f)
+
+@pytest.mark.parametrize("entry", CORPUS["questions"], ids=lambda entry: entry["question"])
+def test_corpus_phrasings(entry):
+    routed = router.route(entry["question"], today=date.fromisoformat(CORPUS["today"]))
+    assert (routed["intent"], routed["slots"]) == (entry["intent"], entry["slots"])
+
+@pytest.mark.parametrize("question,slots", [
+    ("members with score between 5 and 10", {"min_score": 5, "max_score": 10}),
+    ("members with score between 10 and 5", {"min_score": 5, "max_score": 10}),
+    ("screened between 2024-02-01 and 2024-02-15", {"date_from": "2024-02-01", "date_to": "2024-02-15"}),
+    ("screened between 2023 and 2024", {"date_from": "2023-01-01", "date_to": "2024-12-31"}),
+    ("screened between january and march 2024", {"date_from": "2024-01-01", "date_to": "2024-03-31"}),
+    # No year: the range ends at the latest such month and starts before it
+    ("screened between november and february", {"date_from": "2023-11-01", "date_to": "2024-02-29"}),
+    ("screened from jan to mar", {"date_from": "2024-01-01", "date_to": "2024-03-31"}),
+])
+def test_between_ranges(question, slots):
+    assert router.route(question, today=TODAY)["slots"] == slots
+
+@pytest.mark.parametrize("question,slots", [
+    ("members over 65", {}),
+    ("members under 18 in 10001", {"zip_code": "10001"}),
+    ("members over 65 with score above 8", {"min_score": 9}),
+    ("members with a score over 8", {"min_score": 9}),
+])
+def test_comparisons_need_a_score_word(question, slots):
+    assert router.route(question, today=TODAY)["slots"] == slots
+
+@pytest.mark.parametrize("question,slots", [
+    ("screened in march 2024", {"date_from": "2024-03-01", "date_to": "2024-03-31"}),
+    ("screened in february 2024", {"date_from": "2024-02-01", "date_to": "2024-02-29"}),
+    ("screened since mar 2024", {"date_from": "2024-03-01"}),
+    ("screened through sept 2024", {"date_to": "2024-09-30"}),
+    # No year: the latest such month up to today (2025-01-15)
+    ("screened in january", {"date_from": "2025-01-01", "date_to": "2025-01-31"}),
+    ("screened in march", {"date_from": "2024-03-01", "date_to": "2024-03-31"}),
+    # "may" without a date cue or year is just a word
+    ("which members may need food", {}),
+])
+def test_month_names(question, slots):
+    assert router.route(question, today=TODAY)["slots"] == slots
+
+@pytest.mark.parametrize("question,slots", [
+    ("score below 0", {"max_score": 0}),
+    ("score under 1", {"max_score": 0}),
+    ("score below 5", {"max_score": 4}),
+])
+def test_score_bounds_are_never_negative(question, slots):
+    assert router.route(question, today=TODAY)["slots"] == slots
+
+def test_describe_range():
+    assert describe_slots({"min_score": 5, "max_score": 10}) == " with safety score 5-10"
@@ -0,0 +1,90 @@
+# tests/test_compression.py
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from fastapi import HTTPException
+
+from app import compression
+from app.compression import read_request_body
+
+LIMIT = 1024 * 1024
+
+class FakeRequest:
+    """Just what read_request_body uses: headers and a chunked body stream"""
+
+    def __init__(self, body: bytes, encoding: str, chunk_size: int = 64 * 1024):
+        self.headers = {"content-encoding": encoding}
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def body(self):
+        return b"".join(self.chunks)
+
+def read(body: bytes, encoding: str, **kwargs) -> bytes:
+    return asyncio.run(read_request_body(FakeRequest(body, encoding, **kwargs), LIMIT))
+
+def deflate(data: bytes) -> bytes:
+    return zlib.compress(data)
+
+def zstd(data: bytes) -> bytes:
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+@pytest.mark.parametrize("encoding,encode", [("gzip", gzip.compress), ("deflate", deflate), ("zstd", zstd)])
+def test_round_trip(encoding, encode):
+    payload = b'{"resourceType": "Bundle"}' * 1000
+    assert read(encode(payload), encoding, chunk_size=100) == payload
+
+@pytest.mark.parametrize("encoding,encode", [("gzip", gzip.compress), ("deflate", deflate), ("zstd", zstd)])
+def test_bomb_is_rejected_without_inflating_it(encoding, encode, monkeypatch):
+    bomb = encode(b"\0" * (200 * LIMIT))
+    assert len(bomb) < LIMIT
+    inflated = []
+    for name in ("_ZlibInflater", "_ZstdInflater"):
+        inflater = getattr(compression, name)
+        feed = inflater.feed
+
+        def counting_feed(self, chunk, limit, feed=feed):
+            output = feed(self, chunk, limit)
+            inflated.append(len(output))
+            return output
+        monkeypatch.setattr(inflater, "feed", counting_feed)
+
+    with pytest.raises(HTTPException) as excinfo:
+        read(bomb, encoding)
+    assert excinfo.value.status_code == 413
+    # Decoding stopped at the limit, give or take one decoder block
+    assert sum(inflated) <= LIMIT + 256 * 1024
+
+def test_multi_member_gzip_is_decoded_whole():
+    body = gzip.compress(b'{"a": 1, ') + gzip.compress(b'"b": 2}')
+    assert read(body, "gzip", chunk_size=7) == b'{"a": 1, "b": 2}'
+
+def test_multi_member_gzip_counts_against_the_limit():
+    member = gzip.compress(b"x" * (LIMIT // 2 + 1))
+    with pytest.raises(HTTPException) as excinfo:
+        read(member + member, "gzip")
+    assert excinfo.value.status_code == 413
+
+def test_multi_frame_zstd_is_decoded_whole():
+    assert read(zstd(b"first ") + zstd(b"second"), "zstd", chunk_size=5) == b"first second"
+
+def test_trailing_garbage_after_deflate_is_malformed():
+    with pytest.raises(HTTPException) as excinfo:
+        read(deflate(b"{}") + b"junk", "deflate")
+    assert excinfo.value.status_code == 400
+
+def test_truncated_gzip_is_malformed():
+    with pytest.raises(HTTPException) as excinfo:
+        read(gzip.compress(b"{}" * 100)[:-6], "gzip")
+    assert excinfo.value.status_code == 400
+
+def test_unknown_encoding_is_unsupported():
+    with pytest.raises(HTTPException) as excinfo:
+        read(b"{}", "br")
+    assert excinfo.value.status_code == 415
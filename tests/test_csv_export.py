@@ -0,0 +1,71 @@
+# tests/test_csv_export.py
+import csv
+import io
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from simple_main import Base, Member, ScreeningResponse, ScreeningSession, export_csv_chunks
+
+def ordered_id(n):
+    # A leading hex letter keeps SQLite's NUMERIC affinity from turning the id into a number
+    return uuid.UUID(int=(0xA << 124) + n)
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for n in range(5):
+            member = Member(id=ordered_id(n + 1), fhir_id=f"patient-{n}", first_name=f"First{n}",
+                            last_name="Member", zip_code="10001")
+            screening = ScreeningSession(id=ordered_id(100 + n), member_id=member.id, bundle_id=f"bundle-{n}",
+                                         screening_date=datetime(2025, 1, n + 1), total_safety_score=n * 3)
+            db.add_all([member, screening])
+            db.add_all([
+                ScreeningResponse(screening_session_id=screening.id, question_code="88122-7",
+                                  answer_text=f"food-{n}", positive_screen=n % 2 == 0),
+                ScreeningResponse(screening_session_id=screening.id, question_code="95618-5",
+                                  answer_text=f"hurt-{n}")
+            ])
+        db.commit()
+    yield engine
+    engine.dispose()
+
+def count_selects(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+def rows(chunks):
+    return list(csv.reader(io.StringIO("".join(chunks))))
+
+def test_export_pages_by_screening_id_with_one_response_query_per_batch(engine):
+    statements = count_selects(engine)
+    with Session(engine) as db:
+        chunks = list(export_csv_chunks(db, batch_size=2))
+
+    header, *body = rows(chunks)
+    assert [row[header.index("Assessment ID")] for row in body] == [str(ordered_id(100 + n)) for n in range(5)]
+    first = dict(zip(header, body[0]))
+    assert first["Member Name"] == "First0 Member"
+    assert first["Food_Insecurity_Answers"] == "food-0"
+    assert first["Q9_Physical_Hurt_Frequency_Answer"] == "hurt-0"
+    assert first["Positive_Screen_Code_Answer_Pairs"] == "88122-7=food-0"
+    assert dict(zip(header, body[4]))["High Risk"] == "Yes"
+
+    # Three batches of screenings joined to members, each with one IN query for responses
+    assert len(statements) == 6
+    assert sum("screening_responses" in statement and " IN " in statement for statement in statements) == 3
+    assert len(chunks) == 4
+
+def test_export_stops_at_the_limit(engine):
+    with Session(engine) as db:
+        header, *body = rows(export_csv_chunks(db, limit=3, batch_size=2))
+    assert [row[header.index("Bundle ID")] for row in body] == ["bundle-0", "bundle-1", "bundle-2"]
@@ -0,0 +1,132 @@
+# tests/test_fhir_batch.py
+import copy
+import json
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.fhir_batch import is_batch, process_batch, processed_counts
+from app.metrics import StageTimer
+
+from conftest import ROOT
+
+COUNTERS = {"Patient": "members_processed", "Organization": "organizations_processed",
+            "QuestionnaireResponse": "screenings_processed"}
+
+def load_sample(name="hrsn_bundle_1_complete.json"):
+    with open(os.path.join(ROOT, name)) as f:
+        return json.load(f)
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE saved (resource_type TEXT)"))
+    with Session(engine) as session:
+        yield session
+
+def make_process(fail_on=None):
+    """A process_extraction stand-in: one row per resource, raising for `fail_on`"""
+    def process(extraction, db, commit=True, timer=None):
+        result = {counter: 0 for counter in COUNTERS.values()}
+        for list_name, resource_type in (("patients", "Patient"), ("organizations", "Organization"),
+                                         ("screenings", "QuestionnaireResponse")):
+            for _ in extraction[list_name]:
+                db.execute(text("INSERT INTO saved VALUES (:t)"), {"t": resource_type})
+                if resource_type == fail_on:
+                    raise ValueError(f"{resource_type} rejected")
+                result[COUNTERS[resource_type]] += 1
+        if timer is not None:
+            timer.lap("write")
+        return result
+    return process
+
+def saved(db):
+    return [row[0] for row in db.execute(text("SELECT resource_type FROM saved ORDER BY rowid"))]
+
+@pytest.mark.parametrize("bundle_type", ["document", "collection", None])
+def test_non_batch_types_keep_the_document_path_whatever_entries_carry(bundle_type):
+    bundle = load_sample()
+    bundle["type"] = bundle_type
+    assert all("request" in entry for entry in bundle["entry"])
+    assert not is_batch(bundle)
+
+@pytest.mark.parametrize("bundle_type", ["batch", "transaction"])
+def test_batch_types_with_entry_requests_get_batch_semantics(bundle_type):
+    bundle = load_sample()
+    bundle["type"] = bundle_type
+    assert is_batch(bundle)
+
+@pytest.mark.parametrize("name, batch", [("hrsn_bundle_1.json", False), ("hrsn_bundle_2.json", False),
+                                         ("hrsn_bundle_1_complete.json", True),
+                                         ("hrsn_bundle_2_complete.json", True),
+                                         ("hrsn_bundle_3_complete.json", True)])
+def test_legacy_transactions_without_requests_keep_the_queued_path(name, batch):
+    bundle = load_sample(name)
+    assert bundle["type"] == "transaction"
+    assert is_batch(bundle) == batch
+
+def test_posted_legacy_transaction_is_queued():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    bundle = load_sample("hrsn_bundle_1.json")
+    assert not any("request" in entry for entry in bundle["entry"])
+    response = TestClient(app).post("/fhir/Bundle", json=bundle, headers={"Authorization": "Bearer MookieWilson"})
+
+    assert response.status_code == 200
+    assert response.json()["bundle_id"] == bundle["id"]
+    assert response.json()["status"] == "accepted"
+    assert response.json()["processing_id"]
+
+def test_batch_saves_every_entry_and_times_the_stages(db):
+    bundle = load_sample()
+    bundle["type"] = "batch"
+    timer = StageTimer()
+    status, response = process_batch(bundle, db, make_process(), timer=timer)
+
+    assert status == 200
+    assert response["type"] == "batch-response"
+    assert len(response["entry"]) == len(bundle["entry"])
+    assert all(entry["response"]["status"].startswith("2") for entry in response["entry"])
+    assert sorted(saved(db)) == ["Organization", "Patient", "QuestionnaireResponse"]
+    assert processed_counts(response) == {"members_processed": 1, "organizations_processed": 1,
+                                          "screenings_processed": 1}
+    assert {"validate", "resolve", "write", "commit"} <= set(timer.durations)
+
+def test_batch_rolls_back_only_the_failed_entry(db):
+    bundle = load_sample()
+    bundle["type"] = "batch"
+    status, response = process_batch(bundle, db, make_process(fail_on="Organization"))
+
+    assert status == 200
+    statuses = {entry["resource"]["resourceType"]: response["entry"][index]["response"]["status"]
+                for index, entry in enumerate(bundle["entry"])}
+    assert statuses["Organization"] == "400 Bad Request"
+    assert statuses["Patient"].startswith("2")
+    assert sorted(saved(db)) == ["Patient", "QuestionnaireResponse"]
+
+def test_transaction_is_all_or_nothing(db):
+    bundle = load_sample()
+    bundle["type"] = "transaction"
+    status, outcome = process_batch(bundle, db, make_process(fail_on="QuestionnaireResponse"))
+
+    assert status == 400
+    assert outcome["resourceType"] == "OperationOutcome"
+    assert "QuestionnaireResponse" in outcome["issue"][0]["diagnostics"]
+    assert saved(db) == []
+
+def test_entry_without_request_is_rejected(db):
+    bundle = load_sample()
+    bundle["type"] = "batch"
+    bundle["entry"] = copy.deepcopy(bundle["entry"])
+    patient = next(entry for entry in bundle["entry"] if entry["resource"]["resourceType"] == "Patient")
+    del patient["request"]
+    status, response = process_batch(bundle, db, make_process())
+
+    assert status == 200
+    index = bundle["entry"].index(patient)
+    assert response["entry"][index]["response"]["status"] == "400 Bad Request"
+    assert "Patient" not in saved(db)
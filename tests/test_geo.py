@@ -0,0 +1,72 @@
+# tests/test_geo.py
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from app import geo
+from app.geo import get_zip_county_table, geo_summary, record_screening_geo
+from app.models import GeoRollup
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    GeoRollup.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+def screening(date="2024-03-05", safety=0, positives=0):
+    return SimpleNamespace(screening_date=datetime.fromisoformat(date), total_safety_score=safety,
+                           positive_screens_count=positives)
+
+def test_every_county_is_reachable_from_a_zip():
+    table = get_zip_county_table()
+    assert set(table.zip5.values()) == set(table.counties)
+    assert len(table.counties) == 62
+
+@pytest.mark.parametrize("zip_code,county_fips", [
+    ("10001", "36061"),   # Manhattan
+    ("11201", "36047"),   # Brooklyn
+    ("10301", "36085"),   # Staten Island
+    ("12008", "36093"),   # Schenectady, where the ZIP3 (120) row says Albany
+    ("10001-1234", "36061"),
+])
+def test_zip_lookup_prefers_the_exact_zip(zip_code, county_fips):
+    assert get_zip_county_table().county_for_zip(zip_code) == county_fips
+
+def test_unlisted_zip_falls_back_to_its_prefix_or_unknown():
+    table = get_zip_county_table()
+    assert table.county_for_zip("10099") == table.zip3["100"]
+    assert table.county_for_zip("99999") == geo.UNKNOWN_COUNTY
+    assert table.county_for_zip(None) == geo.UNKNOWN_COUNTY
+
+def test_rollups_accumulate_with_one_statement_per_screening(db):
+    member = SimpleNamespace(zip_code="10001")
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    record_screening_geo(db, member, screening(positives=2), {"food-insecurity", "housing-instability"})
+    record_screening_geo(db, member, screening(safety=12, positives=1), {"food-insecurity"})
+    db.commit()
+
+    assert len(statements) == 2
+    region = geo_summary(db, level="zip")["regions"][0]
+    assert region["zip_code"] == "10001"
+    assert region["county_fips"] == "36061"
+    assert region["screenings"] == 2
+    assert region["risk_levels"] == {"high": 1, "moderate": 1, "low": 0}
+    assert region["sdoh_categories"] == {"food-insecurity": 2, "housing-instability": 1}
+
+def test_rollups_without_upsert_support_match(db, monkeypatch):
+    monkeypatch.setattr(geo, "UPSERT_INSERTS", {})
+    member = SimpleNamespace(zip_code="11201")
+    record_screening_geo(db, member, screening(), set())
+    record_screening_geo(db, member, screening(), {"food-insecurity"})
+    db.commit()
+
+    counties = {region["county_fips"]: region for region in geo_summary(db)["regions"]}
+    assert counties["36047"]["screenings"] == 2
+    assert counties["36047"]["risk_levels"]["low"] == 2
+    assert counties["36047"]["sdoh_categories"] == {"food-insecurity": 1}
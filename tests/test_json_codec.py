@@ -0,0 +1,84 @@
+# tests/test_json_codec.py
+import importlib.util
+import json
+import sys
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+import pytest
+
+from app import json_codec
+from app.json_codec import FastJSONResponse
+
+class Trend(Enum):
+    WORSENED = "worsened"
+
+MEMBER_ID = uuid.UUID("6b1c2a52-1f0e-4b8e-9d0e-3a1f5c2d7e90")
+
+PAYLOAD = {
+    "member_id": MEMBER_ID,
+    "screened_at": datetime(2024, 3, 1, 9, 30, 15, 250000),
+    "birth_date": date(1985, 3, 15),
+    "trend": Trend.WORSENED,
+    "percentage": 33.3,
+    "ratio": 0.1 + 0.2,
+    "large": 1e20,
+    "score": Decimal("12.5"),
+    "categories": {"food-insecurity"},
+    "name": "Zoë",
+    2024: "non-string key"
+}
+
+EXPECTED = {
+    "member_id": str(MEMBER_ID),
+    "screened_at": "2024-03-01T09:30:15.250000",
+    "birth_date": "1985-03-15",
+    "trend": "worsened",
+    "percentage": 33.3,
+    "ratio": 0.1 + 0.2,
+    "large": 1e20,
+    "score": 12.5,
+    "categories": ["food-insecurity"],
+    "name": "Zoë",
+    "2024": "non-string key"
+}
+
+@pytest.fixture(scope="module")
+def stdlib_codec():
+    """A second copy of app.json_codec, imported as if orjson were not installed"""
+    spec = importlib.util.spec_from_file_location("app._json_codec_stdlib", json_codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    saved = sys.modules.get("orjson")
+    sys.modules["orjson"] = None
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            sys.modules.pop("orjson", None)
+        else:
+            sys.modules["orjson"] = saved
+    assert module.orjson is None
+    return module
+
+def test_orjson_encodes_uuid_datetime_and_floats():
+    pytest.importorskip("orjson")
+    assert json_codec.orjson is not None
+    assert json.loads(json_codec.dumps(PAYLOAD)) == EXPECTED
+
+def test_stdlib_fallback_encodes_the_same_values(stdlib_codec):
+    body = stdlib_codec.dumps(PAYLOAD)
+    assert json.loads(body) == EXPECTED
+    assert body.startswith(b'{"member_id":"6b1c2a52')  # compact separators
+    assert "Zoë".encode("utf-8") in body
+
+def test_stdlib_fallback_decoding(stdlib_codec):
+    assert stdlib_codec.loads(b'{"a": [1, 2.5]}') == {"a": [1, 2.5]}
+    with pytest.raises(stdlib_codec.DecodeError):
+        stdlib_codec.loads(b"{not json")
+
+def test_fast_json_response_renders_with_dumps():
+    response = FastJSONResponse({"member_id": MEMBER_ID, "screened_at": datetime(2024, 3, 1)})
+    assert response.headers["content-type"] == "application/json"
+    assert json.loads(response.body) == {"member_id": str(MEMBER_ID), "screened_at": "2024-03-01T00:00:00"}
@@ -0,0 +1,36 @@
+# tests/test_member_store.py
+from app.member_store import MemberStore
+
+def store_with(*screenings):
+    store = MemberStore()
+    store.add_result({
+        "members": [{"member_id": member_id, "name": member_id}
+                    for member_id in sorted({screening["member_id"] for screening in screenings})],
+        "screenings": list(screenings)
+    })
+    return store
+
+def screening(session_id, date, score, member_id="m1"):
+    return {"session_id": session_id, "member_id": member_id, "screening_date": date, "total_safety_score": score}
+
+def test_latest_screening_is_the_latest_by_date_not_by_arrival():
+    store = store_with(screening("s2", "2024-06-01", 14), screening("s1", "2024-01-01", 3))
+
+    assert store.latest_screening("m1")["session_id"] == "s2"
+    assert "m1" in store.condition_members["safety"]
+
+def test_an_undated_screening_does_not_displace_a_dated_one():
+    store = store_with(screening("s1", "2024-01-01", 3), screening("s2", None, 14))
+
+    assert store.latest_screening("m1")["session_id"] == "s1"
+    assert "m1" not in store.condition_members["safety"]
+
+def test_members_with_condition_lists_up_to_the_limit_and_counts_them_all():
+    store = store_with(*(screening(f"s{i}", "2024-01-01", 12, member_id=f"m{i:02d}") for i in range(30)))
+
+    count, listed = store.members_with_condition("safety", limit=5)
+
+    assert count == 30
+    assert [member["member_id"] for member in listed] == ["m00", "m01", "m02", "m03", "m04"]
+    count, listed = store.members_with_condition("safety", {"min_score": 13}, limit=5)
+    assert (count, listed) == (0, [])
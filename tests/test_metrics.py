@@ -0,0 +1,52 @@
+# tests/test_metrics.py
+import threading
+
+from app.metrics import MetricsRegistry, StageTimer
+
+def test_counters_from_every_thread_are_summed_and_labels_escaped():
+    registry = MetricsRegistry()
+    bundles = registry.counter("bundles_total", "Bundles by outcome", ("type", "outcome"))
+
+    threads = [threading.Thread(target=lambda: [bundles.inc("batch", "processed") for _ in range(100)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    bundles.inc('say "hi"\n', "failed")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP bundles_total Bundles by outcome", "# TYPE bundles_total counter"]
+    assert 'bundles_total{type="batch",outcome="processed"} 400' in lines
+    assert 'bundles_total{type="say \\"hi\\"\\n",outcome="failed"} 1' in lines
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    duration = registry.histogram("duration_seconds", "Duration", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        duration.observe(value, "/fhir/Bundle")
+
+    lines = registry.render().splitlines()
+    assert 'duration_seconds_bucket{route="/fhir/Bundle",le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{route="/fhir/Bundle",le="1"} 3' in lines
+    assert 'duration_seconds_bucket{route="/fhir/Bundle",le="+Inf"} 4' in lines
+    assert 'duration_seconds_sum{route="/fhir/Bundle"} 4.05' in lines
+    assert 'duration_seconds_count{route="/fhir/Bundle"} 4' in lines
+
+def test_unlabelled_metrics_and_collectors_are_always_exposed():
+    registry = MetricsRegistry()
+    registry.gauge("in_flight", "Requests in flight")
+    registry.add_collector(lambda: [("queue_age_seconds", "gauge", "Oldest queued bundle", {(): 2.5})])
+
+    lines = registry.render().splitlines()
+    assert "in_flight 0" in lines
+    assert "# TYPE queue_age_seconds gauge" in lines
+    assert "queue_age_seconds 2.5" in lines
+
+def test_stage_timer_laps_and_skips():
+    timer = StageTimer()
+    timer.lap("parse", observe=False)
+    timer.skip()
+    timer.lap("write", observe=False)
+
+    assert set(timer.durations) == {"parse", "write"}
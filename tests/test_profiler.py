@@ -0,0 +1,67 @@
+# tests/test_profiler.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import profiler
+
+class FakeRequest:
+    def __init__(self, connected_polls):
+        self.connected_polls = connected_polls
+
+    async def is_disconnected(self):
+        self.connected_polls -= 1
+        return self.connected_polls < 0
+
+def test_profile_returns_collapsed_stacks():
+    response = asyncio.run(profiler.profile(FakeRequest(100), seconds=0.2, hz=200, idle=True))
+
+    assert int(response.headers["X-Profile-Samples"]) > 0
+    assert b";" in response.body
+
+def test_profile_stops_when_the_client_goes_away(monkeypatch):
+    monkeypatch.setattr(profiler, "DISCONNECT_POLL_SECONDS", 0.05)
+
+    response = asyncio.run(profiler.profile(FakeRequest(1), seconds=30))
+
+    assert float(response.headers["X-Profile-Seconds"]) < 5
+    # The profiler is free again
+    profiler.profiler.start()
+    profiler.profiler.stop()
+
+@pytest.mark.parametrize("seconds,hz", [(0, 100), (-1, 100), (profiler.MAX_SECONDS + 1, 100),
+                                        (1, 0), (1, profiler.MAX_HZ + 1)])
+def test_profile_rejects_out_of_range_seconds_and_hz(seconds, hz):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(profiler.profile(FakeRequest(100), seconds=seconds, hz=hz))
+    assert raised.value.status_code == 400
+    # Nothing was started
+    profiler.profiler.start()
+    profiler.profiler.stop()
+
+def test_a_second_concurrent_profile_gets_409():
+    async def both():
+        first = asyncio.create_task(profiler.profile(FakeRequest(100), seconds=0.2, hz=50))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as raised:
+            await profiler.profile(FakeRequest(100), seconds=0.1)
+        return raised.value, await first
+
+    error, first = asyncio.run(both())
+    assert error.status_code == 409
+    assert int(first.headers["X-Profile-Samples"]) > 0
+
+def test_profiles_can_run_one_after_another():
+    for _ in range(2):
+        response = asyncio.run(profiler.profile(FakeRequest(100), seconds=0.1, hz=100, idle=True))
+        assert int(response.headers["X-Profile-Samples"]) > 0
+
+def test_profile_endpoint_validates_its_arguments():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer MookieWilson"}
+    assert client.get("/admin/profile?hz=0", headers=headers).status_code == 400
+    assert client.get(f"/admin/profile?seconds={profiler.MAX_SECONDS + 1}", headers=headers).status_code == 400
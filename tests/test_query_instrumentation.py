@@ -0,0 +1,130 @@
+# tests/test_query_instrumentation.py
+import logging
+
+import pytest
+from fastapi import BackgroundTasks, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app import query_instrumentation
+from app.config import settings
+from app.query_instrumentation import (
+    QueryInstrumentationMiddleware, RequestQueries, fingerprint, instrument_queries, report_request
+)
+
+def test_fingerprint_strips_values_of_every_paramstyle():
+    assert fingerprint("SELECT * FROM members WHERE id = 42 AND name = 'O''Brien'") == \
+        "SELECT * FROM members WHERE id = ? AND name = ?"
+    assert fingerprint("SELECT a FROM t WHERE x = %(x_1)s AND y = $2 AND z = :z") == \
+        "SELECT a FROM t WHERE x = ? AND y = ? AND z = ?"
+    assert fingerprint("SELECT a FROM t WHERE code IN (?, ?,\n ?)") == "SELECT a FROM t WHERE code IN (...)"
+
+@pytest.mark.parametrize("statement", [
+    "SELECT a FROM t2 WHERE x = ? AND code IN (?, ?)",
+    "SELECT a FROM t2 WHERE x = %s AND code IN (%s, %s, %s)",
+    "SELECT a FROM t2 WHERE x = %(x_1)s AND code IN (%(code_1_1)s)",
+    "SELECT a FROM t2 WHERE x = $1 AND code IN ($2, $3)",
+    "SELECT a FROM t2 WHERE x = :x AND code IN (:code_1, :code_2)",
+    "SELECT a FROM t2 WHERE x = 7 AND code IN ('LA6270-8', 'LA10066-1')",
+])
+def test_one_statement_has_one_fingerprint_whatever_the_paramstyle(statement):
+    # Digits inside identifiers are kept
+    assert fingerprint(statement) == "SELECT a FROM t2 WHERE x = ? AND code IN (...)"
+
+def test_fingerprint_keeps_postgres_casts():
+    assert fingerprint("SELECT id::text FROM members WHERE zip = %(zip)s::varchar") == \
+        "SELECT id::text FROM members WHERE zip = ?::varchar"
+
+def test_repeats_are_counted_per_fingerprint():
+    queries = RequestQueries()
+    for member_id in range(3):
+        queries.record(f"SELECT * FROM flags WHERE member_id = {member_id}", 0.001)
+    queries.record("SELECT count(*) FROM members", 0.001)
+
+    assert queries.count == 4
+    assert queries.most_repeated() == ("SELECT * FROM flags WHERE member_id = ?", 3)
+
+def test_background_tasks_are_not_charged_to_the_request(monkeypatch):
+    engine = create_engine("sqlite://")
+    instrument_queries(engine)
+    reports = []
+    monkeypatch.setattr(query_instrumentation, "report_request",
+                        lambda method, route, queries: reports.append(queries.count))
+
+    def cleanup():
+        with engine.connect() as conn:
+            for _ in range(5):
+                conn.execute(text("SELECT 1"))
+
+    app = FastAPI()
+    app.add_middleware(QueryInstrumentationMiddleware, debug_headers=True)
+
+    @app.post("/work")
+    def work(background_tasks: BackgroundTasks):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 2"))
+        background_tasks.add_task(cleanup)
+        return {}
+
+    response = TestClient(app).post("/work")
+
+    assert response.headers["X-Query-Count"] == "1"
+    assert reports == [1]
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_LOG_MAX_COUNT", 50)
+    monkeypatch.setattr(settings, "QUERY_LOG_MAX_MS", 500)
+    monkeypatch.setattr(settings, "QUERY_REPEAT_THRESHOLD", 5)
+
+def request_queries(repeats, others=0):
+    queries = RequestQueries()
+    for member_id in range(repeats):
+        queries.record(f"SELECT * FROM flags WHERE member_id = {member_id}", 0.001)
+    for table in range(others):
+        queries.record(f"SELECT * FROM table_{table}", 0.001)
+    return queries
+
+def test_report_flags_a_repeat_at_the_threshold(limits, caplog):
+    with caplog.at_level(logging.WARNING, logger=query_instrumentation.logger.name):
+        report_request("GET", "/members", request_queries(4))
+        assert not caplog.records
+
+        report_request("GET", "/members", request_queries(5))
+    assert caplog.records[-1].getMessage() == (
+        "GET /members ran 5 queries in 5 ms; 5x (likely N+1) SELECT * FROM flags WHERE member_id = ?")
+
+def test_report_logs_requests_over_the_count_or_time_limit(limits, caplog):
+    with caplog.at_level(logging.WARNING, logger=query_instrumentation.logger.name):
+        report_request("GET", "/overview", request_queries(2, others=49))
+        assert "(likely N+1)" not in caplog.records[-1].getMessage()
+        assert caplog.records[-1].getMessage().startswith("GET /overview ran 51 queries")
+
+        slow = RequestQueries()
+        slow.record("SELECT * FROM members", 0.75)
+        report_request("GET", "/export", slow)
+        assert caplog.records[-1].getMessage() == "GET /export ran 1 queries in 750 ms"
+
+@pytest.mark.parametrize("debug_headers", [True, False])
+def test_query_count_header(debug_headers):
+    engine = create_engine("sqlite://")
+    instrument_queries(engine)
+
+    app = FastAPI()
+    app.add_middleware(QueryInstrumentationMiddleware, debug_headers=debug_headers)
+
+    @app.get("/members")
+    async def members():
+        with engine.connect() as conn:
+            for member_id in range(3):
+                conn.execute(text("SELECT :id"), {"id": member_id})
+        return {}
+
+    response = TestClient(app).get("/members")
+
+    if debug_headers:
+        assert response.headers["X-Query-Count"] == "3"
+        assert float(response.headers["X-Query-Time-Ms"]) >= 0
+    else:
+        assert "X-Query-Count" not in response.headers
+        assert "X-Query-Time-Ms" not in response.headers
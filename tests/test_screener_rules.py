@@ -0,0 +1,99 @@
+# tests/test_screener_rules.py
+import json
+import os
+
+import pytest
+
+from app.bundle_extraction import extract_bundle
+from app.geo import positive_categories
+from app.screener_rules import (
+    AHC_CORE_QUESTIONS, AHC_HRSN_QUESTIONNAIRE, NO_DECISION, NY_HRSN_QUESTIONNAIRE, RulesRegistry, ScreenerRules,
+    builtin_rules, load_rules_file
+)
+
+from conftest import ROOT
+
+NY, AHC = builtin_rules()
+
+def test_safety_answers_score_and_unlisted_answers_decide_nothing():
+    assert NY.decide("95618-5", "LA6482-9")[:2] == (5, False)
+    assert NY.decide("95618-5", "LA6270-8")[0] == 1
+    assert NY.decide("95618-5", "LA-unknown") is NO_DECISION
+    assert NY.decide("unknown-question", "LA6270-8") is NO_DECISION
+
+def test_equal_decisions_share_one_tuple():
+    assert NY.decide("95617-7", "LA10066-1") is NY.decide("95616-9", "LA10066-1")
+
+def test_a_positive_answer_sets_every_category_of_its_question():
+    score, positive, bits, category = NY.decide("71802-3", "LA31995-6")
+    assert positive and score == 0
+    assert NY.category_names(bits) == {"housing-instability", "homelessness"}
+    assert category == NY.question_categories["71802-3"] == "housing-instability"
+    assert positive_categories([("71802-3", "LA31995-6")]) == {"housing-instability", "homelessness"}
+
+def test_extraction_reports_every_positive_category():
+    with open(os.path.join(ROOT, "hrsn_bundle_1_complete.json")) as f:
+        bundle = json.load(f)
+    response = next(entry["resource"] for entry in bundle["entry"]
+                    if entry["resource"]["resourceType"] == "QuestionnaireResponse")
+    living = next(item for item in response["item"] if item["linkId"] == "71802-3")
+    living["answer"] = [{"valueCoding": {"system": "http://loinc.org", "code": "LA31995-6"}}]
+
+    screening = extract_bundle(bundle)["screenings"][0]
+    assert {"housing-instability", "homelessness"} <= screening["positive_categories"]
+
+def test_ahc_core_is_the_ny_table_without_supplemental_questions():
+    assert AHC.questions == frozenset(AHC_CORE_QUESTIONS)
+    assert AHC.questionnaires == [AHC_HRSN_QUESTIONNAIRE]
+    assert AHC.decide("95618-5", "LA6482-9") == NY.decide("95618-5", "LA6482-9")
+    assert AHC.decide("96778-6", "LA31996-4") is NO_DECISION
+
+def write_rules(directory, name, version, score, filename=None):
+    path = os.path.join(directory, filename or f"{name}.json")
+    with open(path, "w") as f:
+        json.dump({"name": name, "version": version, "questionnaires": ["http://example.org/q|2"],
+                   "questions": {"q1": {"safety_question": True, "score_mapping": {"a1": score}}}}, f)
+    # Distinct mtimes even on filesystems with coarse timestamps
+    os.utime(path, ns=(version * 10**9, version * 10**9))
+    return path
+
+def test_load_rules_file_requires_a_name_and_questions(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text(json.dumps({"name": "broken"}))
+    with pytest.raises(ValueError):
+        load_rules_file(str(path))
+
+def test_registry_hot_reloads_changed_rule_files(tmp_path):
+    directory = str(tmp_path)
+    write_rules(directory, "custom", 1, 3)
+    registry = RulesRegistry(directory, check_seconds=0)
+    assert registry.reload()
+    assert not registry.reload()
+
+    rules = registry.for_questionnaire("http://example.org/q|2")
+    assert rules.key == "custom@1"
+    assert rules.decide("q1", "a1")[0] == 3
+    assert registry.for_questionnaire(NY_HRSN_QUESTIONNAIRE).key == "ny-hrsn-12@1"
+    assert registry.default().key == "ny-hrsn-12@1"
+
+    # A new version is picked up by the next lookup; the old one stays addressable
+    write_rules(directory, "custom", 2, 4, filename="custom-v2.json")
+    (tmp_path / "zz-broken.json").write_text("{not json")
+    assert registry.for_questionnaire("http://example.org/q").key == "custom@2"
+    assert registry.get("custom").decide("q1", "a1")[0] == 4
+    assert registry.get("custom", 1).decide("q1", "a1")[0] == 3
+
+def test_registry_checks_files_at_most_every_check_seconds(tmp_path):
+    directory = str(tmp_path)
+    write_rules(directory, "custom", 1, 3)
+    registry = RulesRegistry(directory, check_seconds=3600)
+    registry.reload()
+
+    write_rules(directory, "custom", 2, 4)
+    assert registry.get("custom").version == 1
+    assert registry.reload()
+    assert registry.get("custom").version == 2
+
+def test_an_unknown_default_falls_back_to_ny():
+    assert RulesRegistry(default_name="missing").default() is not None
+    assert RulesRegistry(default_name="ahc-hrsn").default().name == "ahc-hrsn"
@@ -0,0 +1,57 @@
+# tests/test_simple_main.py
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import simple_main
+from simple_main import Base, Member, ScreeningSession
+
+HEADERS = {"Authorization": "Bearer MookieWilson"}
+
+@pytest.fixture
+def client():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+
+    def test_db():
+        with Session(engine) as db:
+            yield db
+
+    simple_main.app.dependency_overrides[simple_main.get_db] = test_db
+    try:
+        yield TestClient(simple_main.app), engine
+    finally:
+        simple_main.app.dependency_overrides.pop(simple_main.get_db)
+        engine.dispose()
+
+@pytest.mark.parametrize("method,path,name", [
+    ("GET", "/members/not-a-uuid", "member_id"),
+    ("DELETE", "/members/12345", "member_id"),
+    ("GET", "/assessments/screening-001", "assessment_id"),
+])
+def test_a_malformed_id_is_a_400(client, method, path, name):
+    client, _ = client
+    response = client.request(method, path, headers=HEADERS)
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"{name} must be a UUID"
+
+def test_ids_are_looked_up_as_uuids(client):
+    client, engine = client
+    member_id, screening_id = uuid.uuid4(), uuid.uuid4()
+    with Session(engine) as db:
+        db.add(Member(id=member_id, fhir_id="patient-1", first_name="Ada"))
+        db.add(ScreeningSession(id=screening_id, member_id=member_id, screening_date=datetime(2024, 3, 1)))
+        db.commit()
+
+    assert client.get(f"/members/{member_id}", headers=HEADERS).status_code == 200
+    assert client.get(f"/assessments/{screening_id}", headers=HEADERS).status_code == 200
+
+    response = client.get(f"/members/{uuid.uuid4()}", headers=HEADERS)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Member not found"
+    assert client.get(f"/assessments/{uuid.uuid4()}", headers=HEADERS).status_code == 404
@@ -0,0 +1,77 @@
+# tests/test_sketches.py
+import itertools
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from app.models import ScreeningSketch
+from app.sketches import _load_partitions, approximate_dashboard, record_screening
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    ScreeningSketch.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+# Fixed ids, so HyperLogLog estimates do not vary from run to run
+_member_ids = itertools.count(1)
+
+def member(zip_code="10001"):
+    return SimpleNamespace(id=uuid.UUID(int=next(_member_ids)), zip_code=zip_code)
+
+def screening(score=0, positives=0, date="2024-03-05"):
+    return SimpleNamespace(screening_date=datetime.fromisoformat(date), total_safety_score=score,
+                           positive_screens_count=positives)
+
+def statements_on(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+def test_a_transactions_screenings_are_merged_into_each_partition_once(db):
+    statements = statements_on(db)
+    for _ in range(20):
+        record_screening(db, member(), screening(score=12, positives=1))
+    record_screening(db, member("12008"), screening())
+    assert statements == []
+    db.commit()
+
+    # New partitions are inserted (ON CONFLICT DO NOTHING) before the one locking read, then updated
+    verbs = [statement.split()[0].upper() for statement in statements]
+    assert verbs == ["INSERT", "SELECT", "UPDATE", "UPDATE"]
+    assert "ON CONFLICT" in statements[0].upper()
+    rows = {row.zip_code: row for row in db.query(ScreeningSketch)}
+    assert rows["10001"].screening_count == 20
+    assert rows["10001"].high_risk_count == 20
+    assert rows["12008"].screening_count == 1
+
+    record_screening(db, member(), screening())
+    db.commit()
+    assert db.query(ScreeningSketch).filter(ScreeningSketch.zip_code == "10001").one().screening_count == 21
+    assert approximate_dashboard(db)["total_members"]["estimate"] == 22
+
+def test_a_rolled_back_savepoint_drops_only_its_screenings(db):
+    record_screening(db, member(), screening())
+    savepoint = db.begin_nested()
+    record_screening(db, member(), screening())
+    record_screening(db, member("12008"), screening())
+    savepoint.rollback()
+    db.commit()
+
+    assert [(row.zip_code, row.screening_count) for row in db.query(ScreeningSketch)] == [("10001", 1)]
+
+def test_county_partitions_are_narrowed_in_sql(db):
+    for zip_code in ("10001", "11201", "12008", "12345"):
+        record_screening(db, member(zip_code), screening())
+    db.commit()
+    statements = statements_on(db)
+
+    rows = _load_partitions(db, county="36093")  # Schenectady
+
+    assert sorted(row.zip_code for row in rows) == ["12008", "12345"]
+    assert "substr" in statements[-1].lower()
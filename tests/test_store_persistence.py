@@ -0,0 +1,136 @@
+# tests/test_store_persistence.py
+import os
+
+import pytest
+
+pytest.importorskip("msgpack")
+
+from app.member_store import MemberStore
+from app.store_persistence import StorePersistence
+
+def result(index: int, score: int = 3):
+    member_id, session_id = f"member-{index}", f"session-{index}"
+    return {
+        "members": [{"member_id": member_id, "name": f"Member {index}", "address": "1 Main St, Albany, NY 12207"}],
+        "screenings": [{"session_id": session_id, "member_id": member_id, "total_safety_score": score,
+                        "screening_date": "2024-03-01"}],
+        "responses": [{"session_id": session_id, "question_code": "88122-7", "answer_code": "LA28397-0"}]
+    }
+
+def ingest(persistence, store, start, count):
+    for index in range(start, start + count):
+        item = result(index)
+        store.add_result(item)
+        persistence.append(store, item)
+
+def reopen(directory):
+    store = MemberStore()
+    persistence = StorePersistence(directory, snapshot_every=5)
+    info = persistence.load(store)
+    return persistence, store, info
+
+def test_log_replay_restores_the_store(tmp_path):
+    persistence, store, _ = reopen(str(tmp_path))
+    ingest(persistence, store, 0, 3)
+
+    restored = MemberStore()
+    info = StorePersistence(str(tmp_path)).load(restored)
+    assert info["log_records"] == 3
+    assert restored.stats() == store.stats()
+    assert restored.condition_members["food"] == {"member-0", "member-1", "member-2"}
+
+def test_snapshot_is_written_off_the_calling_thread(tmp_path, monkeypatch):
+    persistence, store, _ = reopen(str(tmp_path))
+    threads = []
+    write = persistence._write_snapshot
+
+    def recording_write(*args):
+        import threading
+        threads.append(threading.current_thread().name)
+        return write(*args)
+    monkeypatch.setattr(persistence, "_write_snapshot", recording_write)
+
+    ingest(persistence, store, 0, 7)
+    persistence.pending.result()
+    assert threads and threads[0].startswith("store-snapshot")
+    assert not os.path.exists(persistence.prev_log_path)
+
+    _, restored, info = reopen(str(tmp_path))
+    assert info["snapshot_loaded"]
+    assert info["log_records"] == 2
+    assert restored.stats() == store.stats()
+
+def test_failed_snapshot_keeps_records_for_replay(tmp_path, monkeypatch):
+    persistence, store, _ = reopen(str(tmp_path))
+
+    def failing_write(data, member_count):
+        raise OSError("disk full")
+    monkeypatch.setattr(persistence, "_write_snapshot", failing_write)
+    ingest(persistence, store, 0, 12)  # two failed snapshot attempts
+    persistence.pending.exception()
+    assert os.path.exists(persistence.prev_log_path)
+
+    _, restored, info = reopen(str(tmp_path))
+    assert not info["snapshot_loaded"]
+    assert info["log_records"] == 12
+    assert restored.stats() == store.stats()
+
+def test_close_snapshots_everything(tmp_path):
+    persistence, store, _ = reopen(str(tmp_path))
+    ingest(persistence, store, 0, 8)
+    persistence.close(store)
+
+    _, restored, info = reopen(str(tmp_path))
+    assert info["snapshot_loaded"] and info["log_records"] == 0
+    assert restored.stats() == store.stats()
+
+def test_torn_record_is_truncated(tmp_path):
+    persistence, store, _ = reopen(str(tmp_path))
+    ingest(persistence, store, 0, 2)
+    persistence.log_file.write(b"\x83\xa7members")  # half a record, as after a crash mid-append
+    persistence.log_file.flush()
+    persistence.log_file.close()
+    persistence.lock_file.close()
+
+    persistence, restored, info = reopen(str(tmp_path))
+    assert info["log_records"] == 2
+    ingest(persistence, restored, 2, 1)
+    _, again, info = reopen(str(tmp_path))
+    assert info["log_records"] == 3
+
+@pytest.mark.skipif(os.name != "posix", reason="writer lock uses flock")
+def test_second_process_does_not_write(tmp_path):
+    writer, store, info = reopen(str(tmp_path))
+    assert info["writer"]
+    ingest(writer, store, 0, 1)
+
+    reader, read_store, info = reopen(str(tmp_path))
+    assert not info["writer"]
+    assert len(read_store) == 1
+    ingest(reader, read_store, 1, 1)
+    assert os.path.getsize(writer.log_path) == writer.log_file.tell()
+
+def test_snapshot_does_not_share_live_containers():
+    store = MemberStore()
+    store.add_result(result(0))
+    data = store.snapshot()
+    store.add_result(result(1))
+    assert list(data["session_response_counts"]) == ["session-0"]
+    assert len(data["members"]) == 1
+
+def test_snapshot_of_a_restored_store_decodes_old_responses_off_the_calling_thread(tmp_path):
+    persistence, store, _ = reopen(str(tmp_path))
+    ingest(persistence, store, 0, 8)
+    persistence.close(store)
+
+    persistence, store, info = reopen(str(tmp_path))
+    assert info["snapshot_loaded"]
+    ingest(persistence, store, 8, 5)  # crosses snapshot_every
+    persistence.pending.result()
+    assert store._response_loader is not None
+    persistence.close(store)
+
+    _, restored, info = reopen(str(tmp_path))
+    assert info["log_records"] == 0
+    members = {member_id for member_id, _ in restored.responses_for_questions(["88122-7"])}
+    assert members == {f"member-{index}" for index in range(13)}
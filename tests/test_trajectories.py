@@ -0,0 +1,98 @@
+# tests/test_trajectories.py
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.models import MemberTrajectory
+from app.trajectories import record_screening_trajectory
+
+HEADERS = {"Authorization": "Bearer MookieWilson"}
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    MemberTrajectory.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+def screening(date, score):
+    return SimpleNamespace(id=uuid.uuid4(), screening_date=date, total_safety_score=score)
+
+def test_screenings_are_slotted_by_date_not_arrival(engine):
+    member = SimpleNamespace(id=uuid.uuid4())
+    june = screening(datetime(2024, 6, 1), 14)
+    march = screening(datetime(2024, 3, 1), 6)
+    january = screening(datetime(2024, 1, 1), 2)
+
+    with Session(engine) as db:
+        record_screening_trajectory(db, member, june, {"food-insecurity"})
+        trajectory = db.query(MemberTrajectory).one()
+        assert trajectory.trend == "baseline"
+        assert trajectory.previous_screening_id is None
+
+        # Older than the latest: back-filled as the comparison point
+        record_screening_trajectory(db, member, january, set())
+        assert (trajectory.latest_screening_id, trajectory.previous_screening_id) == (june.id, january.id)
+
+        # Between the two: replaces the older comparison point
+        record_screening_trajectory(db, member, march, {"housing-instability"})
+        assert (trajectory.latest_screening_id, trajectory.previous_screening_id) == (june.id, march.id)
+        assert trajectory.safety_score_delta == 8
+        assert trajectory.days_between_screenings == 92
+        assert trajectory.trend == "worsened"
+
+        # Older than both: only counted
+        record_screening_trajectory(db, member, screening(datetime(2023, 1, 1), 20), set())
+        assert (trajectory.latest_screening_id, trajectory.previous_screening_id) == (june.id, march.id)
+        assert trajectory.screening_count == 4
+        assert trajectory.resolved_categories == '["housing-instability"]'
+        assert trajectory.new_categories == '["food-insecurity"]'
+
+def test_a_newer_screening_pushes_the_latest_back(engine):
+    member = SimpleNamespace(id=uuid.uuid4())
+    first = screening(datetime(2024, 1, 1), 12)
+    second = screening(datetime(2024, 2, 1), 4)
+
+    with Session(engine) as db:
+        record_screening_trajectory(db, member, first, {"food-insecurity"})
+        record_screening_trajectory(db, member, second, set())
+        trajectory = db.query(MemberTrajectory).one()
+        assert (trajectory.latest_screening_id, trajectory.previous_screening_id) == (second.id, first.id)
+        assert trajectory.safety_score_delta == -8
+        assert trajectory.trend == "improved"
+
+def test_trajectory_endpoint(engine):
+    from fastapi.testclient import TestClient
+    from app.database import get_db
+    from app.main import app
+
+    member = SimpleNamespace(id=uuid.uuid4())
+    with Session(engine) as db:
+        record_screening_trajectory(db, member, screening(datetime(2024, 1, 1), 3), set())
+        db.commit()
+
+    def test_db():
+        with Session(engine) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = test_db
+    try:
+        client = TestClient(app)
+        response = client.get(f"/members/{member.id}/trajectory", headers=HEADERS)
+        assert response.status_code == 200
+        assert response.json()["trend"] == "baseline"
+
+        response = client.get(f"/members/{uuid.uuid4()}/trajectory", headers=HEADERS)
+        assert response.status_code == 404
+        assert response.json()["detail"] == "No screenings recorded for this member"
+
+        response = client.get("/members/not-a-uuid/trajectory", headers=HEADERS)
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Member not found"
+    finally:
+        app.dependency_overrides.pop(get_db)
@@ -0,0 +1,62 @@
+# tests/test_waiver_report.py
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from app.models import Base, EligibilityAssessment, ScreeningSession, WaiverReportJob
+from app.waiver_report import STALE_AFTER, WaiverReportBusy, claim_job, get_or_create_job, run_waiver_report
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+def add_screening(db, member_id, date, created_at=None):
+    db.add(ScreeningSession(id=uuid.uuid4(), member_id=member_id, screening_date=date, screening_complete=True,
+                            positive_screens_count=0, total_safety_score=0,
+                            created_at=created_at or datetime(2024, 11, 2)))
+
+def test_report_counts_eligible_members_once_and_reports_undated_screenings(db):
+    member_id = uuid.uuid4()
+    add_screening(db, member_id, datetime(2024, 10, 3))
+    add_screening(db, member_id, None)
+    for day in (5, 20):
+        db.add(EligibilityAssessment(id=uuid.uuid4(), member_id=member_id, assessment_date=datetime(2024, 10, day),
+                                     eligibility_status="eligible", enhanced_services_eligible=False))
+    db.commit()
+
+    measures = run_waiver_report(db, "2024Q4")["measures"]
+
+    assert measures["eligibility_assessments"] == 2
+    assert measures["eligible_members_assessed"]["estimate"] == 1
+    assert measures["screenings_completed"] == 1
+    assert measures["screenings_without_date"] == 1
+
+def test_days_without_rows_are_not_checkpointed(db):
+    add_screening(db, uuid.uuid4(), datetime(2024, 10, 3))
+    db.commit()
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+
+    run_waiver_report(db, "2024Q4")
+
+    # Claim, the day's batch, moving past that day, completion - not one per day and stage
+    assert len(commits) <= 6
+
+def test_only_one_worker_claims_a_job(db):
+    job = get_or_create_job(db, "2024q4")
+
+    assert claim_job(db, job)
+    assert not claim_job(db, job)
+    with pytest.raises(WaiverReportBusy):
+        run_waiver_report(db, "2024Q4")
+
+    job.updated_at = datetime.utcnow() - STALE_AFTER - timedelta(minutes=1)
+    db.commit()
+    assert claim_job(db, job)
+    assert db.query(WaiverReportJob).one().status == "running"
@@ -0,0 +1,20 @@
+# tests/test_web_main.py
+import pytest
+from fastapi.testclient import TestClient
+
+from app.web_main import app
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+@pytest.mark.parametrize("page", ["two", "1.5", [1], {"n": 1}])
+def test_chatbot_rejects_a_non_integer_page(client, page):
+    response = client.post("/api/chatbot", json={"question": "show me an overview", "page": page})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "page must be an integer"
+
+@pytest.mark.parametrize("page", [None, 2, "3"])
+def test_chatbot_accepts_integer_pages(client, page):
+    response = client.post("/api/chatbot", json={"question": "show me an overview", "page": page})
+    assert response.status_code == 200